@@ -12,7 +12,9 @@ class AudioAnalysisResult(BaseModel):
 
 class FrameAnalysisResult(BaseModel):
     """Результаты анализа кадров для сцены"""
-    embeddings: Optional[List[List[float]]] = None
+    embeddings_fp16_b64: Optional[str] = None  # Эмбеддинги в float16, закодированные в base64
+    embedding_shape: Optional[List[int]] = None
+    embeddings: Optional[List[List[float]]] = None  # Устаревший формат (список чисел)
     num_frames: int = 0
     frame_info: Optional[List[Dict[str, Any]]] = None
     embedding_model: Optional[str] = None
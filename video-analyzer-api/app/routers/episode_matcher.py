@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends
 from typing import List, Dict, Any, Optional
-import json
+import orjson
 import os
 import logging
 from datetime import datetime
@@ -37,8 +37,8 @@ def load_characters(series_id: str) -> List[Character]:
     try:
         data_root = get_data_root()
         characters_path = os.path.join(data_root, "series/characters.json")
-        with open(characters_path, "r", encoding="utf-8") as f:
-            characters_data = json.load(f)
+        with open(characters_path, "rb") as f:
+            characters_data = orjson.loads(f.read())
         
         # Фильтруем персонажей по series_id
         filtered_characters = [
@@ -61,8 +61,8 @@ def load_episode(episode_id: str) -> Dict[str, Any]:
     try:
         data_root = get_data_root()
         episodes_path = os.path.join(data_root, "series/episodes.json")
-        with open(episodes_path, "r", encoding="utf-8") as f:
-            episodes_data = json.load(f)
+        with open(episodes_path, "rb") as f:
+            episodes_data = orjson.loads(f.read())
         
         # Находим нужный эпизод по ID
         for episode in episodes_data:
@@ -79,8 +79,8 @@ def load_scenes() -> List[Dict[str, Any]]:
     try:
         data_root = get_data_root()
         scenes_path = os.path.join(data_root, "scenes-with-audio/scenes.json")
-        with open(scenes_path, "r", encoding="utf-8") as f:
-            scenes_data = json.load(f)
+        with open(scenes_path, "rb") as f:
+            scenes_data = orjson.loads(f.read())
         return scenes_data
     except Exception as e:
         logger.error(f"Ошибка при загрузке сцен: {str(e)}")
@@ -155,8 +155,8 @@ async def match_episode_to_scenes(episode_id: str) -> Dict[str, Any]:
     
     # Сохраняем результат в файл
     result_path = os.path.join(result_dir, f"{episode_id}.json")
-    with open(result_path, "w", encoding="utf-8") as f:
-        json.dump(match_result, f, ensure_ascii=False, indent=2)
+    with open(result_path, "wb") as f:
+        f.write(orjson.dumps(match_result, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
     
     logger.info(f"Сопоставление для эпизода {episode_id} сохранено в {result_path}")
     
@@ -1,11 +1,11 @@
 import os
 import logging
-import json
+import orjson
 from typing import Dict, Any, List, Optional
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
-from app.services.frame_analyzer import FrameAnalyzer
+from app.services.frame_analyzer import FrameAnalyzer, serialize_frame_analysis
 
 router = APIRouter(
     prefix="/api/frame-analyzer",
@@ -52,8 +52,8 @@ def load_scenes() -> List[Dict[str, Any]]:
             logger.error(f"Файл сцен не найден: {scenes_path}")
             return []
             
-        with open(scenes_path, "r", encoding="utf-8") as f:
-            scenes_data = json.load(f)
+        with open(scenes_path, "rb") as f:
+            scenes_data = orjson.loads(f.read())
             
         logger.info(f"Загружено {len(scenes_data)} сцен из {scenes_path}")
         return scenes_data
@@ -78,8 +78,8 @@ def save_scenes_with_frames(scenes_with_frames: List[Dict[str, Any]], output_fil
         os.makedirs(output_dir, exist_ok=True)
         
         output_path = os.path.join(output_dir, f"{output_filename}.json")
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(scenes_with_frames, f, ensure_ascii=False, indent=2)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(scenes_with_frames, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
             
         logger.info(f"Сохранены результаты анализа кадров в {output_path}")
         return output_path
@@ -143,7 +143,8 @@ async def analyze_frames(request: FrameAnalysisRequest) -> FrameAnalysisResponse
                 
                 # Добавляем результаты анализа к сцене
                 scene_with_frames = scene.copy()
-                scene_with_frames['frame_analysis'] = frame_analysis_result
+                # Эмбеддинги кодируются в float16/base64 только здесь, на границе сериализации
+                scene_with_frames['frame_analysis'] = serialize_frame_analysis(frame_analysis_result)
                 scenes_with_frames.append(scene_with_frames)
                 
                 # Считаем общее количество проанализированных кадров
@@ -1,4 +1,4 @@
-import json
+import orjson
 import os
 import logging
 import time
@@ -80,8 +80,8 @@ def save_results(scenes: List[Dict[str, Any]], video_name: str):
         cleaned_scenes = [clean_scene_data(scene) for scene in scenes]
         
         output_file = os.path.join(output_dir, f"{video_name}.json")
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(cleaned_scenes, f, ensure_ascii=False, indent=2)
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(cleaned_scenes, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
         logger.info(f"Результаты сохранены в {output_file}")
     except Exception as e:
         logger.error(f"Ошибка при сохранении результатов: {str(e)}")
@@ -98,8 +98,8 @@ def load_scenes(scene_ids=None) -> List[Dict[str, Any]]:
         data_root = get_data_root()
         scenes_path = os.path.join(data_root, "scenes-with-frames/frames_360.json")
         logger.info(f"Загрузка данных сцен из {scenes_path}")
-        with open(scenes_path, "r", encoding="utf-8") as f:
-            scenes_data = json.load(f)
+        with open(scenes_path, "rb") as f:
+            scenes_data = orjson.loads(f.read())
         
         # Проверяем структуру сцен
         valid_scenes = []
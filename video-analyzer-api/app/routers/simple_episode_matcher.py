@@ -1,4 +1,4 @@
-import json
+import orjson
 import os
 import logging
 from datetime import datetime
@@ -35,8 +35,8 @@ def load_episode(episode_id: str) -> Dict[str, Any]:
     try:
         data_root = get_data_root()
         episodes_path = os.path.join(data_root, "series/episodes.json")
-        with open(episodes_path, "r", encoding="utf-8") as f:
-            episodes_data = json.load(f)
+        with open(episodes_path, "rb") as f:
+            episodes_data = orjson.loads(f.read())
         
         # Находим нужный эпизод по ID
         for episode in episodes_data:
@@ -54,8 +54,8 @@ def load_scenes() -> List[Dict[str, Any]]:
     try:
         data_root = get_data_root()
         scenes_path = os.path.join(data_root, "scenes-with-frames/frames_360.json")
-        with open(scenes_path, "r", encoding="utf-8") as f:
-            scenes_data = json.load(f)
+        with open(scenes_path, "rb") as f:
+            scenes_data = orjson.loads(f.read())
         return scenes_data
     except Exception as e:
         logger.error(f"Ошибка при загрузке сцен: {str(e)}")
@@ -112,8 +112,8 @@ async def match_episode_to_scenes(episode_id: str) -> Dict[str, Any]:
         result_dir = os.path.join(data_root, "results/simple-episode-matches")
         os.makedirs(result_dir, exist_ok=True)
         result_path = os.path.join(result_dir, f"{episode_id}.json")
-        with open(result_path, "w", encoding="utf-8") as f:
-            json.dump(match_result, f, ensure_ascii=False, indent=2)
+        with open(result_path, "wb") as f:
+            f.write(orjson.dumps(match_result, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
         
         logger.info(f"Сопоставление для эпизода {episode_id} выполнено успешно и сохранено в {result_path}")
         
@@ -1,4 +1,4 @@
-import json
+import orjson
 import os
 import logging
 from fastapi import APIRouter, HTTPException
@@ -54,8 +54,8 @@ def load_scene_descriptions(video_name: str, max_scenes: Optional[int] = None) -
         data_root = get_data_root()
         file_path = os.path.join(data_root, "scenes-with-summary", f"{video_name}.json")
         
-        with open(file_path, 'r', encoding='utf-8') as f:
-            scenes = json.load(f)
+        with open(file_path, "rb") as f:
+            scenes = orjson.loads(f.read())
             
         # Создаем словарь {scene_id: description}
         descriptions = {scene['id']: scene['description'] for scene in scenes}
@@ -90,14 +90,18 @@ async def match_stories(request: StoryMatchRequest):
                 "matches": {}
             }
         
-        # Сравниваем каждую сцену с каждым сюжетом
+        # Сравниваем каждую сцену с каждым сюжетом одним батчевым вызовом модели
+        pairs = [
+            (description, story)
+            for description in scene_descriptions.values()
+            for story in request.stories
+        ]
+        scores = story_matcher_service.calculate_similarities(pairs)
+        
         matches = {}
-        for scene_id, description in scene_descriptions.items():
-            scene_matches = {}
-            for story in request.stories:
-                score = story_matcher_service.calculate_similarity(description, story)
-                scene_matches[story] = score
-            matches[scene_id] = scene_matches
+        for i, scene_id in enumerate(scene_descriptions):
+            scene_scores = scores[i * len(request.stories):(i + 1) * len(request.stories)]
+            matches[scene_id] = {story: float(score) for story, score in zip(request.stories, scene_scores)}
         
         logger.info(f"Сравнение сюжетов успешно завершено для {len(matches)} сцен")
         
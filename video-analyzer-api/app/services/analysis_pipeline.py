@@ -1,3 +1,4 @@
+import hashlib
 import os
 import time
 import json
@@ -8,12 +9,15 @@ from typing import Dict, List, Any, Callable, Optional
 from app.services.video_metadata_extractor import VideoMetadataExtractor
 from app.services.scene_detector import SceneDetector
 from app.services.audio_analyzer import AudioAnalyzer
-from app.services.frame_analyzer import FrameAnalyzer
+from app.services.frame_analyzer import FrameAnalyzer, serialize_scenes_with_frames
 from app.services.storyline_grouper import StorylineGrouper
-from app.services.task_manager import save_scenes_with_audio, save_scenes_with_frames
+from app.services.task_manager import save_scenes_with_audio, save_scenes_with_frames, load_saved_result
 
 logger = logging.getLogger(__name__)
 
+# Размер фрагментов в начале и в конце файла, по которым вычисляется ключ содержимого видео
+_CONTENT_KEY_CHUNK_SIZE = 4 * 1024 * 1024
+
 class AnalysisPipeline:
     """
     Координатор для выполнения анализа видео.
@@ -27,6 +31,8 @@ class AnalysisPipeline:
         self.audio_analyzer = AudioAnalyzer()
         self.frame_analyzer = FrameAnalyzer()
         self.storyline_grouper = StorylineGrouper()
+        # Повторно использовать сохраненный результат задачи, если видео с тех пор не изменилось
+        self.reuse_results = os.getenv("ANALYSIS_REUSE_RESULTS", "true").lower() == "true"
         
         logger.info("Initialized AnalysisPipeline with default analyzers")
     
@@ -54,6 +60,15 @@ class AnalysisPipeline:
             if not self._validate_video_file(video_path, task_id, status_updater):
                 return {}
             
+            # Если это видео с теми же параметрами уже анализировалось, возвращаем сохраненный результат
+            content_key = self._content_key(video_path)
+            if self.reuse_results:
+                saved_result = load_saved_result(task_id)
+                if saved_result and saved_result.get("metadata", {}).get("content_key") == content_key:
+                    logger.info(f"Using saved result for task {task_id}: video content unchanged")
+                    status_updater(task_id, "processing", "Анализ завершен (использован сохраненный результат)", 1.0)
+                    return saved_result
+            
             # Последовательно выполняем этапы анализа
             metadata = self._extract_metadata(video_path, task_id, status_updater)
             scenes = self._detect_scenes(video_path, task_id, status_updater)
@@ -73,7 +88,7 @@ class AnalysisPipeline:
             
             # Сохраняем результаты анализа кадров сцен
             if save_scenes_with_frames is not None:
-                save_scenes_with_frames(task_id, scenes_with_frames)
+                save_scenes_with_frames(task_id, serialize_scenes_with_frames(scenes_with_frames))
             
             # Группируем сцены в сюжетные линии
             storylines = self._group_into_storylines(scenes_with_frames, num_storylines, task_id, status_updater)
@@ -83,7 +98,7 @@ class AnalysisPipeline:
             analysis_time = end_time - start_time
             
             final_result = self._create_final_result(
-                video_path, metadata, scenes, storylines, analysis_time
+                video_path, metadata, scenes, storylines, analysis_time, content_key
             )
             
             # Обновляем статус как завершено
@@ -96,6 +111,20 @@ class AnalysisPipeline:
             status_updater(task_id, "error", f"Ошибка анализа: {str(e)}", 0.0)
             return {}
     
+    def _content_key(self, video_path: str) -> str:
+        """
+        Ключ содержимого видео: SHA-256 от размера файла и его первых и последних 4 МБ.
+        Читается не больше 8 МБ независимо от длины видео
+        """
+        size = os.path.getsize(video_path)
+        digest = hashlib.sha256(str(size).encode())
+        with open(video_path, 'rb') as f:
+            digest.update(f.read(_CONTENT_KEY_CHUNK_SIZE))
+            if size > _CONTENT_KEY_CHUNK_SIZE:
+                f.seek(max(_CONTENT_KEY_CHUNK_SIZE, size - _CONTENT_KEY_CHUNK_SIZE))
+                digest.update(f.read(_CONTENT_KEY_CHUNK_SIZE))
+        return digest.hexdigest()
+    
     def _validate_video_file(self, video_path: str, task_id: str, 
                             status_updater: Callable) -> bool:
         """Проверяет существование видеофайла"""
@@ -200,26 +229,31 @@ class AnalysisPipeline:
         status_updater(task_id, "processing", "Анализ кадров сцен...", 0.6)
         total_scenes = len(scenes)
         
+        # Декодирование кадров следующей сцены идет параллельно с созданием эмбеддингов текущей
+        scene_ids = [scene.get('id', f"scene_{i+1}") for i, scene in enumerate(scenes)]
+        scene_inputs = [
+            {
+                'video_path': video_path,
+                'start_time': scene['start_time'],
+                'end_time': scene['end_time'],
+                'task_id': task_id,
+                'scene_id': scene_id
+            }
+            for scene, scene_id in zip(scenes, scene_ids)
+        ]
+        frame_results = self.frame_analyzer.analyze_many(scene_inputs)
+        
         for i, scene in enumerate(scenes):
             # Обновляем статус для каждой сцены
             scene_progress = 0.6 + (0.2 * (i / total_scenes))
             status_updater(task_id, "processing", f"Анализ кадров сцены {i+1}/{total_scenes}...", scene_progress)
             
             try:
-                # Получаем или создаем scene_id
-                scene_id = scene.get('id', f"scene_{i+1}")
+                scene_id = scene_ids[i]
                 
-                # Анализируем кадры сцены
+                # Получаем результат анализа кадров сцены
                 logger.info(f"Analyzing frames for scene {scene_id}: {scene['start_time']:.2f}s - {scene['end_time']:.2f}s")
-                scene_frames_input = {
-                    'video_path': video_path,
-                    'start_time': scene['start_time'],
-                    'end_time': scene['end_time'],
-                    'task_id': task_id,
-                    'scene_id': scene_id
-                }
-                
-                scene_frames_result = self.frame_analyzer.analyze(scene_frames_input)
+                scene_frames_result = next(frame_results)
                 
                 # Добавляем результаты анализа кадров к сцене
                 scene_with_frames = scene.copy()
@@ -258,7 +292,7 @@ class AnalysisPipeline:
     
     def _create_final_result(self, video_path: str, metadata: Dict[str, Any], 
                             scenes: List[Dict[str, Any]], storylines: List[Dict[str, Any]],
-                            analysis_time: float) -> Dict[str, Any]:
+                            analysis_time: float, content_key: str) -> Dict[str, Any]:
         """Создает итоговый результат анализа"""
         return {
             "video_filename": os.path.basename(video_path),
@@ -269,6 +303,7 @@ class AnalysisPipeline:
             "metadata": {
                 "fps": metadata.get('fps', 0),
                 "size": metadata.get('size', [0, 0]),
-                "analysis_time_seconds": analysis_time
+                "analysis_time_seconds": analysis_time,
+                "content_key": content_key
             }
         } 
\ No newline at end of file
@@ -1,20 +1,55 @@
 # app/services/blip2_replicate_client.py
 
 import base64
+import hashlib
+import io
 import os
 import logging
+import shelve
+import threading
+import time
 import replicate
+from PIL import Image
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+def _get_data_root() -> str:
+    """
+    Возвращает корневую директорию для данных, учитывая разницу
+    между локальной разработкой и Docker окружением
+    """
+    if os.environ.get("SHARED_DATA_DIR"):
+        return os.environ["SHARED_DATA_DIR"]
+    
+    # Проверяем, есть ли путь в Docker
+    docker_path = "/app/shared-data"
+    if os.path.exists(docker_path):
+        return docker_path
+    
+    # Возвращаем относительный путь для локальной разработки
+    return "../shared-data"
+
 class Blip2ReplicateClient:
     def __init__(self):
         # ID модели BLIP2 на Replicate
         self.model_version = "salesforce/blip:2e1dddc8621f72155f24cf2e0adbde548458d3cab9f00c0139eea840d0ac4746"
         
-        # Кэш для результатов
-        self.cache = {}
+        # Кэш результатов по содержимому изображения и промпту (сохраняется на диск между запусками).
+        # Открывается при первом обращении; если каталог недоступен для записи, кэш хранится в памяти
+        self.cache_path = os.getenv(
+            "BLIP2_CACHE_PATH",
+            os.path.join(_get_data_root(), "cache", "blip2_descriptions")
+        )
+        self.cache = None
+        # shelve не потокобезопасен, а запросы к API выполняются из нескольких потоков
+        self._cache_lock = threading.Lock()
+        
+        # Повторные попытки при превышении лимита запросов (HTTP 429) при параллельной генерации
+        self.max_retries = int(os.getenv("REPLICATE_MAX_RETRIES", "3"))
+        
+        # Максимальный размер стороны изображения, отправляемого в API (модель все равно уменьшает вход до 384px)
+        self.max_image_size = int(os.getenv("BLIP2_MAX_IMAGE_SIZE", "768"))
 
     def run(self, image_path: str, prompt: str = "Describe this image", caption: str = "") -> str:
         """
@@ -27,17 +62,24 @@ class Blip2ReplicateClient:
         Returns:
             str: Сгенерированное описание или сообщение об ошибке
         """
-        # Проверяем кэш
-        cache_key = f"{image_path}_{prompt}"
-        if cache_key in self.cache:
+        try:
+            logger.info(f"Открытие изображения: {image_path}")
+            with open(image_path, "rb") as f:
+                image_data = f.read()
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке изображения: {str(e)}")
+            return "Ошибка внешнего API: Ошибка при подготовке изображения"
+        
+        # Проверяем кэш: одинаковые кадры (повторный запуск, общие кадры сцен) не отправляем повторно
+        cache_key = f"{hashlib.blake2b(image_data, digest_size=16).hexdigest()}:{prompt}:{caption}"
+        with self._cache_lock:
+            cached = self._get_cache().get(cache_key)
+        if cached is not None:
             logger.info(f"Используем кэшированное описание для {image_path}")
-            return self.cache[cache_key]
+            return cached
             
         try:
-            logger.info(f"Открытие изображения: {image_path}")
-            base64_image = self.prepare_image(image_path)
-            if not base64_image:
-                raise Exception("Ошибка при подготовке изображения")
+            base64_image = self._encode_image(image_data)
             
             logger.info("Запрос на генерацию описания")
             
@@ -50,7 +92,7 @@ class Blip2ReplicateClient:
             }
             
             # Отправляем запрос
-            response = replicate.run(self.model_version, input=inputs)
+            response = self._run_with_retry(inputs)
             
             # Обрабатываем результат
             if isinstance(response, list) and len(response) > 0:
@@ -59,13 +101,41 @@ class Blip2ReplicateClient:
                 result = str(response)
                 
             # Сохраняем в кэш
-            self.cache[cache_key] = result
+            with self._cache_lock:
+                cache = self._get_cache()
+                cache[cache_key] = result
+                if isinstance(cache, shelve.Shelf):
+                    cache.sync()
             
             return result
         except Exception as e:
             logger.error(f"Ошибка при обращении к Replicate: {str(e)}")
             return f"Ошибка внешнего API: {str(e)}"
             
+    def _get_cache(self):
+        """Открывает дисковый кэш описаний при первом обращении (вызывается под _cache_lock)"""
+        if self.cache is None:
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                self.cache = shelve.open(self.cache_path)
+            except Exception as e:
+                logger.warning(f"Не удалось открыть дисковый кэш описаний {self.cache_path}, кэш хранится в памяти: {str(e)}")
+                self.cache = {}
+        return self.cache
+    
+    def _run_with_retry(self, inputs: dict):
+        """Выполняет запрос к Replicate, повторяя его с экспоненциальной задержкой при HTTP 429"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return replicate.run(self.model_version, input=inputs)
+            except Exception as e:
+                rate_limited = getattr(e, "status", None) == 429 or "429" in str(e)
+                if not rate_limited or attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Превышен лимит запросов Replicate, повтор через {delay} с ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+            
     def prepare_image(self, image_path: str) -> Optional[str]:
         """
         Подготавливает изображение для отправки в API (кодирует в base64)
@@ -81,9 +151,32 @@ class Blip2ReplicateClient:
             with open(image_path, "rb") as f:
                 image_data = f.read()
 
-            base64_image = base64.b64encode(image_data).decode("utf-8")
-            mime_type = "image/jpeg"
-            return f"data:{mime_type};base64,{base64_image}"
+            return self._encode_image(image_data)
         except Exception as e:
             logger.error(f"Ошибка при подготовке изображения: {str(e)}")
             return None
+
+    def _downscale_image(self, image_data: bytes) -> bytes:
+        """Уменьшает JPEG до max_image_size по большей стороне, декодируя его сразу в уменьшенном масштабе"""
+        try:
+            with Image.open(io.BytesIO(image_data)) as image:
+                if max(image.size) <= self.max_image_size:
+                    return image_data
+                # draft позволяет libjpeg декодировать изображение сразу с уменьшением (до доступа к пикселям)
+                image.draft("RGB", (self.max_image_size, self.max_image_size))
+                image = image.convert("RGB")
+                image.thumbnail((self.max_image_size, self.max_image_size))
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=90)
+                return buffer.getvalue()
+        except Exception as e:
+            logger.warning(f"Не удалось уменьшить изображение, отправляется оригинал: {str(e)}")
+            return image_data
+
+    def _encode_image(self, image_data: bytes) -> str:
+        """Кодирует содержимое JPEG-файла в data URI"""
+        if self.max_image_size > 0:
+            image_data = self._downscale_image(image_data)
+        base64_image = base64.b64encode(image_data).decode("utf-8")
+        mime_type = "image/jpeg"
+        return f"data:{mime_type};base64,{base64_image}"
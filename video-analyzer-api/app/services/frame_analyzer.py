@@ -1,10 +1,17 @@
 import os
+import base64
+import hashlib
 import logging
 import tempfile
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import torch
+import torch.nn.functional as F
 import numpy as np
-from typing import Dict, List, Any, Optional, Tuple
-from moviepy.editor import VideoFileClip
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 import cv2
 from transformers import CLIPProcessor, CLIPModel
 from datetime import datetime
@@ -19,6 +26,113 @@ logger = logging.getLogger(__name__)
 _SHARED_DATA_DIR = "/app/shared-data"
 _SCENES_WITH_FRAMES_DIR = os.path.join(_SHARED_DATA_DIR, "scenes-with-frames", "frames")
 
+# Максимальное количество одновременно открытых видеофайлов
+_MAX_OPEN_VIDEOS = 4
+
+# Максимальный промежуток между кадрами (в секундах), который проходится последовательным
+# декодированием вместо перехода (seek) к нужной позиции
+_MAX_SEQUENTIAL_GAP_SECONDS = 5.0
+
+# Максимальное количество кадров, извлекаемых из одной сцены
+_MAX_FRAMES_PER_SCENE = 10
+
+# Качество JPEG при сохранении кадров
+_JPEG_QUALITY = 85
+
+# Глубина очереди между декодированием кадров и GPU-этапом (ограничивает память под кадры)
+_PIPELINE_QUEUE_DEPTH = 2
+_PIPELINE_END = object()
+
+# Загруженные модели CLIP, общие для всех экземпляров FrameAnalyzer:
+# (model_name, device, compute_type, weights_dtype) -> (processor, image_processor, model, encode_images)
+_MODEL_CACHE: Dict[tuple, tuple] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
+# Соответствие строковых типов вычислений типам данных torch
+_TORCH_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16
+}
+
+def encode_embeddings(embeddings: Optional[np.ndarray]) -> Dict[str, Any]:
+    """
+    Кодирует эмбеддинги кадров для передачи в JSON: float16 в base64 вместе с формой массива.
+    
+    Args:
+        embeddings: Массив эмбеддингов кадров
+        
+    Returns:
+        Словарь с полями embeddings_fp16_b64 и embedding_shape
+    """
+    if not isinstance(embeddings, np.ndarray):
+        return {"embeddings_fp16_b64": None, "embedding_shape": None}
+    
+    return {
+        "embeddings_fp16_b64": base64.b64encode(embeddings.astype(np.float16).tobytes()).decode("ascii"),
+        "embedding_shape": list(embeddings.shape)
+    }
+
+def serialize_frame_analysis(frame_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Готовит результат анализа кадров к сериализации в JSON: массив эмбеддингов,
+    который внутри процесса передается как есть, заменяется на float16/base64.
+    
+    Args:
+        frame_analysis: Результат FrameAnalyzer.analyze
+        
+    Returns:
+        Копия результата, пригодная для json.dump
+    """
+    embeddings = frame_analysis.get("embeddings")
+    if "embeddings" not in frame_analysis or (embeddings is not None and not isinstance(embeddings, np.ndarray)):
+        # Уже сериализованный результат (или старый формат со списком чисел)
+        return frame_analysis
+    
+    serialized = {key: value for key, value in frame_analysis.items() if key != "embeddings"}
+    serialized.update(encode_embeddings(embeddings))
+    return serialized
+
+def serialize_scenes_with_frames(scenes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Применяет serialize_frame_analysis к сценам, у которых есть результат анализа кадров"""
+    serialized_scenes = []
+    for scene in scenes:
+        if isinstance(scene.get("frame_analysis"), dict):
+            scene = {**scene, "frame_analysis": serialize_frame_analysis(scene["frame_analysis"])}
+        serialized_scenes.append(scene)
+    return serialized_scenes
+
+def decode_embeddings(frame_analysis: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    Восстанавливает массив эмбеддингов кадров из результата анализа кадров.
+    Поддерживает как формат float16/base64, так и старый формат со списком чисел.
+    
+    Args:
+        frame_analysis: Результат анализа кадров сцены
+        
+    Returns:
+        Массив эмбеддингов в float32 или None, если эмбеддингов нет
+    """
+    encoded = frame_analysis.get("embeddings_fp16_b64")
+    if encoded:
+        shape = frame_analysis.get("embedding_shape")
+        return np.frombuffer(base64.b64decode(encoded), dtype=np.float16).reshape(shape).astype(np.float32)
+    
+    embeddings = frame_analysis.get("embeddings")
+    if embeddings is None:
+        return None
+    return np.asarray(embeddings, dtype=np.float32)
+
+class _ImageEncoder(torch.nn.Module):
+    """Обертка над CLIP, возвращающая только эмбеддинги изображений (для компиляции через TensorRT)"""
+    
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
 class FrameAnalyzer(BaseAnalyzer):
     """
     Анализатор кадров видео, создающий визуальные embeddings.
@@ -32,12 +146,33 @@ class FrameAnalyzer(BaseAnalyzer):
         
         # Определяем устройство и тип вычислений
         self.device = os.getenv("VISION_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
-        self.compute_type = os.getenv("VISION_COMPUTE_TYPE", "float16" if self.device == "cuda" else "float32")
+        
+        # Если тип вычислений задан явно, веса модели приводятся к нему.
+        # Иначе веса остаются в float32, а на GPU используется autocast (bfloat16 при поддержке, иначе float16)
+        explicit_compute_type = os.getenv("VISION_COMPUTE_TYPE")
+        if explicit_compute_type:
+            self.compute_type = explicit_compute_type
+            self.weights_dtype = _TORCH_DTYPES.get(explicit_compute_type, torch.float32)
+        else:
+            if self.device == "cuda":
+                self.compute_type = "bfloat16" if torch.cuda.is_bf16_supported() else "float16"
+            else:
+                self.compute_type = "float32"
+            self.weights_dtype = torch.float32
         
         # Параметры анализа кадров
         self.frames_per_scene = int(os.getenv("FRAMES_PER_SCENE", "3"))  # Количество кадров для анализа из одной сцены
         self.min_scene_duration = float(os.getenv("MIN_SCENE_DURATION", "1.0"))  # Минимальная длительность сцены для анализа
         self.max_scene_duration = float(os.getenv("MAX_SCENE_DURATION", "300.0"))  # Макс. длительность сцены для разбивки
+        self.hw_decode = os.getenv("VISION_HW_DECODE", "true").lower() in ('true', '1', 'yes', 'y')  # Аппаратное декодирование видео на GPU
+        
+        # Кэш открытых видеофайлов, чтобы не открывать видео заново для каждой сцены. Видеофайл
+        # забирается из кэша на время чтения кадров, поэтому один VideoCapture никогда не читают два потока
+        self._reader_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._reader_lock = threading.Lock()
+        
+        # Пул потоков для записи кадров на диск вне пути инференса
+        self._io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="frame-writer")
         
         # Параметры сохранения кадров
         self.frames_save_path = os.getenv("FRAMES_SAVE_PATH", _SCENES_WITH_FRAMES_DIR)
@@ -51,22 +186,172 @@ class FrameAnalyzer(BaseAnalyzer):
         os.makedirs(self.frames_save_path, exist_ok=True)
         logger.info(f"Frames will be saved to: {self.frames_save_path}")
         
-        # Инициализируем модель для анализа изображений
+        # Кэш эмбеддингов по содержимому сцены
+        self.embeddings_cache_path = os.path.join(self.frames_save_path, "cache")
+        self._cache_hits = 0
+        self._cache_misses = 0
+        
+        # Модель загружается один раз на процесс и переиспользуется всеми экземплярами анализатора
+        model_key = (self.model_name, self.device, self.compute_type, str(self.weights_dtype))
+        with _MODEL_CACHE_LOCK:
+            if model_key not in _MODEL_CACHE:
+                self._load_model()
+                if self.model is not None:
+                    _MODEL_CACHE[model_key] = (self.processor, self.image_processor, self.model,
+                                               self._encode_images, self._encoder_backend)
+            else:
+                logger.info(f"Reusing already loaded vision model '{self.model_name}' on {self.device}")
+                (self.processor, self.image_processor, self.model,
+                 self._encode_images, self._encoder_backend) = _MODEL_CACHE[model_key]
+        
+        # Параметры предобработки изображений тензорными операциями на устройстве модели (вместо PIL в CLIPImageProcessor).
+        # На CUDA предобработка выполняется на GPU, на CPU - векторизованно и многопоточно средствами torch
+        self.fast_preprocess = (
+            os.getenv("VISION_GPU_PREPROCESS", "true").lower() in ('true', '1', 'yes', 'y')
+            and self.image_processor is not None
+        )
+        if self.fast_preprocess:
+            self._resize_shortest_edge = self.image_processor.size["shortest_edge"]
+            self._crop_height = self.image_processor.crop_size["height"]
+            self._crop_width = self.image_processor.crop_size["width"]
+            self._image_mean = torch.tensor(self.image_processor.image_mean, device=self.device).view(1, 3, 1, 1)
+            self._image_std = torch.tensor(self.image_processor.image_std, device=self.device).view(1, 3, 1, 1)
+        
+        # Буферы для асинхронной передачи кадров на GPU
+        self._init_transfer_buffers()
+
+    def _load_model(self) -> None:
+        """Загружает, компилирует и прогревает модель для анализа изображений"""
         logger.info(f"Initializing vision model: {self.model_name}, device={self.device}, compute_type={self.compute_type}")
         try:
             # Используем CLIPProcessor вместо AutoImageProcessor
             self.processor = CLIPProcessor.from_pretrained(self.model_name)
+            # Для эмбеддингов изображений нужен только процессор изображений, токенизатор не используется
+            self.image_processor = self.processor.image_processor
             self.model = CLIPModel.from_pretrained(
                 self.model_name,
                 device_map=self.device,
-                torch_dtype=torch.float16 if self.compute_type == "float16" else torch.float32
+                torch_dtype=self.weights_dtype
             )
             self.model.eval()  # Переключаем в режим оценки
+            if self.device == "cuda":
+                # Формат NHWC эффективнее для свертки patch embedding на тензорных ядрах
+                self.model = self.model.to(memory_format=torch.channels_last)
             logger.info(f"Vision model '{self.model_name}' loaded successfully on {self.device}")
         except Exception as e:
             logger.error(f"Error loading vision model: {str(e)}")
             self.processor = None
+            self.image_processor = None
             self.model = None
+        
+        # Функция для получения эмбеддингов изображений (по умолчанию - eager-режим) и способ ее выполнения
+        self._encode_images = self.model.get_image_features if self.model is not None else None
+        self._encoder_backend = "eager"
+        if self.model is not None:
+            if self._compile_tensorrt():
+                self._encoder_backend = "trt"
+            else:
+                self._compile_model()
+            self._warm_up()
+
+    def _autocast(self):
+        """Контекст смешанной точности для прямого прохода модели (активен только на GPU)"""
+        return torch.autocast(
+            device_type="cuda" if self.device == "cuda" else "cpu",
+            dtype=torch.bfloat16 if self.compute_type == "bfloat16" else torch.float16,
+            enabled=self.device == "cuda" and self.compute_type in ("float16", "bfloat16")
+        )
+
+    def _compile_tensorrt(self) -> bool:
+        """
+        Опционально (VISION_USE_TRT=1) компилирует энкодер изображений через torch_tensorrt в FP16.
+        Скомпилированный модуль сохраняется на диск и переиспользуется при следующих запусках.
+        
+        Returns:
+            True, если используется TensorRT-модуль, иначе False
+        """
+        if os.getenv("VISION_USE_TRT", "0") != "1" or self.device != "cuda":
+            return False
+        
+        try:
+            import torch_tensorrt
+            
+            crop_size = self.image_processor.crop_size
+            image_shape = (3, crop_size["height"], crop_size["width"])
+            max_batch = max(_MAX_FRAMES_PER_SCENE, self.frames_per_scene)
+            
+            cache_dir = os.getenv("VISION_TRT_CACHE_DIR", "/root/.cache/torch_tensorrt")
+            engine_name = f"{self.model_name.replace('/', '--')}_{self.frames_per_scene}_{max_batch}.ts"
+            engine_path = os.path.join(cache_dir, engine_name)
+            
+            if os.path.exists(engine_path):
+                logger.info(f"Loading TensorRT vision encoder from {engine_path}")
+                trt_module = torch.jit.load(engine_path).to(self.device)
+            else:
+                logger.info("Compiling vision encoder with torch_tensorrt (this may take several minutes)")
+                encoder = _ImageEncoder(self.model).eval()
+                trt_module = torch_tensorrt.compile(
+                    encoder,
+                    ir="ts",
+                    inputs=[torch_tensorrt.Input(
+                        min_shape=(1, *image_shape),
+                        opt_shape=(self.frames_per_scene, *image_shape),
+                        max_shape=(max_batch, *image_shape),
+                        dtype=self.model.dtype
+                    )],
+                    enabled_precisions={torch.half}
+                )
+                os.makedirs(cache_dir, exist_ok=True)
+                torch.jit.save(trt_module, engine_path)
+                logger.info(f"TensorRT vision encoder saved to {engine_path}")
+            
+            self._encode_images = lambda pixel_values: trt_module(pixel_values)
+            return True
+        except Exception as e:
+            logger.warning(f"TensorRT compilation is not available, falling back: {str(e)}")
+            return False
+
+    def _compile_model(self) -> None:
+        """
+        Компилирует функцию получения эмбеддингов изображений через torch.compile (только для CUDA).
+        Выполняет прогревочный прогон, чтобы компиляция не выпадала на первую сцену.
+        """
+        use_compile = os.getenv("VISION_TORCH_COMPILE", "true").lower() in ('true', '1', 'yes', 'y')
+        torch_major = int(torch.__version__.split('.')[0])
+        if not use_compile or self.device != "cuda" or torch_major < 2:
+            return
+        
+        try:
+            logger.info("Compiling vision model with torch.compile(mode='reduce-overhead')")
+            self._encode_images = torch.compile(self.model.get_image_features, mode="reduce-overhead", fullgraph=False)
+            self._encoder_backend = "compile"
+        except Exception as e:
+            logger.warning(f"torch.compile failed, falling back to eager mode: {str(e)}")
+
+    def _warm_up(self) -> None:
+        """
+        Прогревочные прогоны энкодера изображений на GPU для всех типичных размеров батча,
+        чтобы компиляция графа и инициализация CUDA не выпадали на первые сцены.
+        """
+        if self.device != "cuda":
+            return
+        
+        crop_size = self.image_processor.crop_size
+        batch_sizes = sorted({1, self.frames_per_scene, _MAX_FRAMES_PER_SCENE})
+        start = time.time()
+        try:
+            with torch.inference_mode(), self._autocast():
+                for batch_size in batch_sizes:
+                    dummy = torch.zeros(
+                        batch_size, 3, crop_size["height"], crop_size["width"],
+                        device=self.device, dtype=self.model.dtype
+                    ).contiguous(memory_format=torch.channels_last)
+                    self._encode_images(pixel_values=dummy)
+            torch.cuda.synchronize()
+            logger.info(f"Vision model warm-up for batch sizes {batch_sizes} took {time.time() - start:.2f}s")
+        except Exception as e:
+            logger.warning(f"Vision model warm-up failed, falling back to eager mode: {str(e)}")
+            self._encode_images = self.model.get_image_features
 
     def analyze(self, data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """
@@ -83,6 +368,62 @@ class FrameAnalyzer(BaseAnalyzer):
         Returns:
             Словарь с результатами анализа кадров
         """
+        return self._embed_scene(self._prepare_scene(data))
+    
+    def analyze_many(self, items: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Анализирует несколько сцен конвейером: фоновый поток декодирует кадры следующих сцен,
+        пока модель обрабатывает текущую, а запись JPEG идет в пуле ввода-вывода.
+        
+        Args:
+            items: Список входных данных сцен в формате analyze()
+            
+        Returns:
+            Итератор результатов анализа в порядке входных сцен
+        """
+        prepared_queue: "queue.Queue" = queue.Queue(maxsize=_PIPELINE_QUEUE_DEPTH)
+        stop_event = threading.Event()
+        # Исключение потока декодирования передается потребителю и пробрасывается из итератора
+        producer_errors: List[BaseException] = []
+        
+        def produce():
+            try:
+                for item in items:
+                    if stop_event.is_set():
+                        break
+                    prepared_queue.put(self._prepare_scene(item))
+            except BaseException as e:
+                producer_errors.append(e)
+            finally:
+                # Маркер конца отправляется всегда, иначе потребитель навсегда заблокируется на get()
+                prepared_queue.put(_PIPELINE_END)
+        
+        producer = threading.Thread(target=produce, name="frame-decode", daemon=True)
+        producer.start()
+        try:
+            while True:
+                prepared = prepared_queue.get()
+                if prepared is _PIPELINE_END:
+                    if producer_errors:
+                        raise producer_errors[0]
+                    break
+                yield self._embed_scene(prepared)
+        finally:
+            # Если потребитель остановился раньше, освобождаем очередь, чтобы поток декодирования завершился
+            stop_event.set()
+            while producer.is_alive():
+                try:
+                    prepared_queue.get_nowait()
+                except queue.Empty:
+                    producer.join(timeout=0.1)
+    
+    def _prepare_scene(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        CPU-этап анализа сцены: проверка параметров, поиск в кэше и декодирование кадров.
+        
+        Returns:
+            Подготовленные данные сцены или None, если анализ невозможен
+        """
         # Извлекаем необходимые параметры
         video_path = data.get('video_path')
         start_time = data.get('start_time')
@@ -91,7 +432,7 @@ class FrameAnalyzer(BaseAnalyzer):
         
         # Проверяем наличие всех необходимых параметров
         if not self._validate_input_parameters(video_path, start_time, end_time):
-            return self._create_empty_result()
+            return None
         
         # Логируем информацию о начале анализа
         duration = end_time - start_time
@@ -102,20 +443,77 @@ class FrameAnalyzer(BaseAnalyzer):
         logger.info(f"Will extract {num_frames} frames for analysis")
         
         try:
-            # Извлекаем кадры
-            frames = self._extract_frames(video_path, start_time, end_time, num_frames)
+            # Проверяем кэш эмбеддингов для этого фрагмента видео
+            cache_key = self._embedding_cache_key(video_path, start_time, end_time, num_frames)
+            cached = self._load_cached_embeddings(cache_key)
+            
+            frames = None
+            frame_info = None
+            if cached is None:
+                # Извлекаем кадры
+                frames = self._extract_frames(video_path, start_time, end_time, num_frames)
+                
+                if not frames:
+                    logger.error("Failed to extract frames")
+                    return None
+            else:
+                # Кэш общий для сцен с одинаковым фрагментом видео, а файлы кадров у каждой сцены свои:
+                # если их нет, кадры декодируются только для записи JPEG (эмбеддинги берутся из кэша)
+                frame_info = self._build_frame_info(len(cached), start_time, end_time, scene_id)
+                if not all(os.path.exists(info["frame_path"]) for info in frame_info):
+                    frames = self._extract_frames(video_path, start_time, end_time, num_frames)
             
-            if not frames:
-                logger.error("Failed to extract frames")
-                return self._create_empty_result()
+            return {
+                "start_time": start_time,
+                "end_time": end_time,
+                "scene_id": scene_id,
+                "cache_key": cache_key,
+                "cached": cached,
+                "frame_info": frame_info,
+                "frames": frames
+            }
+        except Exception as e:
+            logger.error(f"Error during frame analysis: {str(e)}")
+            return None
+    
+    def _embed_scene(self, prepared: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        GPU-этап анализа сцены: создание эмбеддингов и формирование результата.
+        
+        Args:
+            prepared: Результат _prepare_scene
             
-            # Создаем эмбеддинги для извлеченных кадров
-            embeddings, frame_info = self._create_frame_embeddings(frames, start_time, end_time, scene_id)
+        Returns:
+            Словарь с результатами анализа кадров
+        """
+        if prepared is None:
+            return self._create_empty_result()
+        
+        # Запись JPEG сцены идет параллельно с вычислением эмбеддингов, но результат сцены отдается только
+        # после записи ее кадров: пути из frame_info сразу читают следующие этапы. Так же ограничивается
+        # очередь записи - в ней не больше кадров одной сцены на каждый вызов
+        pending_writes: List[Future] = []
+        try:
+            if prepared["cached"] is not None:
+                embeddings = prepared["cached"]
+                frame_info = prepared["frame_info"]
+                for info, frame in zip(frame_info, prepared["frames"] or []):
+                    pending_writes.append(self._io_pool.submit(self._write_frame, info["frame_path"], frame))
+            else:
+                # Создаем эмбеддинги для извлеченных кадров
+                embeddings, frame_info = self._create_frame_embeddings(
+                    prepared["frames"], prepared["start_time"], prepared["end_time"], prepared["scene_id"],
+                    pending_writes
+                )
+                
+                # Сохраняем эмбеддинги в кэш
+                if embeddings.size > 0:
+                    self._save_cached_embeddings(prepared["cache_key"], embeddings)
             
             # Формируем результат
             result = {
-                "embeddings": embeddings.tolist() if isinstance(embeddings, np.ndarray) else None,
-                "num_frames": len(frames),
+                "embeddings": embeddings,
+                "num_frames": len(frame_info),
                 "frame_info": frame_info,
                 "embedding_model": self.model_name,
                 "embedding_dim": embeddings.shape[1] if isinstance(embeddings, np.ndarray) else None
@@ -126,6 +524,55 @@ class FrameAnalyzer(BaseAnalyzer):
         except Exception as e:
             logger.error(f"Error during frame analysis: {str(e)}")
             return self._create_empty_result()
+        finally:
+            self._wait_frame_writes(pending_writes)
+    
+    def _wait_frame_writes(self, pending_writes: List[Future]) -> None:
+        """Дожидается записи кадров сцены на диск и логирует ошибки записи"""
+        for future in pending_writes:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error saving frame: {str(e)}")
+    
+    def _embedding_cache_key(self, video_path: str, start_time: float, end_time: float,
+                             num_frames: int) -> str:
+        """
+        Формирует ключ кэша эмбеддингов по содержимому видео (размер и время изменения файла),
+        временному диапазону сцены, количеству кадров, модели и способу вычисления эмбеддингов
+        (тип вычислений и весов, способ выполнения энкодера, предобработка), от которых зависят значения.
+        """
+        stat = os.stat(video_path)
+        raw_key = (f"{stat.st_size}:{stat.st_mtime}:{start_time}:{end_time}:{num_frames}:{self.model_name}:"
+                   f"{self.compute_type}:{self.weights_dtype}:{self._encoder_backend}:{self.fast_preprocess}")
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+    
+    def _load_cached_embeddings(self, cache_key: str) -> Optional[np.ndarray]:
+        """Загружает эмбеддинги кадров из кэша, если они есть"""
+        cache_path = os.path.join(self.embeddings_cache_path, f"{cache_key}.npz")
+        if not os.path.exists(cache_path):
+            self._cache_misses += 1
+            logger.debug(f"Embedding cache miss (hits={self._cache_hits}, misses={self._cache_misses})")
+            return None
+        
+        try:
+            with np.load(cache_path) as cached:
+                embeddings = cached["embeddings"]
+            self._cache_hits += 1
+            logger.debug(f"Embedding cache hit (hits={self._cache_hits}, misses={self._cache_misses})")
+            return embeddings
+        except Exception as e:
+            logger.warning(f"Error reading embedding cache {cache_path}: {str(e)}")
+            return None
+    
+    def _save_cached_embeddings(self, cache_key: str, embeddings: np.ndarray) -> None:
+        """Сохраняет эмбеддинги кадров в кэш (пути к файлам кадров зависят от сцены и в кэш не попадают)"""
+        try:
+            os.makedirs(self.embeddings_cache_path, exist_ok=True)
+            cache_path = os.path.join(self.embeddings_cache_path, f"{cache_key}.npz")
+            np.savez_compressed(cache_path, embeddings=embeddings)
+        except Exception as e:
+            logger.warning(f"Error saving embedding cache: {str(e)}")
     
     def _validate_input_parameters(self, video_path: str, start_time: Optional[float], 
                                    end_time: Optional[float]) -> bool:
@@ -164,7 +611,7 @@ class FrameAnalyzer(BaseAnalyzer):
             return 1  # Для очень коротких сцен берем только один кадр
         elif duration > self.max_scene_duration:
             # Для очень длинных сцен увеличиваем количество кадров
-            return min(int(duration / 10), 10)  # Не более 10 кадров для длинных сцен
+            return min(int(duration / 10), _MAX_FRAMES_PER_SCENE)  # Не более 10 кадров для длинных сцен
         else:
             return self.frames_per_scene
     
@@ -185,6 +632,19 @@ class FrameAnalyzer(BaseAnalyzer):
         frames = []
         duration = end_time - start_time
         
+        # Проверяем диапазон до открытия видео, чтобы не запускать декодер впустую
+        if duration <= 0:
+            logger.error(f"Invalid time range: {start_time}s - {end_time}s")
+            return frames
+        
+        # Если видео уже открыто, его длительность известна - отбрасываем сцены за пределами файла
+        with self._reader_lock:
+            cached_reader = self._reader_cache.get(video_path)
+            known_duration = cached_reader["duration"] if cached_reader else 0
+        if known_duration and start_time >= known_duration:
+            logger.error(f"Time range {start_time}s - {end_time}s is beyond video duration {known_duration:.2f}s: {video_path}")
+            return frames
+        
         # Добавляем небольшой отступ для последнего кадра (100 миллисекунд)
         end_offset_ms = 100  # миллисекунды
         end_offset = end_offset_ms / 1000.0  # в секундах
@@ -193,58 +653,340 @@ class FrameAnalyzer(BaseAnalyzer):
         safe_end_offset = min(end_offset, duration / 2)
         adjusted_end_time = end_time - safe_end_offset
         
+        reader = None
         try:
-            # Открываем видеофайл
-            with VideoFileClip(video_path) as video:
-                if duration <= 0:
-                    logger.error(f"Invalid time range: {start_time}s - {end_time}s")
-                    return frames
+            # Забираем открытый видеофайл из кэша (или открываем его через OpenCV)
+            reader = self._acquire_video_reader(video_path)
+            if reader is None:
+                logger.error(f"Failed to open video: {video_path}")
+                return frames
+            
+            video_duration = reader["duration"] or end_time
+            
+            # Определяем временные точки для извлечения кадров
+            if num_frames == 1:
+                # Если нужен только один кадр, берем из середины сцены
+                frame_times = [start_time + duration / 2]
+            else:
+                # Равномерно распределяем кадры по времени с учетом отступа в конце
+                adjusted_duration = adjusted_end_time - start_time
                 
-                # Определяем временные точки для извлечения кадров
-                if num_frames == 1:
-                    # Если нужен только один кадр, берем из середины сцены
-                    frame_times = [start_time + duration / 2]
+                if num_frames == 2:
+                    # Для двух кадров: один в начале, один с отступом от конца
+                    frame_times = [start_time, adjusted_end_time]
                 else:
-                    # Равномерно распределяем кадры по времени с учетом отступа в конце
-                    adjusted_duration = adjusted_end_time - start_time
-                    
-                    if num_frames == 2:
-                        # Для двух кадров: один в начале, один с отступом от конца
-                        frame_times = [start_time, adjusted_end_time]
-                    else:
-                        # Для более чем двух кадров: равномерно распределяем
-                        frame_times = [
-                            start_time + i * adjusted_duration / (num_frames - 1) 
-                            for i in range(num_frames)
-                        ]
-                
-                logger.debug(f"Extracting frames at times: {[f'{t:.2f}s' for t in frame_times]}")
-                
-                # Извлекаем кадры в указанные временные точки
-                for t in frame_times:
-                    # Ограничиваем время, чтобы не выйти за пределы видео
-                    t = min(t, video.duration - 0.1)
-                    t = max(t, 0)
-                    
-                    # Получаем кадр из видео
-                    frame = video.get_frame(t)
-                    
-                    # Конвертируем из RGB в BGR для OpenCV
-                    frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                    
-                    frames.append(frame_bgr)
-                    logger.debug(f"Extracted frame at time {t:.2f}s")
-                
-                logger.info(f"Extracted {len(frames)} frames from time range {start_time:.2f}s - {end_time:.2f}s (with {safe_end_offset*1000:.0f}ms end offset)")
-                return frames
+                    # Для более чем двух кадров: равномерно распределяем
+                    frame_times = [
+                        start_time + i * adjusted_duration / (num_frames - 1) 
+                        for i in range(num_frames)
+                    ]
+            
+            logger.debug(f"Extracting frames at times: {[f'{t:.2f}s' for t in frame_times]}")
+            
+            # Ограничиваем время, чтобы не выйти за пределы видео
+            clipped_times = np.clip(np.asarray(frame_times, dtype=np.float64), 0, max(video_duration - 0.1, 0))
+            
+            # Обходим временные точки в порядке возрастания за один проход по видео
+            order = np.argsort(clipped_times, kind="stable")
+            sorted_times = clipped_times[order]
+            sorted_frames = self._read_frames_sweep(reader, sorted_times)
+            
+            # Аппаратный декодер может не поддерживать кодек - переключаемся на программное декодирование
+            if reader["hw_accelerated"] and any(frame is None or frame.size == 0 for frame in sorted_frames):
+                logger.warning("Hardware decoding returned empty frame, falling back to software decoding")
+                reader["cap"].release()
+                reader = self._acquire_video_reader(video_path, allow_hw=False)
+                if reader is None:
+                    logger.error(f"Failed to open video: {video_path}")
+                    return frames
+                sorted_frames = self._read_frames_sweep(reader, sorted_times)
+            
+            # Восстанавливаем исходный порядок кадров
+            for idx in np.argsort(order):
+                frame_bgr = sorted_frames[idx]
+                if frame_bgr is None:
+                    logger.warning(f"Failed to read frame at time {sorted_times[idx]:.2f}s")
+                    continue
+                frames.append(frame_bgr)
+            
+            logger.info(f"Extracted {len(frames)} frames from time range {start_time:.2f}s - {end_time:.2f}s (with {safe_end_offset*1000:.0f}ms end offset)")
+            return frames
                 
         except Exception as e:
             logger.error(f"Error extracting frames: {str(e)}")
+            # Состояние декодера после ошибки не гарантировано - закрываем его, а не возвращаем в кэш
+            if reader is not None:
+                reader["cap"].release()
+                reader = None
             return []
+        finally:
+            if reader is not None:
+                self._return_video_reader(video_path, reader)
+    
+    def _read_frames_sweep(self, reader: Dict[str, Any], sorted_times: np.ndarray) -> List[Optional[np.ndarray]]:
+        """
+        Читает кадры для отсортированных временных точек за один проход вперед по видео:
+        один переход к первому кадру, затем последовательное декодирование (grab) до каждого
+        следующего нужного кадра. Для больших промежутков выполняется повторный переход.
+        
+        Args:
+            reader: Видеофайл, полученный через _acquire_video_reader
+            sorted_times: Отсортированные по возрастанию временные точки (в секундах)
+            
+        Returns:
+            Список кадров в формате BGR (None для кадров, которые не удалось прочитать)
+        """
+        cap = reader["cap"]
+        fps = reader["fps"]
+        
+        # Без FPS номера кадров вычислить нельзя - переходим к каждой временной точке отдельно
+        if not fps or fps <= 0:
+            frames = []
+            for t in sorted_times:
+                cap.set(cv2.CAP_PROP_POS_MSEC, float(t) * 1000.0)
+                ok, frame_bgr = cap.read()
+                frames.append(frame_bgr if ok else None)
+            return frames
+        
+        max_gap_frames = int(fps * _MAX_SEQUENTIAL_GAP_SECONDS)
+        frame_indices = (sorted_times * fps).astype(int)
+        
+        frames = []
+        position = None  # Номер кадра, который будет декодирован следующим
+        for target in frame_indices:
+            if position is None or target < position or target - position > max_gap_frames:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(target))
+                position = int(target)
+            
+            # Пропускаем промежуточные кадры без преобразования в numpy
+            while position < target and cap.grab():
+                position += 1
+            
+            ok, frame_bgr = cap.read()
+            position += 1
+            frames.append(frame_bgr if ok else None)
+        
+        return frames
+    
+    def _acquire_video_reader(self, video_path: str, allow_hw: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Забирает открытый видеофайл из LRU-кэша (или открывает новый) в монопольное пользование.
+        Последовательные сцены одного видео переиспользуют уже открытый демультиплексор, а параллельные
+        задачи по тому же видео получают собственные VideoCapture. После чтения видеофайл нужно вернуть
+        через _return_video_reader.
+        
+        Args:
+            video_path: Путь к видеофайлу
+            allow_hw: Разрешить аппаратное декодирование
+            
+        Returns:
+            Словарь с объектом VideoCapture, флагом аппаратного декодирования и длительностью видео,
+            либо None, если видео не удалось открыть
+        """
+        with self._reader_lock:
+            reader = self._reader_cache.pop(video_path, None)
+        if reader is not None:
+            if allow_hw or not reader["hw_accelerated"]:
+                return reader
+            reader["cap"].release()
+        
+        cap, hw_accelerated = self._open_video(video_path, allow_hw=allow_hw)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        
+        # Длительность видео по количеству кадров и FPS
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        return {
+            "cap": cap,
+            "hw_accelerated": hw_accelerated,
+            "fps": fps,
+            "duration": frame_count / fps if fps > 0 else None
+        }
+    
+    def _return_video_reader(self, video_path: str, reader: Dict[str, Any]) -> None:
+        """Возвращает видеофайл в LRU-кэш после чтения кадров"""
+        with self._reader_lock:
+            # Пока видеофайл был занят, другой поток мог вернуть в кэш свой - оставляем только один
+            previous = self._reader_cache.pop(video_path, None)
+            if previous is not None:
+                previous["cap"].release()
+            self._reader_cache[video_path] = reader
+            
+            # Ограничиваем количество открытых видеофайлов (в кэше только свободные, их можно закрывать)
+            while len(self._reader_cache) > _MAX_OPEN_VIDEOS:
+                _, evicted = self._reader_cache.popitem(last=False)
+                evicted["cap"].release()
+    
+    def close(self) -> None:
+        """Закрывает все открытые видеофайлы и дожидается записи кадров на диск"""
+        with self._reader_lock:
+            for reader in self._reader_cache.values():
+                reader["cap"].release()
+            self._reader_cache.clear()
+        self._io_pool.shutdown(wait=True)
+    
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+    
+    def _open_video(self, video_path: str, allow_hw: bool = True) -> Tuple[cv2.VideoCapture, bool]:
+        """
+        Открывает видеофайл, по возможности с аппаратным декодированием (NVDEC и т.п.).
+        
+        Args:
+            video_path: Путь к видеофайлу
+            allow_hw: Разрешить аппаратное декодирование
+            
+        Returns:
+            Кортеж из объекта VideoCapture и флага использования аппаратного декодирования
+        """
+        if allow_hw and self.hw_decode and self.device == "cuda":
+            try:
+                cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [
+                    cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY,
+                    cv2.CAP_PROP_HW_ACCELERATION_USE_OPENCL, 0
+                ])
+                if cap.isOpened():
+                    return cap, True
+                cap.release()
+            except Exception as e:
+                logger.warning(f"Hardware video decoding is not available: {str(e)}")
+        
+        return cv2.VideoCapture(video_path), False
+    
+    def _preprocess_on_device(self, frames_bgr: List[np.ndarray]) -> torch.Tensor:
+        """
+        Предобработка кадров для CLIP на устройстве модели: перестановка каналов BGR -> RGB,
+        масштабирование по короткой стороне (бикубическая интерполяция), центральная обрезка и нормализация.
+        Повторяет шаги CLIPImageProcessor без промежуточного преобразования в PIL.
+        
+        Args:
+            frames_bgr: Список кадров в формате BGR (uint8, одинакового размера), как их возвращает OpenCV
+            
+        Returns:
+            Тензор pixel_values формы (N, 3, crop_height, crop_width) в dtype модели
+        """
+        batch = torch.from_numpy(np.stack(frames_bgr))
+        if self.device == "cuda":
+            batch = batch.pin_memory()
+        # (N, H, W, BGR) -> (N, RGB, H, W)
+        batch = batch.to(self.device, non_blocking=True).permute(0, 3, 1, 2).flip(1).float()
+        
+        # Масштабируем так, чтобы короткая сторона стала равна shortest_edge
+        height, width = batch.shape[-2:]
+        scale = self._resize_shortest_edge / min(height, width)
+        new_height, new_width = round(height * scale), round(width * scale)
+        batch = F.interpolate(batch, size=(new_height, new_width), mode="bicubic",
+                              align_corners=False, antialias=True).clamp_(0, 255)
+        
+        # Центральная обрезка
+        top = (new_height - self._crop_height) // 2
+        left = (new_width - self._crop_width) // 2
+        batch = batch[..., top:top + self._crop_height, left:left + self._crop_width]
+        
+        # Приводим к [0, 1] и нормализуем
+        batch = (batch / 255.0 - self._image_mean) / self._image_std
+        return batch.to(self.model.dtype)
+    
+    def _init_transfer_buffers(self) -> None:
+        """
+        Выделяет закрепленный (pinned) буфер в памяти хоста и отдельный CUDA-поток
+        для асинхронного копирования pixel_values на GPU.
+        """
+        self._pixel_buf = None
+        self._copy_stream = None
+        if self.device != "cuda" or self.image_processor is None or self.fast_preprocess:
+            return
+        
+        try:
+            crop_size = self.image_processor.crop_size
+            max_batch = max(_MAX_FRAMES_PER_SCENE, self.frames_per_scene)
+            self._pixel_buf = torch.empty(
+                max_batch, 3, crop_size["height"], crop_size["width"],
+                dtype=torch.float32, pin_memory=True
+            )
+            self._copy_stream = torch.cuda.Stream()
+        except Exception as e:
+            logger.warning(f"Failed to allocate pinned transfer buffer: {str(e)}")
+            self._pixel_buf = None
+            self._copy_stream = None
+    
+    def _to_device(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """
+        Переносит pixel_values на устройство модели. На GPU копирование идет через
+        закрепленный буфер без блокировки (non_blocking) в отдельном CUDA-потоке.
+        """
+        batch_size = pixel_values.shape[0]
+        if self._pixel_buf is None or batch_size > self._pixel_buf.shape[0] \
+                or pixel_values.shape[1:] != self._pixel_buf.shape[1:]:
+            return pixel_values.to(self.device, dtype=self.model.dtype)
+        
+        staging = self._pixel_buf[:batch_size]
+        staging.copy_(pixel_values)
+        with torch.cuda.stream(self._copy_stream):
+            device_values = staging.to(self.device, non_blocking=True)
+        
+        # Вычисления в основном потоке должны дождаться завершения копирования
+        current_stream = torch.cuda.current_stream()
+        current_stream.wait_stream(self._copy_stream)
+        device_values.record_stream(current_stream)
+        return device_values.to(self.model.dtype)
+    
+    @staticmethod
+    def _write_frame(frame_path: str, frame: np.ndarray) -> None:
+        """Сохраняет кадр в JPEG (выполняется в пуле потоков ввода-вывода)"""
+        if not cv2.imwrite(frame_path, frame, [cv2.IMWRITE_JPEG_QUALITY, _JPEG_QUALITY]):
+            raise IOError(f"cv2.imwrite failed for {frame_path}")
+    
+    def _build_frame_info(self, num_frames: int, start_time: float, end_time: float,
+                          scene_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Формирует информацию о кадрах сцены: примерное время, относительную позицию и путь к файлу кадра.
+        
+        Args:
+            num_frames: Количество кадров
+            start_time: Начальное время сцены
+            end_time: Конечное время сцены
+            scene_id: ID сцены для именования файлов
+            
+        Returns:
+            Список словарей с информацией о кадрах
+        """
+        # Определяем директорию для сохранения кадров
+        frames_dir = self.frames_save_path
+        os.makedirs(frames_dir, exist_ok=True)
+        
+        # Формируем ID сцены для имени файла
+        scene_identifier = scene_id if scene_id else f"scene_{start_time:.2f}_{end_time:.2f}"
+        
+        # Вычисляем относительные позиции (от 0 до 1) и примерное время всех кадров
+        duration = end_time - start_time
+        relative_positions = np.linspace(0.0, 1.0, num_frames)
+        if num_frames == 1:
+            frame_times = np.array([start_time + duration / 2])
+        else:
+            frame_times = start_time + relative_positions * duration
+        
+        frame_info = []
+        for i in range(num_frames):
+            # Создаем имя файла для кадра с ID сцены
+            frame_filename = f"frame_{scene_identifier}_{i}.jpg"
+            frame_info.append({
+                "time": float(frame_times[i]),
+                "relative_position": float(relative_positions[i]),  # От 0 до 1
+                "frame_path": os.path.join(frames_dir, frame_filename),
+                "frame_filename": frame_filename
+            })
+        return frame_info
     
     def _create_frame_embeddings(self, frames: List[np.ndarray], 
                                start_time: float, end_time: float,
-                               scene_id: Optional[str] = None) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+                               scene_id: Optional[str] = None,
+                               pending_writes: Optional[List[Future]] = None) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
         """
         Создает эмбеддинги для кадров с использованием модели компьютерного зрения.
         Также сохраняет кадры на диск и добавляет пути к ним в информацию о кадрах.
@@ -254,84 +996,46 @@ class FrameAnalyzer(BaseAnalyzer):
             start_time: Начальное время сцены
             end_time: Конечное время сцены
             scene_id: ID сцены для именования файлов
+            pending_writes: Список, в который добавляются задачи записи кадров (их нужно дождаться)
             
         Returns:
             Кортеж из массива эмбеддингов и информации о кадрах
         """
-        if not frames or self.model is None or self.processor is None:
+        if not frames or self.model is None or self.image_processor is None:
             return np.zeros((0, 0)), []
         
-        duration = end_time - start_time
-        frame_embeddings = []
-        frame_info = []
-        
         try:
-            # Определяем директорию для сохранения кадров
-            frames_dir = self.frames_save_path
-            os.makedirs(frames_dir, exist_ok=True)
-            
-            # Формируем ID сцены для имени файла
-            scene_identifier = scene_id if scene_id else f"scene_{start_time:.2f}_{end_time:.2f}"
-            
-            # Обрабатываем каждый кадр
-            for i, frame in enumerate(frames):
-                # Вычисляем примерное время кадра
-                if len(frames) == 1:
-                    frame_time = start_time + duration / 2
-                else:
-                    frame_time = start_time + i * duration / (len(frames) - 1)
-                
+            frame_info = self._build_frame_info(len(frames), start_time, end_time, scene_id)
+            
+            # Сохраняем кадры на диск в фоновом потоке, не блокируя вычисление эмбеддингов
+            for info, frame in zip(frame_info, frames):
+                future = self._io_pool.submit(self._write_frame, info["frame_path"], frame)
+                if pending_writes is not None:
+                    pending_writes.append(future)
+            
+            if self.fast_preprocess:
+                # Предобработка всего батча тензорными операциями (перестановка каналов BGR -> RGB тоже выполняется там)
+                pixel_values = self._preprocess_on_device(frames)
+            else:
                 # Преобразуем BGR в RGB
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                
-                # Подготавливаем изображение для модели CLIP
-                # CLIP требует как изображение, так и текст для обработки
-                inputs = self.processor(
-                    text=["a photo"], 
-                    images=frame_rgb, 
-                    return_tensors="pt", 
-                    padding=True
-                )
-                
-                # Переносим тензоры на нужное устройство
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
-                
-                # Получаем эмбеддинг
-                with torch.no_grad():
-                    outputs = self.model.get_image_features(**{
-                        k: v for k, v in inputs.items() 
-                        if k in ['pixel_values']
-                    })
+                frames_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
                 
-                # Получаем эмбеддинг изображения
-                embedding = outputs.cpu().numpy()
+                # Подготавливаем все кадры сцены одним батчем (только pixel_values, без токенизации текста)
+                inputs = self.image_processor(images=frames_rgb, return_tensors="pt")
                 
-                frame_embeddings.append(embedding)
-                
-                # Создаем имя файла для кадра с ID сцены
-                frame_filename = f"frame_{scene_identifier}_{i}.jpg"
-                frame_path = os.path.join(frames_dir, frame_filename)
-                
-                # Сохраняем кадр на диск
-                cv2.imwrite(frame_path, frame)
-                
-                # Сохраняем информацию о кадре
-                frame_info.append({
-                    "time": float(frame_time),
-                    "relative_position": i / max(1, len(frames) - 1),  # От 0 до 1
-                    "frame_path": frame_path,
-                    "frame_filename": frame_filename
-                })
-                
-                logger.debug(f"Saved frame to {frame_path} and created embedding for time {frame_time:.2f}s")
+                # Переносим тензор на нужное устройство
+                pixel_values = self._to_device(inputs["pixel_values"])
             
-            # Объединяем все эмбеддинги в один массив
-            if frame_embeddings:
-                all_embeddings = np.vstack(frame_embeddings)
-                logger.info(f"Created embeddings array with shape {all_embeddings.shape}")
-                return all_embeddings, frame_info
-            else:
-                return np.zeros((0, 0)), []
+            if self.device == "cuda":
+                pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+            
+            # Получаем эмбеддинги всех кадров за один прямой проход
+            with torch.inference_mode(), self._autocast():
+                outputs = self._encode_images(pixel_values=pixel_values)
+            
+            all_embeddings = outputs.float().cpu().numpy()
+            logger.info(f"Created embeddings array with shape {all_embeddings.shape}")
+            return all_embeddings, frame_info
                 
         except Exception as e:
             logger.error(f"Error creating frame embeddings: {str(e)}")
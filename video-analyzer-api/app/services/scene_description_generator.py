@@ -1,7 +1,7 @@
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
-from PIL import Image
 
 # Импортируем клиент Replicate
 from app.services.blip2_replicate_client import Blip2ReplicateClient
@@ -14,6 +14,8 @@ class SceneDescriptionGenerator:
         # Инициализация клиента Replicate
         logger.info("Инициализация генератора описаний сцен с использованием Replicate API")
         self.replicate_client = Blip2ReplicateClient()
+        # Количество одновременных запросов к API при генерации описаний для нескольких сцен
+        self.batch_size = int(os.getenv("BLIP2_BATCH_SIZE", "8"))
 
     def _validate_scene(self, scene: Dict[str, Any]) -> Optional[str]:
         """
@@ -86,6 +88,8 @@ class SceneDescriptionGenerator:
         
         logger.info(f"Начало генерации описаний для {total_scenes} сцен")
         
+        # Первый проход: собираем кадры всех корректных сцен
+        pending = []
         for i, scene in enumerate(scenes):
             scene_id = scene.get('id')
             if not scene_id:
@@ -99,11 +103,15 @@ class SceneDescriptionGenerator:
             if not frame_path:
                 continue
             
-            # Генерируем описание для первого кадра
-            description = self.generate_description_for_frame(frame_path)
-            
+            pending.append((scene_id, frame_path, scene.get('audio_analysis', {}).get('transcript', '')))
+        
+        # Второй проход: генерируем описания пачками параллельных запросов
+        frame_paths = [frame_path for _, frame_path, _ in pending]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.batch_size, len(frame_paths)))) as executor:
+            descriptions = list(executor.map(self.generate_description_for_frame, frame_paths))
+        
+        for (scene_id, _, transcript), description in zip(pending, descriptions):
             # Если есть транскрипция, добавляем её к описанию
-            transcript = scene.get('audio_analysis', {}).get('transcript', '')
             if transcript:
                 description = f"{description} (Диалог: '{transcript}')"
             
@@ -1,6 +1,7 @@
+import os
 import logging
 from typing import Dict, List, Any
-from scenedetect import detect, ContentDetector
+from scenedetect import open_video, SceneManager, ContentDetector, AdaptiveDetector
 
 from app.services.base_analyzer import BaseAnalyzer
 
@@ -19,14 +20,31 @@ class SceneDetector(BaseAnalyzer):
             threshold: Пороговое значение для обнаружения сцен
         """
         self.threshold = threshold
-        logger.info(f"Initialized SceneDetector with threshold={threshold}")
+        # Коэффициент уменьшения кадров перед сравнением (0 - автоматический выбор по разрешению видео)
+        self.downscale = int(os.getenv("SCENE_DETECT_DOWNSCALE", "0"))
+        # Количество пропускаемых кадров между анализируемыми (0 - анализируется каждый кадр)
+        self.frame_skip = int(os.getenv("SCENE_DETECT_FRAME_SKIP", "0"))
+        # Бэкенд декодирования видео scenedetect (opencv или pyav - быстрее, требует установленного av)
+        self.backend = os.getenv("SCENE_DETECT_BACKEND", "opencv")
+        # Детектор сцен: content (порог threshold) или adaptive (адаптивный порог, устойчивее к движению камеры)
+        self.detector = os.getenv("SCENE_DETECT_DETECTOR", "content").lower()
+        # Минимальная длительность сцены в секундах (отсекает фрагменты в 1-2 кадра)
+        self.min_scene_len_seconds = float(os.getenv("SCENE_DETECT_MIN_SCENE_LEN", "2.0"))
+        # Если сцен больше этого числа, поиск повторяется с более высоким порогом (0 - без ограничения)
+        self.max_scenes = int(os.getenv("SCENE_DETECT_MAX_SCENES", "500"))
+        self.fallback_threshold = 30.0
+        logger.info(f"Initialized SceneDetector with threshold={threshold}, downscale={self.downscale or 'auto'}, "
+                    f"frame_skip={self.frame_skip}, backend={self.backend}, detector={self.detector}, "
+                    f"min_scene_len={self.min_scene_len_seconds}s, max_scenes={self.max_scenes}")
     
     def analyze(self, data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
         """
         Обнаруживает сцены в видео.
         
         Args:
-            data: Словарь данных, должен содержать ключ 'video_path'
+            data: Словарь данных, должен содержать ключ 'video_path'.
+                Может содержать 'video_stream' - уже открытый VideoStream scenedetect,
+                чтобы не открывать видео повторно
             **kwargs: Дополнительные параметры
             
         Returns:
@@ -40,30 +58,58 @@ class SceneDetector(BaseAnalyzer):
         logger.info(f"Detecting scenes for {video_path}")
         
         try:
-            # Используем функцию detect из scenedetect
-            scene_list = detect(video_path, ContentDetector(threshold=self.threshold))
+            # Используем SceneManager напрямую, чтобы управлять уменьшением кадров и переиспользовать открытый поток
+            video = data.get('video_stream') or self._open_video(video_path)
+            min_scene_len = max(1, int(round(video.frame_rate * self.min_scene_len_seconds)))
+            scene_list = self._detect(video, self.threshold, min_scene_len)
+            
+            # Слишком мелкое разбиение (например, из-за шума или частых вспышек) ограничиваем повторным
+            # поиском с более высоким порогом, чтобы не раздувать последующую обработку сцен
+            if (self.detector != "adaptive" and self.max_scenes > 0 and len(scene_list) > self.max_scenes
+                    and self.threshold < self.fallback_threshold):
+                logger.warning(f"Обнаружено {len(scene_list)} сцен (больше {self.max_scenes}), "
+                               f"повторный поиск с порогом {self.fallback_threshold}")
+                video.reset()
+                scene_list = self._detect(video, self.fallback_threshold, min_scene_len)
             
             logger.info(f"Обнаружено {len(scene_list)} сцен")
             
-            # Преобразуем сцены в список словарей с временными метками
-            scenes = []
-            for i, scene in enumerate(scene_list):
-                start_frame = scene[0].get_frames()
-                end_frame = scene[1].get_frames()
-                start_time = scene[0].get_seconds()
-                end_time = scene[1].get_seconds()
-                duration = end_time - start_time
-                
-                scenes.append({
+            # Преобразуем сцены в список словарей с временными метками (время начала и конца вычисляется один раз)
+            scenes = [
+                {
                     "id": f"scene_{i + 1}",
-                    "start_frame": start_frame,
-                    "end_frame": end_frame,
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "duration": duration
-                })
+                    "start_frame": start.get_frames(),
+                    "end_frame": end.get_frames(),
+                    "start_time": (start_time := start.get_seconds()),
+                    "end_time": (end_time := end.get_seconds()),
+                    "duration": end_time - start_time
+                }
+                for i, (start, end) in enumerate(scene_list)
+            ]
             
             return {"scenes": scenes}
         except Exception as e:
             logger.error(f"Error detecting scenes: {str(e)}")
-            return {"scenes": []} 
\ No newline at end of file
+            return {"scenes": []}
+    
+    def _detect(self, video, threshold: float, min_scene_len: int) -> List[Any]:
+        """Один проход поиска сцен по видеопотоку с заданным порогом и минимальной длиной сцены (в кадрах)"""
+        scene_manager = SceneManager()
+        if self.detector == "adaptive":
+            scene_manager.add_detector(AdaptiveDetector(min_scene_len=min_scene_len))
+        else:
+            scene_manager.add_detector(ContentDetector(threshold=threshold, min_scene_len=min_scene_len))
+        if self.downscale > 0:
+            scene_manager.auto_downscale = False
+            scene_manager.downscale = self.downscale
+        scene_manager.detect_scenes(video=video, frame_skip=self.frame_skip)
+        return scene_manager.get_scene_list()
+    
+    def _open_video(self, video_path: str):
+        """Открывает видео через выбранный бэкенд scenedetect, при ошибке - через OpenCV"""
+        if self.backend != "opencv":
+            try:
+                return open_video(video_path, backend=self.backend)
+            except Exception as e:
+                logger.warning(f"Failed to open video with backend {self.backend}, falling back to opencv: {str(e)}")
+        return open_video(video_path)
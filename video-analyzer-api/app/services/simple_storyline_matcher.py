@@ -1,24 +1,40 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from transformers import CLIPProcessor, CLIPModel
+import hashlib
 import logging
 import os
 from typing import Dict, List, Any
 import torch
-from sklearn.preprocessing import normalize
+
+from app.services.frame_analyzer import decode_embeddings
+
+# Веса текстовой и визуальной схожести в итоговой оценке
+_TEXT_WEIGHT = 0.3
+_IMAGE_WEIGHT = 0.7
 
 class SimpleStorylineMatcher:
     def __init__(self):
         # Инициализация модели CLIP с автоматической поддержкой GPU
         self._setup_model()
         
-        # Кэш для хранения вычисленных эмбеддингов сюжетов
+        # Кэш для хранения вычисленных эмбеддингов сюжетов (сохраняется на диск между запусками)
         self.plot_embeddings_cache = {}
+        self.plot_visual_embeddings_cache = {}
+        self.plot_cache_path = os.environ.get(
+            "PLOT_EMBEDDINGS_CACHE_PATH",
+            os.path.join(os.environ.get("SHARED_DATA_DIR", "/app/shared-data"), "cache", "plot_embeddings.npz")
+        )
+        self._plot_cache_dirty = False
+        self._load_plot_cache()
+        
+        # Кэш текстовых эмбеддингов транскриптов сцен
+        self.scene_text_cache = {}
 
     def _setup_model(self):
         """Настраивает модель, автоматически используя GPU при доступности"""
         # Получаем настройки из переменных окружения
         model_name = os.environ.get("VISION_MODEL_NAME", "openai/clip-vit-base-patch32")
+        self.model_name = model_name
         device_preference = os.environ.get("VISION_DEVICE", "cuda")
         compute_type = os.environ.get("VISION_COMPUTE_TYPE", "float16")
         
@@ -30,62 +46,130 @@ class SimpleStorylineMatcher:
             self.device = "cpu"
             logging.info(f"SimpleStorylineMatcher: Используется CPU с моделью {model_name}")
         
-        # Определяем тип данных
-        self.dtype = torch.float16 if compute_type.lower() == "float16" and self.device == "cuda" else torch.float32
+        # Определяем тип данных (bfloat16 численно устойчивее float16 при том же объеме памяти)
+        compute_type = compute_type.lower()
+        if self.device == "cuda" and compute_type == "bfloat16" and torch.cuda.is_bf16_supported():
+            self.dtype = torch.bfloat16
+        elif self.device == "cuda" and compute_type in ("float16", "bfloat16"):
+            self.dtype = torch.float16
+        else:
+            self.dtype = torch.float32
         
-        # Загружаем модель с нужными параметрами
-        self.model = CLIPModel.from_pretrained(model_name, torch_dtype=self.dtype).to(self.device)
+        # Загружаем веса сразу на нужное устройство и в нужном типе, без промежуточной копии в fp32 на CPU
+        self.model = CLIPModel.from_pretrained(
+            model_name,
+            torch_dtype=self.dtype,
+            device_map={"": self.device},
+            low_cpu_mem_usage=True
+        )
+        self.model.eval()
         self.processor = CLIPProcessor.from_pretrained(model_name)
         
         logging.info(f"SimpleStorylineMatcher: Модель {model_name} успешно загружена на {self.device}")
 
     def _move_to_device(self, inputs):
         """Перемещает входные тензоры на нужное устройство (GPU/CPU)"""
-        if self.device == "cuda":
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        return inputs
+        # BatchEncoding умеет переносить все тензоры сразу
+        return inputs.to(self.device, non_blocking=True)
         
     def _convert_to_numpy(self, tensor):
         """Преобразует тензор PyTorch в numpy массив"""
-        if self.device == "cuda":
-            tensor = tensor.cpu()
-            torch.cuda.empty_cache()
-        return tensor.detach().numpy()
+        # bfloat16 не поддерживается numpy, поэтому приводим к float32 перед копированием
+        return tensor.detach().float().cpu().numpy()
 
     def _normalize_vector(self, vector):
         """Нормализует вектор для корректного косинусного сходства"""
-        # Используем L2-нормализацию (единичная длина вектора)
-        return normalize(vector.reshape(1, -1))[0]
+        # Используем L2-нормализацию (единичная длина вектора) без промежуточных 2D-массивов sklearn
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
     
     def get_visual_embedding_for_plot(self, plot: Dict[str, Any]) -> np.ndarray:
         """
         Создаёт "визуальный" эмбеддинг для сюжета — на основе ключевых слов или заголовка.
         Используется для сравнения с image эмбеддингами сцен.
         """
+        plot_key = self._plot_key(plot)
+        if plot_key in self.plot_visual_embeddings_cache:
+            return self.plot_visual_embeddings_cache[plot_key]
+        
         visual_prompt = f"{plot['title']} {' '.join(plot['keywords'])}"
-        return self.get_text_embedding(visual_prompt)
+        embedding = self.get_text_embedding(visual_prompt)
+        self.plot_visual_embeddings_cache[plot_key] = embedding
+        self._plot_cache_dirty = True
+        return embedding
+    
+    def get_scene_text_embedding(self, transcript: str) -> np.ndarray:
+        """Получает эмбеддинг транскрипта сцены, вычисляя его не более одного раза"""
+        if transcript not in self.scene_text_cache:
+            self.scene_text_cache[transcript] = self.get_text_embedding(transcript)
+        return self.scene_text_cache[transcript]
 
     def get_text_embedding(self, text: str) -> np.ndarray:
         """Генерирует текстовые эмбеддинги"""
+        return self.get_text_embeddings([text])[0]
+
+    def get_text_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Генерирует нормализованные текстовые эмбеддинги для списка текстов за один прямой проход.
+        
+        Args:
+            texts: Список текстов
+            
+        Returns:
+            Массив эмбеддингов формы (len(texts), D) с единичной нормой строк
+        """
         # Подготовка входных данных
-        inputs = self.processor(text=[text], return_tensors="pt", padding=True, truncation=True)
+        inputs = self.processor(text=texts, return_tensors="pt", padding=True, truncation=True)
         
         # Перемещение на нужное устройство
         inputs = self._move_to_device(inputs)
         
-        # Получаем эмбеддинги без вычисления градиентов
-        with torch.no_grad():
+        # Получаем эмбеддинги без вычисления градиентов и учета версий тензоров
+        with torch.inference_mode():
             outputs = self.model.get_text_features(**inputs)
         
         # Конвертируем результат в numpy
         embeddings = self._convert_to_numpy(outputs)
         
-        # Нормализуем вектор
-        return self._normalize_vector(embeddings)
+        # Нормализуем каждую строку на месте (нулевые строки остаются нулевыми)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings
+
+    def _precompute_text_embeddings(self, scenes: List[Dict[str, Any]], plots: List[Dict[str, Any]]) -> None:
+        """Заполняет кэши текстовых эмбеддингов сюжетов и транскриптов сцен одним батчем"""
+        pending = []  # (кэш, ключ, текст)
+        queued = set()
+        for plot in plots:
+            plot_key = self._plot_key(plot)
+            if plot_key not in self.plot_embeddings_cache and ('plot', plot_key) not in queued:
+                queued.add(('plot', plot_key))
+                pending.append((self.plot_embeddings_cache, plot_key,
+                                f"{plot['title']} {plot['description']} {' '.join(plot['keywords'])}"))
+            if plot_key not in self.plot_visual_embeddings_cache and ('visual', plot_key) not in queued:
+                queued.add(('visual', plot_key))
+                pending.append((self.plot_visual_embeddings_cache, plot_key,
+                                f"{plot['title']} {' '.join(plot['keywords'])}"))
+        for scene in scenes:
+            transcript = scene['audio_analysis']['transcript']
+            if transcript not in self.scene_text_cache and ('scene', transcript) not in queued:
+                queued.add(('scene', transcript))
+                pending.append((self.scene_text_cache, transcript, transcript))
+        
+        if not pending:
+            return
+        
+        embeddings = self.get_text_embeddings([text for _, _, text in pending])
+        for (cache, key, _), embedding in zip(pending, embeddings):
+            cache[key] = embedding
+            if cache is not self.scene_text_cache:
+                self._plot_cache_dirty = True
 
     def get_frame_embedding(self, frame_embeddings: np.ndarray) -> np.ndarray:
         # Усреднение эмбеддингов кадров для получения одного векторного представления
-        mean_embedding = np.mean(frame_embeddings, axis=0)
+        # Накопление в float32 без промежуточного преобразования в float64
+        mean_embedding = np.asarray(frame_embeddings, dtype=np.float32).mean(axis=0, dtype=np.float32)
         # Нормализуем вектор
         return self._normalize_vector(mean_embedding)
 
@@ -94,7 +178,7 @@ class SimpleStorylineMatcher:
         Получает эмбеддинг для сюжета, используя кэш для избежания повторных вычислений
         """
         # Генерируем уникальный ключ для сюжета
-        plot_key = plot.get('id', str(hash(f"{plot['title']}{plot['description']}{''.join(plot['keywords'])}")))
+        plot_key = self._plot_key(plot)
         
         # Проверяем, есть ли эмбеддинг в кэше
         if plot_key in self.plot_embeddings_cache:
@@ -104,56 +188,86 @@ class SimpleStorylineMatcher:
         plot_text = f"{plot['title']} {plot['description']} {' '.join(plot['keywords'])}"
         embedding = self.get_text_embedding(plot_text)
         self.plot_embeddings_cache[plot_key] = embedding
+        self._plot_cache_dirty = True
         return embedding
 
-    def calculate_similarity(self, scene, plot) -> dict:
-        # Получение текстовых эмбеддингов для транскрипта сцены и описания сюжета
-        text_embedding_scene = self.get_text_embedding(scene['audio_analysis']['transcript'])
-        text_embedding_plot = self.get_plot_embedding(plot)  # Используем кэшированный эмбеддинг
-        visual_embedding_plot = self.get_visual_embedding_for_plot(plot)
-
-        # Получение усредненных эмбеддингов кадров для сцены
-        frame_embedding_scene = self.get_frame_embedding(scene['frame_analysis']['embeddings'])
-
-        # Вычисление косинусного сходства для текстовых и визуальных эмбеддингов
-        # Поскольку векторы уже нормализованы, используем dot product
-        text_similarity = float(np.dot(text_embedding_scene, text_embedding_plot))
-        image_similarity = float(np.dot(frame_embedding_scene, visual_embedding_plot))
+    def _plot_key(self, plot: Dict[str, Any]) -> str:
+        """
+        Возвращает ключ сюжета для кэшей эмбеддингов: стабильный между процессами хэш
+        модели и содержимого сюжета (id сюжета не уникален между запросами).
+        """
+        raw_key = f"{self.model_name}|{plot['title']}|{plot['description']}|{','.join(plot['keywords'])}"
+        return hashlib.blake2b(raw_key.encode("utf-8"), digest_size=16).hexdigest()
 
-        similarity_score = 0.3 * text_similarity + 0.7 * image_similarity
+    def _load_plot_cache(self) -> None:
+        """Загружает сохраненные эмбеддинги сюжетов с диска"""
+        if not os.path.exists(self.plot_cache_path):
+            return
+        try:
+            with np.load(self.plot_cache_path) as cached:
+                for name in cached.files:
+                    kind, plot_key = name.split("_", 1)
+                    cache = self.plot_embeddings_cache if kind == "text" else self.plot_visual_embeddings_cache
+                    cache[plot_key] = cached[name]
+            logging.info(f"SimpleStorylineMatcher: Загружено {len(self.plot_embeddings_cache)} эмбеддингов сюжетов из {self.plot_cache_path}")
+        except Exception as e:
+            logging.warning(f"SimpleStorylineMatcher: Не удалось загрузить кэш эмбеддингов сюжетов: {str(e)}")
 
-        return {
-            'sceneId': scene['id'],
-            'plotId': plot['id'],
-            'similarityScore': similarity_score,
-            'breakdown': {
-                'textSimilarity': text_similarity,
-                'imageSimilarity': image_similarity
-            }
-        }
+    def _save_plot_cache(self) -> None:
+        """Атомарно сохраняет эмбеддинги сюжетов на диск, если появились новые"""
+        if not self._plot_cache_dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.plot_cache_path), exist_ok=True)
+            arrays = {f"text_{key}": value for key, value in self.plot_embeddings_cache.items()}
+            arrays.update({f"visual_{key}": value for key, value in self.plot_visual_embeddings_cache.items()})
+            tmp_path = f"{self.plot_cache_path}.tmp.npz"
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, self.plot_cache_path)
+            self._plot_cache_dirty = False
+        except Exception as e:
+            logging.warning(f"SimpleStorylineMatcher: Не удалось сохранить кэш эмбеддингов сюжетов: {str(e)}")
 
     def match_scenes_to_plots(self, scenes, plots):
         # Логирование начала процесса сопоставления
         logging.info("Начало сопоставления сцен с сюжетами")
         logging.info(f"Количество сцен: {len(scenes)}, количество сюжетов: {len(plots)}")
         
-        # Предварительное вычисление эмбеддингов для всех сюжетов
-        for plot in plots:
-            self.get_plot_embedding(plot)
+        # Предварительное вычисление текстовых эмбеддингов для всех сюжетов и сцен одним батчем
+        self._precompute_text_embeddings(scenes, plots)
         logging.info(f"Эмбеддинги для {len(plots)} сюжетов вычислены и кэшированы")
         
-        # Сопоставление каждой сцены с каждым сюжетом и вычисление схожести
+        if not scenes or not plots:
+            logging.info("Завершение сопоставления сцен с сюжетами")
+            return []
+        
+        # Собираем нормализованные эмбеддинги сцен (N, D) и сюжетов (M, D) в матрицы
+        scene_ids = [scene.get('id') for scene in scenes]
+        scene_text = np.stack([self.get_scene_text_embedding(scene['audio_analysis']['transcript']) for scene in scenes])
+        scene_visual = np.stack([self.get_frame_embedding(decode_embeddings(scene['frame_analysis'])) for scene in scenes])
+        plot_text = np.stack([self.get_plot_embedding(plot) for plot in plots])
+        plot_visual = np.stack([self.get_visual_embedding_for_plot(plot) for plot in plots])
+        
+        # Схожесть всех пар сцена-сюжет за два матричных умножения
+        text_similarity = scene_text @ plot_text.T
+        image_similarity = scene_visual @ plot_visual.T
+        scores = _TEXT_WEIGHT * text_similarity + _IMAGE_WEIGHT * image_similarity
+        
+        # Перебираем пары по убыванию схожести
+        order = np.argsort(-scores, axis=None, kind="stable")
         results = []
-        for scene in scenes:
-            scene_id = scene.get('id')
-            logging.info(f"Сопоставление сцены: {scene_id}")
-            
-            for plot in plots:
-                result = self.calculate_similarity(scene, plot)
-                results.append(result)
+        for scene_idx, plot_idx in zip(*np.unravel_index(order, scores.shape)):
+            results.append({
+                'sceneId': scene_ids[scene_idx],
+                'plotId': plots[plot_idx]['id'],
+                'similarityScore': float(scores[scene_idx, plot_idx]),
+                'breakdown': {
+                    'textSimilarity': float(text_similarity[scene_idx, plot_idx]),
+                    'imageSimilarity': float(image_similarity[scene_idx, plot_idx])
+                }
+            })
         
-        # Просто сортируем все результаты по убыванию схожести
-        results.sort(key=lambda x: x['similarityScore'], reverse=True)
+        self._save_plot_cache()
         
         # Логирование завершения процесса сопоставления
         logging.info("Завершение сопоставления сцен с сюжетами")
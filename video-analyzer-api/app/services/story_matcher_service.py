@@ -1,7 +1,9 @@
 import logging
 from sentence_transformers import CrossEncoder
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import os
+import numpy as np
+import torch
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +13,29 @@ class StoryMatcherService:
         model_id = os.getenv("CROSS_ENCODER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
         logger.info(f"Инициализация StoryMatcherService с CrossEncoder {model_id}")
         self.model = CrossEncoder(model_id)
+        # Размер батча пар (сюжет, описание) для одного прямого прохода
+        self.batch_size = int(os.getenv("CROSS_ENCODER_BATCH_SIZE", "64"))
+        
+        # На GPU модель работает в float16 (и опционально компилируется)
+        if torch.cuda.is_available() and self.model.model.device.type == "cuda":
+            self._optimize_for_gpu()
+    
+    def _optimize_for_gpu(self) -> None:
+        """Переводит CrossEncoder в float16 и компилирует прямой проход, проверяя результат на тестовой паре"""
+        self.model.model.half()
+        if os.getenv("CROSS_ENCODER_TORCH_COMPILE", "false").lower() in ('true', '1', 'yes', 'y'):
+            # Длина входа меняется от батча к батчу, поэтому компилируем с динамическими формами
+            self.model.model.forward = torch.compile(self.model.model.forward, dynamic=True)
+        
+        try:
+            with torch.inference_mode():
+                self.model.predict([("test", "test")], show_progress_bar=False)
+            logger.info("CrossEncoder переведен в float16 на GPU")
+        except Exception as e:
+            logger.warning(f"Не удалось запустить CrossEncoder в float16, используется float32: {str(e)}")
+            # Убираем скомпилированный forward, возвращаясь к методу класса
+            self.model.model.__dict__.pop("forward", None)
+            self.model.model.float()
         
     def calculate_similarity(self, description: str, story: str) -> float:
         """
@@ -35,4 +60,34 @@ class StoryMatcherService:
             
         except Exception as e:
             logger.error(f"Ошибка при вычислении схожести: {str(e)}")
-            return 0.0 
\ No newline at end of file
+            return 0.0 
+    
+    def calculate_similarities(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Вычисляет схожесть для списка пар (описание сцены, сюжет) батчами
+        
+        Args:
+            pairs: Список пар (описание сцены, сюжет)
+            
+        Returns:
+            np.ndarray: Оценки схожести от 0 до 1 в порядке пар
+        """
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        
+        try:
+            # Модель ожидает пары в порядке (сюжет, описание)
+            with torch.inference_mode():
+                scores = self.model.predict(
+                    [(story, description) for description, story in pairs],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                    convert_to_numpy=True
+                )
+            
+            logger.info(f"Вычислена схожесть для {len(pairs)} пар")
+            return np.clip(scores, 0.0, 1.0)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при вычислении схожести: {str(e)}")
+            return np.zeros(len(pairs), dtype=np.float32)
@@ -1,6 +1,9 @@
+import heapq
 import logging
 from typing import Dict, List, Any
 
+import numpy as np
+
 from app.services.base_analyzer import BaseAnalyzer
 
 logger = logging.getLogger(__name__)
@@ -67,36 +70,45 @@ class StorylineGrouper(BaseAnalyzer):
                 })
             return storylines
         
-        # Сортируем сцены по длительности (от самых длинных)
-        sorted_scenes = sorted(scenes, key=lambda s: s["duration"], reverse=True)
+        # Границы сцен в виде массивов для векторизованной проверки близости
+        starts = np.fromiter((scene["start_time"] for scene in scenes), dtype=np.float64, count=len(scenes))
+        ends = np.fromiter((scene["end_time"] for scene in scenes), dtype=np.float64, count=len(scenes))
+        # Порядок сцен по времени начала и по времени конца (вычисляется один раз для всех сюжетных линий)
+        order_by_start = np.argsort(starts, kind="stable")
+        order_by_end = np.argsort(ends, kind="stable")
+        sorted_starts = starts[order_by_start]
+        sorted_ends = ends[order_by_end]
+        # Позиция каждой сцены в порядке по времени начала
+        start_rank = np.empty(len(scenes), dtype=np.intp)
+        start_rank[order_by_start] = np.arange(len(scenes))
         
         # Берем N самых длинных сцен как базовые для сюжетных линий
-        key_scenes = sorted_scenes[:num_storylines]
+        key_indices = heapq.nlargest(num_storylines, range(len(scenes)), key=lambda idx: scenes[idx]["duration"])
+        
+        # Определяем "радиус" близости как определенный процент от длительности всего видео
+        video_duration = scenes[-1]["end_time"]
+        proximity_radius = video_duration * self.proximity_radius_percent
         
         # Для каждой ключевой сцены, находим близкие сцены по времени
         storylines = []
-        for i, key_scene in enumerate(key_scenes):
-            key_start = key_scene["start_time"]
-            key_end = key_scene["end_time"]
+        for i, key_idx in enumerate(key_indices):
+            key_start = starts[key_idx]
+            key_end = ends[key_idx]
             
-            # Определяем "радиус" близости как определенный процент от длительности всего видео
-            video_duration = scenes[-1]["end_time"]
-            proximity_radius = video_duration * self.proximity_radius_percent
-            
-            # Находим сцены, близкие к ключевой
-            storyline_scenes = [key_scene]
-            for scene in scenes:
-                # Пропускаем саму ключевую сцену
-                if scene["id"] == key_scene["id"]:
-                    continue
-                
-                # Проверяем близость сцены к ключевой
-                if (abs(scene["start_time"] - key_end) < proximity_radius or 
-                    abs(scene["end_time"] - key_start) < proximity_radius):
-                    storyline_scenes.append(scene)
+            # Находим сцены, близкие к ключевой, бинарным поиском по отсортированным границам:
+            # начало в интервале (key_end - r, key_end + r) или конец в интервале (key_start - r, key_start + r)
+            starts_from = np.searchsorted(sorted_starts, key_end - proximity_radius, side="right")
+            starts_to = np.searchsorted(sorted_starts, key_end + proximity_radius, side="left")
+            ends_from = np.searchsorted(sorted_ends, key_start - proximity_radius, side="right")
+            ends_to = np.searchsorted(sorted_ends, key_start + proximity_radius, side="left")
+            close_indices = np.union1d(
+                np.union1d(order_by_start[starts_from:starts_to], order_by_end[ends_from:ends_to]),
+                [key_idx]
+            )
             
-            # Сортируем сцены в сюжетной линии по времени начала
-            storyline_scenes.sort(key=lambda s: s["start_time"])
+            # Сцены сюжетной линии в порядке времени начала
+            close_indices = close_indices[np.argsort(start_rank[close_indices])]
+            storyline_scenes = [scenes[idx] for idx in close_indices]
             
             # Вычисляем общую длительность и время начала/конца сюжетной линии
             start_time = storyline_scenes[0]["start_time"]
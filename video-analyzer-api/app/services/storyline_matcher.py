@@ -1,10 +1,13 @@
+import hashlib
 import logging
-import nltk
+import re
+import shelve
+import threading
+from collections import OrderedDict
 import numpy as np
 import torch
 import os
 from typing import List, Dict, Any, Tuple, Optional
-from sklearn.metrics.pairwise import cosine_similarity
 from transformers import AutoTokenizer, AutoModel
 from app.models.storyline_matcher import (
     Character, UserStoryline, SceneMatch, 
@@ -14,6 +17,42 @@ from app.models.storyline_matcher import (
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 
+# Размер блока строк при вычислении попарного сходства сцен (ограничивает память вместо полной матрицы N x N)
+_SIMILARITY_BLOCK_SIZE = 1024
+
+# Общий для всех экземпляров LRU-кэш embeddings текстов ((модель, текст) -> embedding): сюжеты, персонажи и
+# транскрипции повторяются между запросами, а сервис создается заново на каждый запрос
+_EMBEDDING_CACHE: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+_EMBEDDING_CACHE_LOCK = threading.Lock()
+
+# Дисковый кэш embeddings между перезапусками (открывается при первом обращении, доступ под _EMBEDDING_CACHE_LOCK).
+# Размер кэша не ограничивается: около 3 КБ на текст для rubert-base, для очистки достаточно удалить файлы кэша
+_EMBEDDING_DISK_CACHE: Optional[shelve.Shelf] = None
+# Признак того, что дисковый кэш открыть не удалось (повторные попытки не выполняются)
+_EMBEDDING_DISK_CACHE_FAILED = False
+_EMBEDDING_DISK_CACHE_PATH = os.getenv(
+    "TEXT_EMBEDDING_CACHE_PATH",
+    os.path.join(os.environ.get("SHARED_DATA_DIR", "/app/shared-data"), "cache", "text_embeddings")
+)
+
+
+def _get_disk_cache() -> Optional[shelve.Shelf]:
+    """Открывает дисковый кэш embeddings при первом обращении (вызывается под _EMBEDDING_CACHE_LOCK)"""
+    global _EMBEDDING_DISK_CACHE, _EMBEDDING_DISK_CACHE_FAILED
+    if _EMBEDDING_DISK_CACHE is None and _EMBEDDING_DISK_CACHE_PATH and not _EMBEDDING_DISK_CACHE_FAILED:
+        try:
+            os.makedirs(os.path.dirname(_EMBEDDING_DISK_CACHE_PATH), exist_ok=True)
+            _EMBEDDING_DISK_CACHE = shelve.open(_EMBEDDING_DISK_CACHE_PATH)
+        except Exception as e:
+            _EMBEDDING_DISK_CACHE_FAILED = True
+            logger.warning(f"Не удалось открыть дисковый кэш embeddings {_EMBEDDING_DISK_CACHE_PATH}, "
+                           f"дисковый кэш отключен: {str(e)}")
+            return None
+    return _EMBEDDING_DISK_CACHE
+
+# Входы BERT-модели при экспорте в ONNX
+_ONNX_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+
 class StorylineMatcher:
     """
     Сервис для сопоставления сцен с пользовательскими сюжетами.
@@ -25,27 +64,56 @@ class StorylineMatcher:
         """
         Инициализация сервиса сопоставления сцен с сюжетами.
         """
-        # Загрузка необходимых ресурсов NLTK
-        try:
-            nltk.data.find('tokenizers/punkt')
-        except LookupError:
-            logger.info("Загрузка NLTK punkt tokenizer")
-            nltk.download('punkt')
-        
         # NLP модели будут инициализированы при первом использовании
         self.tokenizer = None
         self.model = None
+        self._onnx_session = None
+        # Размерность embeddings и нулевой embedding для пустых текстов (определяются по конфигурации модели)
+        self.embed_dim = 0
+        self._zero_embedding: Optional[np.ndarray] = None
+        
+        # Embeddings текстов текущего сопоставления (текст -> embedding), чтобы не считать один текст повторно
+        self._text_embeddings: Dict[str, np.ndarray] = {}
+        # Имена персонажей и ключевые слова текущего сопоставления в нижнем регистре (термин -> lower)
+        self._lowered_terms: Dict[str, str] = {}
         
         # Читаем настройки из переменных окружения
+        # Модель для текстовых embeddings (например, более быстрая cointegrated/rubert-tiny2)
+        self.model_name = os.environ.get('TEXT_MODEL_NAME', 'DeepPavlov/rubert-base-cased')
         self.enable_character_matching = self._get_env_bool('ENABLE_CHARACTER_MATCHING', True)
         self.enable_keyword_matching = self._get_env_bool('ENABLE_KEYWORD_MATCHING', True)
         self.min_scene_score_threshold = self._get_env_float('MIN_SCENE_SCORE_THRESHOLD', 0.2)
+        self.embedding_batch_size = int(self._get_env_float('TEXT_EMBEDDING_BATCH_SIZE', 32))
+        # Максимальное число текстов в общем LRU-кэше embeddings (0 - кэш отключен)
+        self.embedding_cache_size = int(self._get_env_float('TEXT_EMBEDDING_CACHE_SIZE', 4096))
+        self.quantize_model = self._get_env_bool('TEXT_MODEL_QUANTIZE', True)
+        # Прямой проход на CPU под autocast в bfloat16 (выгодно на процессорах с AVX-512 BF16 / AMX)
+        self.cpu_bf16 = self._get_env_bool('TEXT_MODEL_CPU_BF16', False)
+        self.torch_compile = self._get_env_bool('TEXT_MODEL_TORCH_COMPILE', False)
+        # Число потоков PyTorch для инференса на CPU (0 - значение PyTorch по умолчанию)
+        self.num_threads = int(self._get_env_float('TEXT_MODEL_NUM_THREADS', 0))
+        device_preference = os.environ.get('TEXT_MODEL_DEVICE', 'cuda').lower()
+        self.device = "cuda" if device_preference == "cuda" and torch.cuda.is_available() else "cpu"
+        # Способ вычисления embeddings (устройство, тип данных, квантование, ONNX) - часть ключа дискового кэша,
+        # так как результаты разных способов немного отличаются. Уточняется после загрузки модели
+        if self.device == "cuda":
+            self._inference_mode = "cuda-fp16"
+        elif os.environ.get('TEXT_MODEL_USE_ONNX', '0') == '1':
+            self._inference_mode = "onnx-int8" if self.quantize_model else "onnx-fp32"
+        else:
+            self._inference_mode = self._torch_cpu_inference_mode()
         
         logger.info(f"Инициализирован StorylineMatcher с настройками: "
                    f"enable_character_matching={self.enable_character_matching}, "
                    f"enable_keyword_matching={self.enable_keyword_matching}, "
                    f"min_scene_score_threshold={self.min_scene_score_threshold}")
     
+    def _torch_cpu_inference_mode(self) -> str:
+        """Способ вычисления embeddings моделью PyTorch на CPU (см. инициализацию модели)"""
+        if self.cpu_bf16:
+            return "cpu-bf16"
+        return "cpu-int8" if self.quantize_model else "cpu-fp32"
+    
     def _get_env_bool(self, env_name: str, default: bool) -> bool:
         """Получает булево значение из переменной окружения"""
         value = os.environ.get(env_name, str(default)).lower()
@@ -65,21 +133,89 @@ class StorylineMatcher:
         if self.tokenizer is None or self.model is None:
             # Используем русскоязычную модель BERT
             logger.info("Загрузка языковой модели для анализа текста...")
-            model_name = "DeepPavlov/rubert-base-cased"
+            model_name = self.model_name
             
             try:
                 logger.info(f"Загрузка токенизатора {model_name}")
                 self.tokenizer = AutoTokenizer.from_pretrained(model_name)
                 
                 logger.info(f"Загрузка модели {model_name}")
-                self.model = AutoModel.from_pretrained(model_name)
+                # На GPU веса сразу загружаются в float16, без промежуточной копии в float32
+                self.model = AutoModel.from_pretrained(
+                    model_name,
+                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
+                    low_cpu_mem_usage=True
+                )
                 self.model.eval()  # Переключаем в режим оценки
                 
+                self.embed_dim = self.model.config.hidden_size
+                self._zero_embedding = np.zeros(self.embed_dim, dtype=np.float32)
+                self._zero_embedding.flags.writeable = False
+                
+                if self.device == "cuda":
+                    # На GPU модель работает в float16 на тензорных ядрах
+                    self.model = self.model.to(self.device)
+                    logger.info(f"Модель {model_name} перенесена на GPU (float16)")
+                elif not self._load_onnx_session(model_name):
+                    self._inference_mode = self._torch_cpu_inference_mode()
+                    self._configure_cpu_threads()
+                    if self.cpu_bf16:
+                        # Квантованные слои ожидают float32 на входе, поэтому bfloat16 autocast заменяет квантование
+                        logger.info(f"Модель {model_name} будет работать на CPU под autocast в bfloat16")
+                    elif self.quantize_model:
+                        # Без ONNX Runtime на CPU динамическое INT8-квантование линейных слоев ускоряет их в 2-4 раза
+                        # (LayerNorm и GELU остаются в float32)
+                        self.model = torch.ao.quantization.quantize_dynamic(
+                            self.model, {torch.nn.Linear}, dtype=torch.qint8
+                        )
+                        logger.info(f"Модель {model_name} квантована в INT8 (динамическое квантование Linear)")
+                
+                if self._onnx_session is None:
+                    self._compile_model()
+                
                 logger.info(f"Модель {model_name} успешно инициализирована для анализа текста")
             except Exception as e:
                 logger.error(f"Ошибка при инициализации модели: {str(e)}")
                 raise
     
+    def _configure_cpu_threads(self) -> None:
+        """
+        Настраивает параллелизм PyTorch для инференса на CPU: внутриоператорные потоки по числу
+        ядер и один межоператорный поток, чтобы не перегружать ядра поверх параллельных GEMM.
+        Настройка действует на весь процесс; при параллельной обработке нескольких запросов
+        лучше задать TEXT_MODEL_NUM_THREADS=1 и масштабироваться процессами.
+        """
+        if self.num_threads <= 0:
+            return
+        
+        torch.set_num_threads(self.num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            # Межоператорный пул можно настроить только до начала параллельной работы в процессе
+            logger.warning(f"Не удалось изменить число межоператорных потоков: {str(e)}")
+        logger.info(f"PyTorch на CPU использует {torch.get_num_threads()} потоков")
+    
+    def _compile_model(self) -> None:
+        """
+        Опционально (TEXT_MODEL_TORCH_COMPILE=true) компилирует модель через torch.compile, чтобы слить
+        attention, LayerNorm и GELU в меньшее число ядер. Длина входа меняется от батча к батчу, поэтому
+        компилируем с динамическими формами. Компиляция проверяется тестовым прогоном, при ошибке
+        остается исходная модель.
+        """
+        if not self.torch_compile or not hasattr(torch, "compile"):
+            return
+        
+        eager_model = self.model
+        try:
+            logger.info("Компиляция текстовой модели через torch.compile(dynamic=True)")
+            self.model = torch.compile(eager_model, dynamic=True)
+            features = [dict(self.tokenizer("пример текста", truncation=True, max_length=512))]
+            self._encode_batch_torch(features)
+        except Exception as e:
+            logger.warning(f"Не удалось скомпилировать текстовую модель, используется исходная: {str(e)}")
+            self.model = eager_model
+    
     def match_scenes_to_storylines(
         self, 
         scenes: List[Dict[str, Any]], 
@@ -106,15 +242,22 @@ class StorylineMatcher:
         logger.info("Инициализация модели для анализа текста")
         self._initialize_model()
         
+        # Кэш embeddings действует в пределах одного сопоставления
+        self._text_embeddings = {}
+        
         # Создаем словарь персонажей для быстрого доступа
         logger.info("Создание словаря персонажей")
         character_map = {char.name: char for char in characters}
         logger.info(f"Создан словарь с {len(character_map)} персонажами")
         
+        # Поля сцен, нужные на нескольких этапах, извлекаем один раз в виде столбцов
+        transcripts = [scene.get("audio_analysis", {}).get("transcript", "") for scene in scenes]
+        start_times = np.fromiter((scene["start_time"] for scene in scenes), dtype=np.float64, count=len(scenes))
+        
         # Получаем embeddings для сцен и сюжетов
         logger.info("Создание эмбеддингов для сцен и сюжетов")
         try:
-            scene_embeddings, storyline_embeddings = self._create_embeddings(scenes, storylines, character_map)
+            scene_embeddings, storyline_embeddings = self._create_embeddings(scenes, transcripts, storylines, character_map)
             logger.info(f"Созданы эмбеддинги: {scene_embeddings.shape} для сцен, {storyline_embeddings.shape} для сюжетов")
         except Exception as e:
             logger.error(f"Ошибка при создании эмбеддингов: {str(e)}")
@@ -122,9 +265,37 @@ class StorylineMatcher:
         
         # Вычисляем матрицу сходства между сценами и сюжетами
         logger.info("Вычисление матрицы сходства между сценами и сюжетами")
-        similarity_matrix = cosine_similarity(scene_embeddings, storyline_embeddings)
+        similarity_matrix = scene_embeddings @ storyline_embeddings.T
         logger.info(f"Размер матрицы сходства: {similarity_matrix.shape}")
         
+        # Сходство всех сцен со всеми (уникальными) ключевыми словами сюжетов одним матричным умножением
+        keyword_index: Dict[str, int] = {}
+        keyword_similarity = np.zeros((len(scenes), 0), dtype=np.float32)
+        if self.enable_keyword_matching:
+            keyword_index = {
+                keyword: i for i, keyword in enumerate(dict.fromkeys(kw for storyline in storylines for kw in storyline.keywords))
+            }
+            keyword_embeddings = np.empty((len(keyword_index), self.embed_dim), dtype=np.float32)
+            for keyword, i in keyword_index.items():
+                keyword_embeddings[i] = self._get_text_embedding(keyword)
+            keyword_similarity = scene_embeddings @ keyword_embeddings.T
+            logger.info(f"Размер матрицы сходства сцен с ключевыми словами: {keyword_similarity.shape}")
+        
+        # Сходство всех сцен с описаниями персонажей сюжетов одним матричным умножением
+        character_index: Dict[str, int] = {}
+        character_similarity = np.zeros((len(scenes), 0), dtype=np.float32)
+        if self.enable_character_matching:
+            character_index = {
+                name: i for i, name in enumerate(dict.fromkeys(
+                    name for storyline in storylines for name in storyline.characters if name in character_map
+                ))
+            }
+            character_embeddings = np.empty((len(character_index), self.embed_dim), dtype=np.float32)
+            for name, i in character_index.items():
+                character_embeddings[i] = self._get_text_embedding(character_map[name].description)
+            character_similarity = scene_embeddings @ character_embeddings.T
+            logger.info(f"Размер матрицы сходства сцен с персонажами: {character_similarity.shape}")
+        
         # Выполняем кластеризацию для обнаружения групп связанных сцен
         logger.info("Кластеризация связанных сцен")
         scene_clusters = self._cluster_related_scenes(scenes, storylines, scene_embeddings)
@@ -136,16 +307,30 @@ class StorylineMatcher:
         
         # Обнаруживаем переходы между сюжетами
         logger.info("Определение переходов между сюжетами")
-        storyline_transitions = self._detect_storyline_transitions(scenes, scene_clusters)
+        storyline_transitions = self._detect_storyline_transitions(scenes, scene_clusters, start_times)
         logger.info(f"Найдено {len(storyline_transitions)} переходов между сюжетами")
+        # Позиция каждой пары (сюжет, сцена) в последовательности переходов для поиска за O(1)
+        transition_positions = {transition: i for i, transition in enumerate(storyline_transitions)}
         
         # Формируем результаты
         logger.info("Создание итоговых результатов сопоставления")
         results = []
         
+        # Транскрипции, имена персонажей и ключевые слова в нижнем регистре готовим один раз для поиска упоминаний
+        transcripts_lc = [transcript.lower() for transcript in transcripts]
+        self._lowered_terms = {}
+        for char in characters:
+            self._lowered_terms[char.name] = char.name.lower()
+            self._lowered_terms.update((kw, kw.lower()) for kw in char.keywords)
+        for storyline in storylines:
+            self._lowered_terms.update((kw, kw.lower()) for kw in storyline.keywords)
+        
         for storyline_idx, storyline in enumerate(storylines):
             logger.info(f"Обработка сюжета {storyline_idx}: '{storyline.title}'")
             
+            # Одно регулярное выражение для всех имен и ключевых слов сюжета
+            terms_pattern = self._compile_terms_pattern(storyline, character_map)
+            
             # Находим сцены, связанные с этим сюжетом
             related_indices = scene_clusters[storyline_idx]["scene_indices"]
             scene_similarities = similarity_matrix[:, storyline_idx]
@@ -161,28 +346,30 @@ class StorylineMatcher:
                 
                 # Если оценка выше порога, добавляем сцену
                 if score > self.min_scene_score_threshold:
-                    logger.info(f"Сцена {scene['id']} имеет оценку сходства {score:.4f} > {self.min_scene_score_threshold}, анализируем детали")
+                    logger.debug("Сцена %s имеет оценку сходства %.4f > %s, анализируем детали", scene['id'], score, self.min_scene_score_threshold)
                     
                     # Анализируем совпадения с персонажами и ключевыми словами, если включено
                     character_matches = {}
                     keyword_matches = {}
+                    # Все упоминания имен и ключевых слов находим за один проход по транскрипции
+                    mentions = set(terms_pattern.findall(transcripts_lc[idx]))
                     
                     if self.enable_character_matching:
-                        character_matches = self._match_characters(scene, storyline, character_map)
-                        logger.info(f"Сцена {scene['id']}: найдены совпадения с {len(character_matches)} персонажами")
+                        character_matches = self._match_characters(scene, storyline, character_map, mentions, character_similarity[idx], character_index)
+                        logger.debug("Сцена %s: найдены совпадения с %s персонажами", scene['id'], len(character_matches))
                     
                     if self.enable_keyword_matching:
-                        keyword_matches = self._match_keywords(scene, storyline.keywords)
-                        logger.info(f"Сцена {scene['id']}: найдены совпадения с {len(keyword_matches)} ключевыми словами")
+                        keyword_matches = self._match_keywords(scene, storyline.keywords, mentions, keyword_similarity[idx], keyword_index)
+                        logger.debug("Сцена %s: найдены совпадения с %s ключевыми словами", scene['id'], len(keyword_matches))
                     
                     # Применяем контекстные бонусы к оценке
                     original_score = score
                     score = self._apply_context_bonuses(
-                        score, idx, storyline_idx, storyline_transitions
+                        score, idx, storyline_idx, storyline_transitions, transition_positions
                     )
                     
                     if score != original_score:
-                        logger.info(f"Оценка сцены {scene['id']} изменена с {original_score:.4f} на {score:.4f} на основе контекста")
+                        logger.debug("Оценка сцены %s изменена с %.4f на %.4f на основе контекста", scene['id'], original_score, score)
                     
                     # Создаем объект сцены
                     matched_scenes.append(SceneMatch(
@@ -194,10 +381,10 @@ class StorylineMatcher:
                         start_time=scene["start_time"],
                         end_time=scene["end_time"],
                         duration=scene["duration"],
-                        transcript=scene.get("audio_analysis", {}).get("transcript", "")
+                        transcript=transcripts[idx]
                     ))
                 else:
-                    logger.info(f"Сцена {scene['id']} имеет слишком низкую оценку: {score:.4f} < {self.min_scene_score_threshold}, пропускаем")
+                    logger.debug("Сцена %s имеет слишком низкую оценку: %.4f < %s, пропускаем", scene['id'], score, self.min_scene_score_threshold)
             
             # Сортировка сцен по оценке совпадения (от высшей к низшей)
             matched_scenes.sort(key=lambda x: x.score, reverse=True)
@@ -209,15 +396,19 @@ class StorylineMatcher:
                 for i, scene in enumerate(top_scenes):
                     logger.info(f"Топ-{i+1} сцена для '{storyline.title}': {scene.scene_id}, оценка: {scene.score:.4f}, продолжительность: {scene.duration:.2f} сек")
             
+            # Оценки и длительности подобранных сцен одним массивом
+            scores = np.fromiter((scene.score for scene in matched_scenes), dtype=np.float64, count=len(matched_scenes))
+            durations = np.fromiter((scene.duration for scene in matched_scenes), dtype=np.float64, count=len(matched_scenes))
+            
             # Вычисление общей длительности
-            total_duration = sum(scene.duration for scene in matched_scenes)
+            total_duration = float(durations.sum())
             
             # Добавление результата сюжета
             try:
                 characters_for_storyline = [character_map[name] for name in storyline.characters if name in character_map]
                 logger.info(f"Найдено {len(characters_for_storyline)} персонажей для сюжета '{storyline.title}'")
                 
-                avg_score = sum(scene.score for scene in matched_scenes) / len(matched_scenes) if matched_scenes else 0
+                avg_score = float(scores.mean()) if matched_scenes else 0
                 
                 storyline_result = StorylineWithScenes(
                     title=storyline.title,
@@ -250,6 +441,7 @@ class StorylineMatcher:
     def _create_embeddings(
         self, 
         scenes: List[Dict[str, Any]], 
+        transcripts: List[str],
         storylines: List[UserStoryline],
         character_map: Dict[str, Character]
     ) -> Tuple[np.ndarray, np.ndarray]:
@@ -258,39 +450,29 @@ class StorylineMatcher:
         
         Args:
             scenes: Список сцен
+            transcripts: Транскрипции сцен
             storylines: Список сюжетов
             character_map: Словарь персонажей
             
         Returns:
             Кортеж из (embeddings сцен, embeddings сюжетов)
         """
-        # Создаем embeddings для сцен
+        # Собираем все тексты, которые понадобятся при сопоставлении, чтобы получить их embeddings одним батчем
         logger.info(f"Создание эмбеддингов для {len(scenes)} сцен")
-        scene_embeddings = []
-        
-        for i, scene in enumerate(scenes):
-            if i % 50 == 0:  # Логируем прогресс каждые 50 сцен
-                logger.info(f"Обработано {i}/{len(scenes)} сцен")
-                
-            transcript = scene.get("audio_analysis", {}).get("transcript", "")
-            
+        scene_texts = transcripts
+        for scene, transcript in zip(scenes, transcripts):
             # Если транскрипция отсутствует или пуста, логируем это
             if not transcript:
-                logger.info(f"Сцена {scene['id']} не имеет транскрипции, будет создан нулевой эмбеддинг")
-                
-            embedding = self._get_text_embedding(transcript)
-            scene_embeddings.append(embedding)
+                logger.debug("Сцена %s не имеет транскрипции, будет создан нулевой эмбеддинг", scene['id'])
         
-        scene_embeddings = np.vstack(scene_embeddings)
-        logger.info(f"Созданы эмбеддинги для сцен размерностью {scene_embeddings.shape}")
-        
-        # Создаем embeddings для сюжетов
         logger.info(f"Создание эмбеддингов для {len(storylines)} сюжетов")
-        storyline_embeddings = []
-        
+        storyline_texts = []
+        extra_texts = []
         for storyline in storylines:
             # Комбинируем название, описание и ключевые слова
             storyline_text = f"{storyline.title}. {storyline.description}. " + " ".join(storyline.keywords)
+            # Этот же текст без персонажей используется при кластеризации
+            extra_texts.append(storyline_text)
             
             # Добавляем информацию о персонажах, если они есть
             character_count = 0
@@ -299,13 +481,35 @@ class StorylineMatcher:
                     char = character_map[char_name]
                     storyline_text += f" {char.name}. {char.description}. " + " ".join(char.keywords)
                     character_count += 1
+                    if self.enable_character_matching:
+                        extra_texts.append(char.description)
             
-            logger.info(f"Сюжет '{storyline.title}': текст для эмбеддинга включает {character_count} персонажей, {len(storyline.keywords)} ключевых слов")
+            if self.enable_keyword_matching:
+                extra_texts.extend(storyline.keywords)
             
-            embedding = self._get_text_embedding(storyline_text)
-            storyline_embeddings.append(embedding)
+            logger.info(f"Сюжет '{storyline.title}': текст для эмбеддинга включает {character_count} персонажей, {len(storyline.keywords)} ключевых слов")
+            storyline_texts.append(storyline_text)
         
-        storyline_embeddings = np.vstack(storyline_embeddings)
+        # Один проход модели по всем уникальным текстам
+        unique_texts = list(dict.fromkeys(scene_texts + storyline_texts + extra_texts))
+        # Тексты из общего кэша не прогоняем через модель повторно
+        self._text_embeddings.update(self._lookup_cached_embeddings(unique_texts))
+        missing_texts = [text for text in unique_texts if text not in self._text_embeddings]
+        logger.info(f"Найдено в кэше {len(unique_texts) - len(missing_texts)} из {len(unique_texts)} текстов")
+        if missing_texts:
+            missing_embeddings = self._get_text_embeddings(missing_texts)
+            self._store_cached_embeddings(missing_texts, missing_embeddings)
+            # Строки общего массива запоминаем как представления, без копирования
+            self._text_embeddings.update(zip(missing_texts, missing_embeddings))
+        
+        scene_embeddings = np.empty((len(scene_texts), self.embed_dim), dtype=np.float32)
+        for i, text in enumerate(scene_texts):
+            scene_embeddings[i] = self._text_embeddings[text]
+        logger.info(f"Созданы эмбеддинги для сцен размерностью {scene_embeddings.shape}")
+        
+        storyline_embeddings = np.empty((len(storyline_texts), self.embed_dim), dtype=np.float32)
+        for i, text in enumerate(storyline_texts):
+            storyline_embeddings[i] = self._text_embeddings[text]
         logger.info(f"Созданы эмбеддинги для сюжетов размерностью {storyline_embeddings.shape}")
         
         return scene_embeddings, storyline_embeddings
@@ -318,29 +522,200 @@ class StorylineMatcher:
             text: Входной текст
             
         Returns:
-            Numpy массив с embedding
+            Numpy массив формы (embed_dim,) с embedding
         """
-        # Если текст пустой, возвращаем нулевой вектор
+        # Для пустого текста модель не нужна
         if not text:
-            # Размерность выходного вектора модели (для rubert-base это 768)
-            return np.zeros((1, 768))
+            return self._zero_embedding
+        
+        # Тексты, подготовленные в _create_embeddings, уже посчитаны батчем; остальные запоминаем до конца сопоставления
+        if text not in self._text_embeddings:
+            cached = self._lookup_cached_embeddings([text])
+            if cached:
+                self._text_embeddings.update(cached)
+            else:
+                embeddings = self._get_text_embeddings([text])
+                self._store_cached_embeddings([text], embeddings)
+                self._text_embeddings[text] = embeddings[0]
+        return self._text_embeddings[text]
+    
+    def _disk_cache_key(self, text: str) -> str:
+        """Ключ дискового кэша: модель, способ вычисления embeddings и хэш содержимого текста"""
+        return f"{self.model_name}:{self._inference_mode}:{hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()}"
+    
+    def _lookup_cached_embeddings(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Возвращает embeddings текстов, найденных в общем LRU-кэше (отмечая их как недавно
+        использованные) или в дисковом кэше (поднимая их в LRU-кэш)
+        """
+        found = {}
+        with _EMBEDDING_CACHE_LOCK:
+            disk_cache = _get_disk_cache() if self.embedding_cache_size > 0 else None
+            for text in texts:
+                embedding = _EMBEDDING_CACHE.get((self.model_name, text))
+                if embedding is not None:
+                    _EMBEDDING_CACHE.move_to_end((self.model_name, text))
+                    found[text] = embedding
+                elif text and disk_cache is not None:
+                    data = disk_cache.get(self._disk_cache_key(text))
+                    if data is not None:
+                        embedding = np.frombuffer(data, dtype=np.float32)
+                        _EMBEDDING_CACHE[(self.model_name, text)] = embedding
+                        found[text] = embedding
+            self._evict_cached_embeddings()
+        return found
+    
+    def _store_cached_embeddings(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """Кладет embeddings в общий LRU-кэш, вытесняя давно не использованные тексты"""
+        if self.embedding_cache_size <= 0:
+            return
+        
+        with _EMBEDDING_CACHE_LOCK:
+            disk_cache = _get_disk_cache()
+            for text, embedding in zip(texts, embeddings):
+                if not text:
+                    continue
+                # Копия строки, чтобы кэш не удерживал весь массив батча; только для чтения
+                row = embedding.copy()
+                row.flags.writeable = False
+                _EMBEDDING_CACHE[(self.model_name, text)] = row
+                _EMBEDDING_CACHE.move_to_end((self.model_name, text))
+                if disk_cache is not None:
+                    disk_cache[self._disk_cache_key(text)] = row.tobytes()
+            if disk_cache is not None:
+                disk_cache.sync()
+            self._evict_cached_embeddings()
+    
+    def _evict_cached_embeddings(self) -> None:
+        """Вытесняет давно не использованные тексты из LRU-кэша (вызывается под _EMBEDDING_CACHE_LOCK)"""
+        while len(_EMBEDDING_CACHE) > self.embedding_cache_size:
+            _EMBEDDING_CACHE.popitem(last=False)
+    
+    def _get_text_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Получает L2-нормализованные embeddings для списка текстов батчами, чтобы косинусное
+        сходство сводилось к скалярному произведению. Для пустых текстов (и при ошибке модели)
+        возвращается нулевой вектор.
+        
+        Args:
+            texts: Входные тексты
+            
+        Returns:
+            Numpy массив формы (len(texts), embed_dim)
+        """
+        embeddings = np.zeros((len(texts), self.embed_dim), dtype=np.float32)
+        
+        # Токенизируем все непустые тексты один раз (без паддинга), чтобы знать их длину в токенах
+        text_indices = [i for i, text in enumerate(texts) if text]
+        if not text_indices:
+            return embeddings
+        encodings = self.tokenizer([texts[i] for i in text_indices], truncation=True, max_length=512)
+        token_lengths = [len(ids) for ids in encodings["input_ids"]]
+        
+        # Сортируем тексты по числу токенов: каждый батч дополняется только до своей максимальной длины
+        order = sorted(range(len(text_indices)), key=token_lengths.__getitem__)
+        
+        for start in range(0, len(order), self.embedding_batch_size):
+            batch_positions = order[start:start + self.embedding_batch_size]
+            batch_indices = [text_indices[pos] for pos in batch_positions]
+            try:
+                features = [{key: encodings[key][pos] for key in encodings.keys()} for pos in batch_positions]
+                if self._onnx_session is not None:
+                    embeddings[batch_indices] = self._encode_batch_onnx(features)
+                else:
+                    embeddings[batch_indices] = self._encode_batch_torch(features)
+            except Exception as e:
+                logger.error(f"Ошибка при создании эмбеддингов для {len(batch_indices)} текстов: {str(e)}")
+        
+        # Нормализуем один раз; нулевые векторы остаются нулевыми
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings
+    
+    def _encode_batch_torch(self, features: List[Dict[str, List[int]]]) -> np.ndarray:
+        """Прогоняет батч токенизированных текстов через PyTorch-модель и усредняет скрытые состояния по токенам"""
+        # Дополняем батч до максимальной длины в нем
+        inputs = self.tokenizer.pad(features, return_tensors="pt")
+        inputs = inputs.to(self.device, non_blocking=True)
+        
+        # Получение embeddings (на GPU веса уже в float16, на CPU опционально autocast в bfloat16)
+        use_bf16 = self.cpu_bf16 and self.device == "cpu"
+        with torch.inference_mode(), torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=use_bf16):
+            outputs = self.model(**inputs)
+        
+        # Усреднение по токенам без учета паддинга для получения embedding предложения
+        # (суммирование в float32, чтобы не терять точность при работе модели в float16)
+        hidden = outputs.last_hidden_state.float()
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled.cpu().numpy()
+    
+    def _encode_batch_onnx(self, features: List[Dict[str, List[int]]]) -> np.ndarray:
+        """Прогоняет батч токенизированных текстов через ONNX Runtime и усредняет скрытые состояния по токенам"""
+        inputs = self.tokenizer.pad(features, return_tensors="np")
+        feeds = {name: inputs[name].astype(np.int64) for name in _ONNX_INPUT_NAMES}
+        hidden = self._onnx_session.run(["last_hidden_state"], feeds)[0]
+        
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+    
+    def _load_onnx_session(self, model_name: str) -> bool:
+        """
+        Опционально (TEXT_MODEL_USE_ONNX=1, только CPU) экспортирует модель в ONNX, применяет
+        оптимизации графа ONNX Runtime для BERT (слияние attention и LayerNorm) и INT8-квантование.
+        Оптимизированная модель сохраняется на диск и переиспользуется при следующих запусках.
+        
+        Returns:
+            True, если используется ONNX Runtime, иначе False
+        """
+        if os.environ.get('TEXT_MODEL_USE_ONNX', '0') != '1' or self.device != "cpu":
+            return False
         
         try:
-            # Токенизация текста
-            inputs = self.tokenizer(text, return_tensors="pt", 
-                                padding=True, truncation=True, max_length=512)
+            import onnxruntime
             
-            # Получение embeddings
-            with torch.no_grad():
-                outputs = self.model(**inputs)
+            cache_dir = os.environ.get('TEXT_MODEL_ONNX_DIR', '/root/.cache/onnx')
+            base_name = model_name.replace('/', '--')
+            suffix = "int8" if self.quantize_model else "opt"
+            model_path = os.path.join(cache_dir, f"{base_name}_{suffix}.onnx")
             
-            # Усреднение по токенам для получения embedding предложения
-            embeddings = outputs.last_hidden_state.mean(dim=1).cpu().numpy()
-            return embeddings
+            if not os.path.exists(model_path):
+                from onnxruntime.transformers import optimizer
+                
+                logger.info(f"Экспорт модели {model_name} в ONNX")
+                os.makedirs(cache_dir, exist_ok=True)
+                export_path = os.path.join(cache_dir, f"{base_name}.onnx")
+                dummy = self.tokenizer(["пример текста"], return_tensors="pt")
+                dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in _ONNX_INPUT_NAMES}
+                dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+                torch.onnx.export(
+                    self.model,
+                    tuple(dummy[name] for name in _ONNX_INPUT_NAMES),
+                    export_path,
+                    input_names=list(_ONNX_INPUT_NAMES),
+                    output_names=["last_hidden_state", "pooler_output"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14
+                )
+                
+                optimized_path = os.path.join(cache_dir, f"{base_name}_opt.onnx")
+                optimized = optimizer.optimize_model(
+                    export_path, model_type="bert",
+                    num_heads=self.model.config.num_attention_heads, hidden_size=self.embed_dim
+                )
+                optimized.save_model_to_file(optimized_path)
+                
+                if self.quantize_model:
+                    from onnxruntime.quantization import quantize_dynamic, QuantType
+                    quantize_dynamic(optimized_path, model_path, weight_type=QuantType.QInt8)
+                logger.info(f"ONNX-модель сохранена в {model_path}")
+            
+            self._onnx_session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+            logger.info(f"Для {model_name} используется ONNX Runtime ({model_path})")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка при создании эмбеддинга для текста: {str(e)}")
-            # В случае ошибки возвращаем нулевой вектор
-            return np.zeros((1, 768))
+            logger.warning(f"ONNX Runtime недоступен, используется PyTorch: {str(e)}")
+            self._onnx_session = None
+            return False
     
     def _cluster_related_scenes(
         self, 
@@ -354,62 +729,58 @@ class StorylineMatcher:
         Args:
             scenes: Список сцен
             storylines: Список сюжетов
-            scene_embeddings: Embeddings сцен
+            scene_embeddings: Нормализованные embeddings сцен
             
         Returns:
             Словарь кластеров сцен для каждого сюжета
         """
-        # Вычисляем матрицу сходства между всеми сценами
-        logger.info("Вычисление матрицы сходства между всеми сценами")
-        scene_similarity_matrix = cosine_similarity(scene_embeddings)
-        logger.info(f"Матрица сходства между сценами размерностью {scene_similarity_matrix.shape}")
+        # Сходство всех сюжетов со всеми сценами одним матричным умножением
+        storyline_texts = [
+            f"{storyline.title}. {storyline.description}. " + " ".join(storyline.keywords)
+            for storyline in storylines
+        ]
+        storyline_embeddings = np.empty((len(storyline_texts), self.embed_dim), dtype=np.float32)
+        for i, text in enumerate(storyline_texts):
+            storyline_embeddings[i] = self._get_text_embedding(text)
+        storyline_similarity = storyline_embeddings @ scene_embeddings.T
         
-        # Для каждого сюжета ищем тематически связанные сцены
-        scene_clusters = {}
+        # Сцены с высоким сходством с сюжетом (S x N)
+        threshold = 0.4  # Порог сходства
+        high_similarity = storyline_similarity > threshold
         
+        # Кластер сюжета: потенциальные сцены и все сцены, близкие хотя бы к одной из них.
+        # Пары тематически близких сцен считаем блоками строк, не храня полную матрицу N x N
+        logger.info("Вычисление сходства между всеми сценами")
+        related_mask = high_similarity.copy()
+        high_counts = high_similarity.astype(np.float32)
+        for start in range(0, len(scene_embeddings), _SIMILARITY_BLOCK_SIZE):
+            block = slice(start, start + _SIMILARITY_BLOCK_SIZE)
+            close_block = (scene_embeddings[block] @ scene_embeddings.T > 0.6).astype(np.float32)
+            related_mask |= high_counts[:, block] @ close_block > 0
+        related_counts = related_mask.sum(axis=1)
+        avg_similarities = np.where(
+            related_counts > 0,
+            (storyline_similarity * related_mask).sum(axis=1) / np.maximum(related_counts, 1),
+            0.0
+        )
+        
+        scene_clusters = {}
         for storyline_idx, storyline in enumerate(storylines):
-            logger.info(f"Кластеризация сцен для сюжета {storyline_idx}: '{storyline.title}'")
-            
-            # Создаем embedding для сюжета
-            storyline_text = f"{storyline.title}. {storyline.description}. " + " ".join(storyline.keywords)
-            storyline_embedding = self._get_text_embedding(storyline_text)
-            
-            # Вычисляем сходство с каждой сценой
-            logger.info(f"Вычисление сходства сюжета '{storyline.title}' со всеми сценами")
-            storyline_similarity = cosine_similarity(storyline_embedding, scene_embeddings).squeeze()
-            
-            # Находим сцены с высоким сходством с сюжетом
-            threshold = 0.4  # Порог сходства
-            high_similarity_indices = np.where(storyline_similarity > threshold)[0]
-            potential_scenes = [(i, storyline_similarity[i]) for i in high_similarity_indices]
+            logger.info(f"Найдено {int(high_similarity[storyline_idx].sum())} сцен с высоким сходством (>{threshold}) с сюжетом '{storyline.title}'")
             
-            logger.info(f"Найдено {len(potential_scenes)} сцен с высоким сходством (>{threshold}) с сюжетом '{storyline.title}'")
-            
-            # Для каждой потенциальной сцены находим тематически близкие другие сцены
-            related_scenes = set()
-            for idx, similarity in potential_scenes:
-                # Находим другие сцены с высоким сходством с текущей
-                scene_similarity = scene_similarity_matrix[idx]
-                similar_scenes = np.where(scene_similarity > 0.6)[0]
-                related_scenes.update(similar_scenes)
-                logger.info(f"Для сцены {scenes[idx]['id']} (сходство: {similarity:.4f}) найдено {len(similar_scenes)} похожих сцен")
-            
-            # Добавляем начальные потенциальные сцены
-            related_scenes.update([idx for idx, _ in potential_scenes])
-            
-            # Сортируем сцены по временной последовательности
-            related_scenes = sorted(related_scenes)
+            # Индексы сцен уже отсортированы по временной последовательности
+            related_scenes = np.flatnonzero(related_mask[storyline_idx]).tolist()
             
             # Некоторая статистика по идентификаторам сцен в кластере
             scene_ids = [scenes[idx]['id'] for idx in related_scenes[:min(5, len(related_scenes))]]
             logger.info(f"Кластер для сюжета '{storyline.title}' содержит {len(related_scenes)} сцен. Примеры: {', '.join(scene_ids)}")
             
-            avg_similarity = np.mean([storyline_similarity[i] for i in related_scenes]) if related_scenes else 0
+            avg_similarity = float(avg_similarities[storyline_idx])
             logger.info(f"Средняя схожесть сцен кластера '{storyline.title}' с сюжетом: {avg_similarity:.4f}")
             
             scene_clusters[storyline_idx] = {
                 "storyline": storyline,
-                "scene_indices": list(related_scenes),
+                "scene_indices": related_scenes,
                 "avg_similarity": avg_similarity
             }
         
@@ -418,7 +789,8 @@ class StorylineMatcher:
     def _detect_storyline_transitions(
         self, 
         scenes: List[Dict[str, Any]], 
-        scene_clusters: Dict[int, Dict[str, Any]]
+        scene_clusters: Dict[int, Dict[str, Any]],
+        start_times: np.ndarray
     ) -> List[Tuple[int, int]]:
         """
         Определяет переходы между сюжетами, анализируя последовательность сцен.
@@ -426,47 +798,42 @@ class StorylineMatcher:
         Args:
             scenes: Список сцен
             scene_clusters: Кластеры сцен для каждого сюжета
+            start_times: Время начала сцен
             
         Returns:
             Список кортежей (индекс сюжета, индекс сцены)
         """
+        if not scenes or not scene_clusters:
+            return []
+        
         # Сортируем сцены по времени
         logger.info("Сортировка сцен по времени для анализа переходов между сюжетами")
-        sorted_scene_indices = sorted(range(len(scenes)), key=lambda i: scenes[i]["start_time"])
+        sorted_scene_indices = np.argsort(start_times, kind="stable")
         
-        # Отслеживаем, к какому сюжету относится каждая сцена
+        # Отслеживаем, к какому сюжету относится каждая сцена (матрица принадлежности S x N)
         logger.info("Создание карты соответствия сцен сюжетам")
-        scene_to_storyline = {}
+        membership = np.zeros((len(scene_clusters), len(scenes)), dtype=bool)
+        avg_similarities = np.empty(len(scene_clusters), dtype=np.float64)
         for storyline_idx, cluster in scene_clusters.items():
-            for scene_idx in cluster["scene_indices"]:
-                if scene_idx not in scene_to_storyline:
-                    scene_to_storyline[scene_idx] = []
-                scene_to_storyline[scene_idx].append(storyline_idx)
+            membership[storyline_idx, cluster["scene_indices"]] = True
+            avg_similarities[storyline_idx] = cluster["avg_similarity"]
         
-        logger.info(f"Создана карта сцен и сюжетов, {len(scene_to_storyline)} сцен имеют соответствие с сюжетами")
+        storyline_counts = membership.sum(axis=0)
+        logger.info(f"Создана карта сцен и сюжетов, {int((storyline_counts > 0).sum())} сцен имеют соответствие с сюжетами")
+        logger.info(f"{int((storyline_counts > 1).sum())} сцен относятся к нескольким сюжетам, для них выбираем сюжет с наивысшим сходством")
         
-        # Анализируем последовательность сюжетов во времени
-        storyline_sequence = []
-        current_storyline = None
+        # Для каждой сцены выбираем сюжет с наивысшим сходством (при равенстве - с меньшим индексом)
+        best_storylines = np.where(membership, avg_similarities[:, None], -np.inf).argmax(axis=0)
         
-        for i in sorted_scene_indices:
-            storylines = scene_to_storyline.get(i, [])
-            
-            if not storylines:
-                continue
-            
-            # Если сцена относится к нескольким сюжетам, выбираем с наивысшим сходством
-            if len(storylines) > 1:
-                logger.info(f"Сцена {scenes[i]['id']} относится к {len(storylines)} сюжетам, выбираем с наивысшим сходством")
-                similarities = [scene_clusters[s]["avg_similarity"] for s in storylines]
-                best_storyline = storylines[similarities.index(max(similarities))]
-            else:
-                best_storyline = storylines[0]
-            
-            if best_storyline != current_storyline:
-                storyline_sequence.append((best_storyline, i))
-                logger.info(f"Обнаружен переход к сюжету {best_storyline} в сцене {scenes[i]['id']}")
-                current_storyline = best_storyline
+        # Анализируем последовательность сюжетов во времени: переход - смена сюжета у соседних привязанных сцен
+        assigned_scenes = sorted_scene_indices[storyline_counts[sorted_scene_indices] > 0]
+        sequence = best_storylines[assigned_scenes]
+        is_transition = np.ones(len(sequence), dtype=bool)
+        is_transition[1:] = sequence[1:] != sequence[:-1]
+        
+        storyline_sequence = list(zip(sequence[is_transition].tolist(), assigned_scenes[is_transition].tolist()))
+        for best_storyline, i in storyline_sequence:
+            logger.debug("Обнаружен переход к сюжету %s в сцене %s", best_storyline, scenes[i]['id'])
         
         logger.info(f"Определено {len(storyline_sequence)} переходов между сюжетами")
         return storyline_sequence
@@ -476,7 +843,8 @@ class StorylineMatcher:
         score: float, 
         scene_idx: int, 
         storyline_idx: int, 
-        storyline_transitions: List[Tuple[int, int]]
+        storyline_transitions: List[Tuple[int, int]],
+        transition_positions: Dict[Tuple[int, int], int]
     ) -> float:
         """
         Применяет контекстные бонусы к оценке сцены.
@@ -486,16 +854,13 @@ class StorylineMatcher:
             scene_idx: Индекс сцены
             storyline_idx: Индекс сюжета
             storyline_transitions: Переходы между сюжетами
+            transition_positions: Позиции пар (сюжет, сцена) в storyline_transitions
             
         Returns:
             Обновленную оценку с учетом контекста
         """
         # Находим позицию сцены в переходах
-        position = None
-        for i, (sl_idx, sc_idx) in enumerate(storyline_transitions):
-            if sl_idx == storyline_idx and sc_idx == scene_idx:
-                position = i
-                break
+        position = transition_positions.get((storyline_idx, scene_idx))
         
         if position is None:
             return score
@@ -507,16 +872,60 @@ class StorylineMatcher:
             
             # Если сцена находится между сценами того же сюжета
             if prev_storyline == storyline_idx or next_storyline == storyline_idx:
-                logger.info(f"Сцена с индексом {scene_idx} получает бонус +20% за нахождение в последовательности сюжета {storyline_idx}")
+                logger.debug("Сцена с индексом %s получает бонус +20%% за нахождение в последовательности сюжета %s", scene_idx, storyline_idx)
                 score *= 1.2  # Повышаем оценку на 20%
         
         return min(1.0, score)  # Ограничиваем максимальную оценку
     
+    def _compile_terms_pattern(
+        self, 
+        storyline: UserStoryline, 
+        character_map: Dict[str, Character]
+    ) -> "re.Pattern[str]":
+        """
+        Собирает имена персонажей, их ключевые слова и ключевые слова сюжета в одно регулярное выражение.
+        
+        Альтернативы отсортированы по убыванию длины и обернуты в lookahead, поэтому findall
+        возвращает в каждой позиции самый длинный совпавший термин, не пропуская перекрытия.
+        
+        Args:
+            storyline: Данные сюжета
+            character_map: Словарь персонажей
+            
+        Returns:
+            Скомпилированное регулярное выражение
+        """
+        terms = {self._lowered_terms[keyword] for keyword in storyline.keywords}
+        for char_name in storyline.characters:
+            if char_name in character_map:
+                terms.add(self._lowered_terms[char_name])
+                terms.update(self._lowered_terms[kw] for kw in character_map[char_name].keywords)
+        
+        if not terms:
+            # Выражение, которое ничего не находит
+            return re.compile(r"(?!)")
+        
+        alternation = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+        return re.compile(f"(?=({alternation}))")
+    
+    def _is_mentioned(self, term: str, mentions: set) -> bool:
+        """
+        Проверяет, встречается ли термин в транскрипции, по найденным упоминаниям.
+        
+        Если термин начинается в какой-то позиции текста, то в этой позиции найден он сам
+        или более длинный термин с тем же началом, поэтому достаточно проверить вхождение в упоминания.
+        """
+        term = self._lowered_terms[term]
+        return any(term in mention for mention in mentions)
+    
     def _match_characters(
         self, 
         scene: Dict[str, Any], 
         storyline: UserStoryline, 
-        character_map: Dict[str, Character]
+        character_map: Dict[str, Character],
+        mentions: set,
+        character_similarities: np.ndarray,
+        character_index: Dict[str, int]
     ) -> Dict[str, float]:
         """
         Находит совпадения по персонажам в сцене.
@@ -525,6 +934,9 @@ class StorylineMatcher:
             scene: Данные сцены
             storyline: Данные сюжета
             character_map: Словарь персонажей
+            mentions: Упоминания терминов сюжета в транскрипции (см. _compile_terms_pattern)
+            character_similarities: Косинусное сходство транскрипции сцены с описаниями персонажей
+            character_index: Индекс персонажа в character_similarities
             
         Returns:
             Словарь с оценками совпадения по каждому персонажу
@@ -533,52 +945,52 @@ class StorylineMatcher:
         result = {}
         
         if not transcript:
-            logger.info(f"Сцена {scene['id']} не имеет транскрипции для анализа персонажей")
+            logger.debug("Сцена %s не имеет транскрипции для анализа персонажей", scene['id'])
             return result
             
-        logger.info(f"Анализ персонажей для сцены {scene['id']} с транскрипцией длиной {len(transcript)} символов")
+        logger.debug("Анализ персонажей для сцены %s с транскрипцией длиной %s символов", scene['id'], len(transcript))
         
         for char_name in storyline.characters:
             if char_name in character_map:
                 # Базовая проверка на упоминание имени
-                if char_name.lower() in transcript.lower():
+                if self._is_mentioned(char_name, mentions):
                     result[char_name] = 0.8  # Высокая оценка если имя упомянуто
-                    logger.info(f"Персонаж '{char_name}' напрямую упомянут в сцене {scene['id']}, оценка: 0.8")
+                    logger.debug("Персонаж '%s' напрямую упомянут в сцене %s, оценка: 0.8", char_name, scene['id'])
                 else:
                     # Проверяем ключевые слова персонажа
                     char_keywords = character_map[char_name].keywords
-                    matched_keywords = [kw for kw in char_keywords if kw.lower() in transcript.lower()]
+                    matched_keywords = [kw for kw in char_keywords if self._is_mentioned(kw, mentions)]
                     
                     if matched_keywords:
                         # Оценка зависит от доли найденных ключевых слов
                         match_score = 0.5 * len(matched_keywords) / len(char_keywords)
                         result[char_name] = match_score
-                        logger.info(f"Персонаж '{char_name}' связан с {len(matched_keywords)}/{len(char_keywords)} ключевыми словами в сцене {scene['id']}, оценка: {match_score:.4f}")
+                        logger.debug("Персонаж '%s' связан с %s/%s ключевыми словами в сцене %s, оценка: %.4f", char_name, len(matched_keywords), len(char_keywords), scene['id'], match_score)
                     else:
                         # Семантическое сравнение описания персонажа и транскрипции
                         char_description = character_map[char_name].description
                         
                         # Если есть и описание, и транскрипция
                         if char_description and transcript:
-                            logger.info(f"Выполняем семантическое сравнение для персонажа '{char_name}' в сцене {scene['id']}")
-                            char_emb = self._get_text_embedding(char_description)
-                            transcript_emb = self._get_text_embedding(transcript)
-                            
-                            semantic_similarity = cosine_similarity(char_emb, transcript_emb)[0][0]
+                            logger.debug("Выполняем семантическое сравнение для персонажа '%s' в сцене %s", char_name, scene['id'])
+                            semantic_similarity = float(character_similarities[character_index[char_name]])
                             sem_score = semantic_similarity * 0.4
                             result[char_name] = sem_score
-                            logger.info(f"Семантическое сходство для персонажа '{char_name}': {semantic_similarity:.4f}, итоговая оценка: {sem_score:.4f}")
+                            logger.debug("Семантическое сходство для персонажа '%s': %.4f, итоговая оценка: %.4f", char_name, semantic_similarity, sem_score)
                         else:
                             result[char_name] = 0.0
-                            logger.info(f"Персонаж '{char_name}' не имеет ключевых слов или семантического сходства с сценой {scene['id']}")
+                            logger.debug("Персонаж '%s' не имеет ключевых слов или семантического сходства с сценой %s", char_name, scene['id'])
         
-        logger.info(f"Найдено {len(result)} совпадений персонажей для сцены {scene['id']}")
+        logger.debug("Найдено %s совпадений персонажей для сцены %s", len(result), scene['id'])
         return result
     
     def _match_keywords(
         self, 
         scene: Dict[str, Any], 
-        keywords: List[str]
+        keywords: List[str],
+        mentions: set,
+        keyword_similarities: np.ndarray,
+        keyword_index: Dict[str, int]
     ) -> Dict[str, float]:
         """
         Находит совпадения по ключевым словам в сцене.
@@ -586,6 +998,9 @@ class StorylineMatcher:
         Args:
             scene: Данные сцены
             keywords: Ключевые слова для поиска
+            mentions: Упоминания терминов сюжета в транскрипции (см. _compile_terms_pattern)
+            keyword_similarities: Косинусное сходство транскрипции сцены со всеми ключевыми словами
+            keyword_index: Индекс ключевого слова в keyword_similarities
             
         Returns:
             Словарь с оценками совпадения по каждому ключевому слову
@@ -594,31 +1009,29 @@ class StorylineMatcher:
         result = {}
         
         if not transcript:
-            logger.info(f"Сцена {scene['id']} не имеет транскрипции для анализа ключевых слов")
+            logger.debug("Сцена %s не имеет транскрипции для анализа ключевых слов", scene['id'])
             return result
             
-        logger.info(f"Анализ {len(keywords)} ключевых слов для сцены {scene['id']}")
+        logger.debug("Анализ %s ключевых слов для сцены %s", len(keywords), scene['id'])
         
         for keyword in keywords:
             # Точное совпадение
-            if keyword.lower() in transcript.lower():
+            if self._is_mentioned(keyword, mentions):
                 result[keyword] = 0.8
-                logger.info(f"Точное совпадение ключевого слова '{keyword}' в сцене {scene['id']}, оценка: 0.8")
+                logger.debug("Точное совпадение ключевого слова '%s' в сцене %s, оценка: 0.8", keyword, scene['id'])
             else:
                 # Семантическое сравнение ключевого слова и транскрипции
                 if transcript:
-                    logger.info(f"Семантическое сравнение для ключевого слова '{keyword}' в сцене {scene['id']}")
-                    kw_emb = self._get_text_embedding(keyword)
-                    transcript_emb = self._get_text_embedding(transcript)
-                    
-                    semantic_similarity = cosine_similarity(kw_emb, transcript_emb)[0][0]
+                    logger.debug("Семантическое сравнение для ключевого слова '%s' в сцене %s", keyword, scene['id'])
+                    semantic_similarity = float(keyword_similarities[keyword_index[keyword]])
                     sem_score = semantic_similarity * 0.5
                     result[keyword] = sem_score
                     
                     if sem_score > 0.25:  # Логируем только значимые совпадения
-                        logger.info(f"Семантическое сходство для ключевого слова '{keyword}': {semantic_similarity:.4f}, итоговая оценка: {sem_score:.4f}")
+                        logger.debug("Семантическое сходство для ключевого слова '%s': %.4f, итоговая оценка: %.4f", keyword, semantic_similarity, sem_score)
                 else:
                     result[keyword] = 0.0
         
-        logger.info(f"Найдено {len([k for k, v in result.items() if v > 0.25])} значимых совпадений ключевых слов для сцены {scene['id']}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Найдено %s значимых совпадений ключевых слов для сцены %s", sum(v > 0.25 for v in result.values()), scene['id'])
         return result 
\ No newline at end of file
@@ -1,21 +1,149 @@
+import atexit
 import os
-import json
 import logging
+import queue
+import sqlite3
 import threading
-import glob
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения статусов задач
-_task_status = {}
-_task_lock = threading.Lock()
+# Статусы задач хранятся в нескольких сегментах со своими блокировками, чтобы опросы статуса
+# из HTTP-обработчиков и обновления прогресса из потоков анализа разных задач не ждали друг друга.
+# Записи о задачах не изменяются на месте, а всегда заменяются новым словарем, поэтому чтение
+# одной записи через dict.get безопасно и без блокировки; блокировка нужна только для изменений
+_TASK_SHARDS = 16
+_task_shards: List[Tuple[Dict[str, Dict[str, Any]], threading.Lock]] = [
+    ({}, threading.Lock()) for _ in range(_TASK_SHARDS)
+]
+
+# Задачи, для которых недавно не нашлось файла результатов (task_id -> время проверки), чтобы
+# частые опросы несуществующих задач не обращались к диску. Запись устаревает через _NOT_FOUND_TTL
+# секунд, так как результаты может записать и другой процесс сервиса
+_not_found: "OrderedDict[str, float]" = OrderedDict()
+_NOT_FOUND_MAX_SIZE = 4096
+_NOT_FOUND_TTL = 5.0
+_not_found_lock = threading.Lock()
+
+# Задачи, результаты которых сейчас загружены в память (в порядке последнего обращения). Записанные на диск
+# результаты сверх _LOADED_RESULTS_MAX_SIZE выгружаются и читаются из файла снова при следующем запросе
+_loaded_results: "OrderedDict[str, None]" = OrderedDict()
+_LOADED_RESULTS_MAX_SIZE = int(os.getenv("TASK_RESULTS_CACHE_SIZE", "64"))
+_loaded_results_lock = threading.Lock()
+
+# Минимальное изменение прогресса и минимальный интервал (в секундах) между обновлениями статуса "processing"
+_PROGRESS_MIN_DELTA = 0.01
+_PROGRESS_MIN_INTERVAL = 0.5
 _RESULTS_DIR = "/app/shared-data/results"
 _SCENES_WITH_AUDIO_DIR = "/app/shared-data/scenes-with-audio"
 _SCENES_WITH_FRAMES_DIR = "/app/shared-data/scenes-with-frames"
-_AUDIO_CHECKPOINTS_DIR = "/app/shared-data/audio-checkpoints"
-_FRAME_CHECKPOINTS_DIR = "/app/shared-data/frame-checkpoints"
+_CHECKPOINTS_DIR = "/app/shared-data/checkpoints"
+
+# Открытые соединения с базами чекпоинтов (task_id -> (соединение, блокировка)), не более
+# _CHECKPOINT_DBS_MAX_OPEN одновременно; давно не использовавшиеся закрываются
+_checkpoint_dbs: "OrderedDict[str, Tuple[sqlite3.Connection, threading.Lock]]" = OrderedDict()
+_CHECKPOINT_DBS_MAX_OPEN = 32
+_checkpoint_dbs_lock = threading.Lock()
+
+# Последние сохраненные/прочитанные чекпоинты ((task_id, scene_id, kind) -> сериализованный JSON),
+# чтобы повторные загрузки одной сцены не обращались к базе. Храним байты, а не словари, чтобы
+# изменения возвращенного результата вызывающим кодом не попадали в кэш
+_checkpoint_cache: "OrderedDict[Tuple[str, str, str], bytes]" = OrderedDict()
+_CHECKPOINT_CACHE_MAX_SIZE = 1024
+_checkpoint_cache_lock = threading.Lock()
+
+# Опции orjson для всех сохраняемых данных: ключи-не-строки (например, номера сцен) и массивы numpy
+# из результатов анализа сериализуются напрямую, без предварительного преобразования
+_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# Каталоги, уже созданные в этом процессе (чтобы не вызывать makedirs на каждый чекпоинт)
+_ensured_dirs = set()
+_ensured_dirs_lock = threading.Lock()
+
+def _ensure_dir(path: str) -> None:
+    """Создает каталог, если он еще не создавался в этом процессе"""
+    if path in _ensured_dirs:
+        return
+    with _ensured_dirs_lock:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
+
+def _write_json(path: str, data: Any) -> None:
+    """
+    Сериализует данные в JSON через orjson (UTF-8, компактно, без отступов) и атомарно записывает в файл:
+    сначала во временный файл в том же каталоге, затем os.replace, чтобы при падении
+    процесса не оставался наполовину записанный JSON
+    """
+    _write_bytes(path, orjson.dumps(data, option=_JSON_OPTIONS))
+
+def _write_bytes(path: str, payload: bytes) -> None:
+    """Атомарно записывает готовые байты в файл (временный файл + os.replace)"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _writer_loop() -> None:
+    """Фоновый поток записи: сохраняет на диск результаты, поставленные в очередь save_result"""
+    while True:
+        task_id, path, payload, result = _writer_queue.get()
+        try:
+            _write_bytes(path, payload)
+            _mark_result_persisted(task_id, path, result)
+            logger.info(f"Результаты задачи {task_id} сохранены в {path}")
+        except Exception as e:
+            # Статус "completed" уже мог быть отдан клиентам, поэтому не меняем его: результат остается
+            # в памяти (без _path он не выгружается), но после перезапуска сервиса будет недоступен
+            logger.error(f"Ошибка при сохранении результатов для задачи {task_id} в файл: {str(e)}")
+        finally:
+            _writer_queue.task_done()
+
+def flush_writer() -> None:
+    """Дожидается записи на диск всех результатов из очереди фонового потока"""
+    _writer_queue.join()
+
+# Запись файлов результатов выполняется в отдельном потоке, чтобы не задерживать поток анализа;
+# при завершении процесса дожидаемся записи всего, что осталось в очереди
+_writer_queue: "queue.Queue[Tuple[str, str, bytes, Dict[str, Any]]]" = queue.Queue()
+_writer_thread = threading.Thread(target=_writer_loop, name="results-writer", daemon=True)
+_writer_thread.start()
+atexit.register(flush_writer)
+
+def _read_json(path: str) -> Any:
+    """Читает JSON-файл через orjson"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def _load_result_file(file_path: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Загружает файл результатов анализа.
+    
+    Returns:
+        Пара (task_id, результат) или None, если файл не удалось прочитать
+    """
+    try:
+        # Извлекаем task_id из имени файла
+        task_id = os.path.basename(file_path).split('.')[0]
+        
+        # Загружаем содержимое файла
+        result = _read_json(file_path)
+        
+        logger.info(f"Загружены результаты для задачи {task_id}")
+        return task_id, result
+    
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке результатов из файла {file_path}: {str(e)}")
+        return None
 
 def init_task_status_from_files():
     """
@@ -24,111 +152,243 @@ def init_task_status_from_files():
     """
     try:
         # Создаем каталоги для результатов, если они не существуют
-        os.makedirs(_RESULTS_DIR, exist_ok=True)
-        os.makedirs(_SCENES_WITH_AUDIO_DIR, exist_ok=True)
-        os.makedirs(_SCENES_WITH_FRAMES_DIR, exist_ok=True)
-        os.makedirs(_AUDIO_CHECKPOINTS_DIR, exist_ok=True)
-        os.makedirs(_FRAME_CHECKPOINTS_DIR, exist_ok=True)
+        _ensure_dir(_RESULTS_DIR)
+        _ensure_dir(_SCENES_WITH_AUDIO_DIR)
+        _ensure_dir(_SCENES_WITH_FRAMES_DIR)
+        _ensure_dir(_CHECKPOINTS_DIR)
         
-        # Ищем все JSON файлы в каталоге результатов
-        result_files = glob.glob(os.path.join(_RESULTS_DIR, "*.json"))
+        # Сами результаты не читаем: они загружаются из файла (_path) при первом запросе статуса задачи,
+        # чтобы при запуске не держать в памяти все когда-либо полученные результаты.
+        # Каталог обходим одним проходом scandir (тип файла известен без отдельного stat)
+        loaded_at = time.time()
+        registered = 0
+        by_shard: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        with os.scandir(_RESULTS_DIR) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json') or entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                task_id = entry.name.split('.')[0]
+                by_shard.setdefault(_shard_index(task_id), {})[task_id] = {
+                    "status": "completed",
+                    "result": None,
+                    "message": "Анализ завершен. Загружено из сохраненного файла.",
+                    "progress": 1.0,
+                    "last_updated_ts": loaded_at,
+                    "_path": entry.path
+                }
+                registered += 1
         
-        logger.info(f"Найдено {len(result_files)} файлов с результатами анализа")
+        for shard_index, statuses in by_shard.items():
+            shard_status, shard_lock = _task_shards[shard_index]
+            with shard_lock:
+                shard_status.update(statuses)
         
-        for file_path in result_files:
-            try:
-                # Извлекаем task_id из имени файла
-                task_id = os.path.basename(file_path).split('.')[0]
-                
-                # Загружаем содержимое файла
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    result = json.load(f)
-                
-                # Устанавливаем статус как завершенный
-                with _task_lock:
-                    _task_status[task_id] = {
-                        "status": "completed",
-                        "result": result,
-                        "message": "Анализ завершен. Загружено из сохраненного файла.",
-                        "progress": 1.0,
-                        "last_updated": datetime.now().isoformat()
-                    }
-                
-                logger.info(f"Загружены результаты для задачи {task_id}")
-            
-            except Exception as e:
-                logger.error(f"Ошибка при загрузке результатов из файла {file_path}: {str(e)}")
+        logger.info(f"Найдено {registered} файлов с результатами анализа")
     
     except Exception as e:
         logger.error(f"Ошибка при инициализации статусов задач: {str(e)}")
 
+def _shard_index(task_id: str) -> int:
+    """Номер сегмента статусов для задачи"""
+    return hash(task_id) % _TASK_SHARDS
+
+def _get_shard(task_id: str) -> Tuple[Dict[str, Dict[str, Any]], threading.Lock]:
+    """Сегмент статусов (словарь и его блокировка), в котором хранится задача"""
+    return _task_shards[_shard_index(task_id)]
+
+def _is_known_missing(task_id: str) -> bool:
+    """Проверяет, не искали ли недавно файл результатов этой задачи безуспешно"""
+    with _not_found_lock:
+        checked_at = _not_found.get(task_id)
+    return checked_at is not None and time.monotonic() - checked_at < _NOT_FOUND_TTL
+
+def _remember_missing(task_id: str) -> None:
+    """Запоминает, что файла результатов задачи нет"""
+    with _not_found_lock:
+        _not_found[task_id] = time.monotonic()
+        _not_found.move_to_end(task_id)
+        while len(_not_found) > _NOT_FOUND_MAX_SIZE:
+            _not_found.popitem(last=False)
+
+def _forget_missing(task_id: str) -> None:
+    """Убирает задачу из кэша отсутствующих"""
+    with _not_found_lock:
+        _not_found.pop(task_id, None)
+
+def _touch_loaded_result(task_id: str) -> None:
+    """
+    Отмечает, что результат задачи загружен в память. Если таких задач больше _LOADED_RESULTS_MAX_SIZE,
+    у давно не запрашивавшихся результат выгружается: в записи остается только путь к файлу (_path),
+    и при следующем запросе результат снова читается с диска
+    """
+    with _loaded_results_lock:
+        _loaded_results[task_id] = None
+        _loaded_results.move_to_end(task_id)
+        evicted = []
+        while len(_loaded_results) > _LOADED_RESULTS_MAX_SIZE:
+            evicted.append(_loaded_results.popitem(last=False)[0])
+    
+    for evicted_id in evicted:
+        shard_status, shard_lock = _get_shard(evicted_id)
+        with shard_lock:
+            entry = shard_status.get(evicted_id)
+            if entry is not None and entry.get("result") is not None and "_path" in entry:
+                shard_status[evicted_id] = {**entry, "result": None}
+
+def _mark_result_persisted(task_id: str, path: str, result: Dict[str, Any]) -> None:
+    """
+    Запоминает файл записанного результата, после чего результат можно выгружать из памяти.
+    Путь добавляется, только если в записи задачи по-прежнему тот же объект результата, что был записан
+    """
+    shard_status, shard_lock = _get_shard(task_id)
+    with shard_lock:
+        entry = shard_status.get(task_id)
+        if entry is None or entry.get("result") is not result or "_path" in entry:
+            return
+        shard_status[task_id] = {**entry, "_path": path}
+    _touch_loaded_result(task_id)
+
 def get_analysis_status(task_id: str) -> Dict[str, Any]:
     """Получить статус задачи анализа"""
-    with _task_lock:
-        if task_id not in _task_status:
-            # Проверяем, есть ли сохраненный файл результатов для этой задачи
+    entry = _get_task_entry(task_id)
+    if "last_updated_ts" not in entry:
+        return entry
+    
+    # Время обновления хранится как timestamp и форматируется только при отдаче статуса
+    status_info = dict(entry)
+    status_info.pop("_path", None)
+    status_info["last_updated"] = datetime.fromtimestamp(status_info.pop("last_updated_ts")).isoformat()
+    return status_info
+
+def _get_task_entry(task_id: str) -> Dict[str, Any]:
+    """Запись о задаче из памяти (при необходимости результат загружается из файла)"""
+    shard_status, shard_lock = _get_shard(task_id)
+    
+    # Частый случай (задача в памяти, результат не нужно читать) обслуживаем без блокировки сегмента
+    entry = shard_status.get(task_id)
+    if entry is not None and (entry.get("result") is not None or "_path" not in entry):
+        return entry
+    
+    with shard_lock:
+        entry = shard_status.get(task_id)
+        if entry is None:
+            if _is_known_missing(task_id):
+                return {"status": "not_found", "message": "Задача не найдена"}
+            
+            # Проверяем, есть ли сохраненный файл результатов для этой задачи (например, от другого процесса)
             result_path = os.path.join(_RESULTS_DIR, f"{task_id}.json")
-            if os.path.exists(result_path):
-                try:
-                    with open(result_path, 'r', encoding='utf-8') as f:
-                        result = json.load(f)
-                    
-                    # Устанавливаем статус как завершенный
-                    _task_status[task_id] = {
-                        "status": "completed",
-                        "result": result,
-                        "message": "Анализ завершен. Загружено из сохраненного файла.",
-                        "progress": 1.0,
-                        "last_updated": datetime.now().isoformat()
-                    }
-                    return _task_status[task_id]
-                except Exception as e:
-                    logger.error(f"Ошибка при загрузке результатов для задачи {task_id}: {str(e)}")
+            if not os.path.exists(result_path):
+                _remember_missing(task_id)
+                return {"status": "not_found", "message": "Задача не найдена"}
             
+            # Регистрируем задачу как завершенную, результат читается ниже
+            entry = {
+                "status": "completed",
+                "result": None,
+                "message": "Анализ завершен. Загружено из сохраненного файла.",
+                "progress": 1.0,
+                "last_updated_ts": time.time(),
+                "_path": result_path
+            }
+            shard_status[task_id] = entry
+        
+        result_path = entry.get("_path")
+        if result_path is None or entry.get("result") is not None:
+            return entry
+    
+    # Выгруженный или еще не прочитанный результат читаем вне блокировки сегмента
+    loaded = _load_result_file(result_path)
+    with shard_lock:
+        entry = shard_status.get(task_id)
+        if entry is None:
+            return {"status": "not_found", "message": "Задача не найдена"}
+        if entry.get("_path") != result_path or entry.get("result") is not None:
+            # Статус задачи успели обновить, пока читался файл
+            return entry
+        if loaded is None:
+            del shard_status[task_id]
             return {"status": "not_found", "message": "Задача не найдена"}
         
-        return _task_status[task_id]
+        entry = {**entry, "result": loaded[1]}
+        shard_status[task_id] = entry
+    
+    _touch_loaded_result(task_id)
+    return entry
 
 def set_task_status(task_id: str, status: str, message: str = "", progress: float = 0.0) -> None:
     """Установить статус задачи анализа"""
-    with _task_lock:
-        _task_status[task_id] = {
+    shard_status, shard_lock = _get_shard(task_id)
+    now = time.time()
+    
+    # Частые обновления прогресса (например, на каждую сцену) пропускаем, если прогресс изменился
+    # меньше чем на _PROGRESS_MIN_DELTA и с прошлого обновления прошло меньше _PROGRESS_MIN_INTERVAL секунд.
+    # Чтение словаря без блокировки безопасно: запись о задаче всегда заменяется целиком
+    if status == "processing":
+        previous = shard_status.get(task_id)
+        if (previous is not None and previous["status"] == "processing"
+                and abs(progress - previous["progress"]) < _PROGRESS_MIN_DELTA
+                and now - previous["last_updated_ts"] < _PROGRESS_MIN_INTERVAL):
+            return
+    
+    _forget_missing(task_id)
+    with shard_lock:
+        shard_status[task_id] = {
             "status": status,
             "message": message,
             "progress": progress,
-            "last_updated": datetime.now().isoformat()
+            "last_updated_ts": now
         }
         
 def save_result(task_id: str, result: Dict[str, Any]) -> None:
     """
     Сохраняет результаты анализа в JSON-файл и обновляет статус задачи.
+    Результаты сериализуются сразу, а запись файла выполняет фоновый поток (см. flush_writer).
     
     Args:
         task_id: Идентификатор задачи
         result: Результаты анализа
     """
     try:
-        # Сохраняем результаты в JSON-файл
+        # Сериализуем результаты сразу, чтобы ошибка сериализации попала в статус задачи
         result_path = os.path.join(_RESULTS_DIR, f"{task_id}.json")
-        with open(result_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        payload = orjson.dumps(result, option=_JSON_OPTIONS)
         
-        # Обновляем статус как "завершено" и включаем результаты
-        with _task_lock:
-            _task_status[task_id] = {
+        # Обновляем статус как "завершено" и включаем результаты. Запись сохраняется до постановки
+        # файла в очередь, чтобы фоновый поток после записи нашел ее и добавил путь к файлу (_path)
+        _forget_missing(task_id)
+        shard_status, shard_lock = _get_shard(task_id)
+        with shard_lock:
+            shard_status[task_id] = {
                 "status": "completed",
                 "result": result,
                 "message": "Анализ видео успешно завершен",
                 "progress": 1.0,
-                "last_updated": datetime.now().isoformat()
+                "last_updated_ts": time.time()
             }
         
-        logger.info(f"Результаты задачи {task_id} сохранены в {result_path}")
+        # Запись файла выполняет фоновый поток
+        _writer_queue.put((task_id, result_path, payload, result))
         
     except Exception as e:
         logger.error(f"Ошибка при сохранении результатов для задачи {task_id}: {str(e)}")
         set_task_status(task_id, "error", f"Ошибка при сохранении результатов: {str(e)}", 0.0)
 
+def load_saved_result(task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Загружает ранее сохраненный результат анализа задачи из файла.
+    
+    Args:
+        task_id: Идентификатор задачи
+        
+    Returns:
+        Результаты анализа или None, если файла нет или его не удалось прочитать
+    """
+    result_path = os.path.join(_RESULTS_DIR, f"{task_id}.json")
+    if not os.path.exists(result_path):
+        return None
+    loaded = _load_result_file(result_path)
+    return loaded[1] if loaded is not None else None
+
 def save_scenes_with_audio(task_id: str, scenes_with_audio: List[Dict[str, Any]]) -> None:
     """
     Сохраняет результаты анализа аудио сцен в JSON-файл.
@@ -139,12 +399,11 @@ def save_scenes_with_audio(task_id: str, scenes_with_audio: List[Dict[str, Any]]
     """
     try:
         # Создаем директорию, если она не существует
-        os.makedirs(_SCENES_WITH_AUDIO_DIR, exist_ok=True)
+        _ensure_dir(_SCENES_WITH_AUDIO_DIR)
         
         # Сохраняем результаты в JSON-файл
         output_path = os.path.join(_SCENES_WITH_AUDIO_DIR, f"{task_id}.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(scenes_with_audio, f, ensure_ascii=False, indent=2)
+        _write_json(output_path, scenes_with_audio)
         
         logger.info(f"Scenes with audio analysis for task {task_id} saved to {output_path}")
         
@@ -161,18 +420,90 @@ def save_scenes_with_frames(task_id: str, scenes_with_frames: List[Dict[str, Any
     """
     try:
         # Создаем директорию, если она не существует
-        os.makedirs(_SCENES_WITH_FRAMES_DIR, exist_ok=True)
+        _ensure_dir(_SCENES_WITH_FRAMES_DIR)
         
         # Сохраняем результаты в JSON-файл
         output_path = os.path.join(_SCENES_WITH_FRAMES_DIR, f"{task_id}.json")
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(scenes_with_frames, f, ensure_ascii=False, indent=2)
+        _write_json(output_path, scenes_with_frames)
         
         logger.info(f"Scenes with frame analysis for task {task_id} saved to {output_path}")
         
     except Exception as e:
         logger.error(f"Ошибка при сохранении анализа кадров сцен для задачи {task_id}: {str(e)}")
 
+def _get_checkpoint_db(task_id: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """
+    Возвращает открытое соединение с базой чекпоинтов задачи и блокировку для него.
+    Все чекпоинты задачи хранятся в одном файле {task_id}.db вместо отдельного JSON на каждую сцену
+    """
+    with _checkpoint_dbs_lock:
+        entry = _checkpoint_dbs.get(task_id)
+        if entry is not None:
+            _checkpoint_dbs.move_to_end(task_id)
+            return entry
+        
+        _ensure_dir(_CHECKPOINTS_DIR)
+        connection = sqlite3.connect(
+            os.path.join(_CHECKPOINTS_DIR, f"{task_id}.db"),
+            isolation_level=None,
+            check_same_thread=False
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS ck ("
+            "scene_id TEXT, kind TEXT, blob BLOB, ts REAL, PRIMARY KEY (scene_id, kind))"
+        )
+        entry = (connection, threading.Lock())
+        _checkpoint_dbs[task_id] = entry
+        
+        # Закрываем соединения давно не использовавшихся задач
+        while len(_checkpoint_dbs) > _CHECKPOINT_DBS_MAX_OPEN:
+            _, (old_connection, old_lock) = _checkpoint_dbs.popitem(last=False)
+            with old_lock:
+                old_connection.close()
+        return entry
+
+def _cache_checkpoint(key: Tuple[str, str, str], blob: bytes) -> None:
+    """Помещает сериализованный чекпоинт в LRU-кэш"""
+    with _checkpoint_cache_lock:
+        _checkpoint_cache[key] = blob
+        _checkpoint_cache.move_to_end(key)
+        if len(_checkpoint_cache) > _CHECKPOINT_CACHE_MAX_SIZE:
+            _checkpoint_cache.popitem(last=False)
+
+def _save_checkpoint(kind: str, task_id: str, scene_id: str, result: Dict[str, Any]) -> None:
+    """Сохраняет чекпоинт вида kind ('audio' или 'frame') для одной сцены"""
+    blob = orjson.dumps(result, option=_JSON_OPTIONS)
+    connection, lock = _get_checkpoint_db(task_id)
+    with lock:
+        connection.execute(
+            "INSERT OR REPLACE INTO ck (scene_id, kind, blob, ts) VALUES (?, ?, ?, ?)",
+            (scene_id, kind, blob, time.time())
+        )
+    _cache_checkpoint((task_id, scene_id, kind), blob)
+
+def _load_checkpoint(kind: str, task_id: str, scene_id: str) -> Optional[Dict[str, Any]]:
+    """Загружает чекпоинт вида kind ('audio' или 'frame') для сцены или None, если его нет"""
+    key = (task_id, scene_id, kind)
+    with _checkpoint_cache_lock:
+        blob = _checkpoint_cache.get(key)
+        if blob is not None:
+            _checkpoint_cache.move_to_end(key)
+    
+    if blob is None:
+        connection, lock = _get_checkpoint_db(task_id)
+        with lock:
+            row = connection.execute(
+                "SELECT blob FROM ck WHERE scene_id = ? AND kind = ?", (scene_id, kind)
+            ).fetchone()
+        if row is None:
+            return None
+        blob = row[0]
+        _cache_checkpoint(key, blob)
+    
+    return orjson.loads(blob)
+
 def save_audio_checkpoint(task_id: str, scene_id: str, audio_result: Dict[str, Any]) -> None:
     """
     Сохраняет результат анализа аудио для одной сцены
@@ -183,26 +514,8 @@ def save_audio_checkpoint(task_id: str, scene_id: str, audio_result: Dict[str, A
         audio_result: Результат анализа аудио
     """
     try:
-        # Создаем директорию, если она не существует
-        os.makedirs(_AUDIO_CHECKPOINTS_DIR, exist_ok=True)
-        
-        # Формируем имя файла чекпоинта
-        filename = f"{task_id}_{scene_id}.json"
-        filepath = os.path.join(_AUDIO_CHECKPOINTS_DIR, filename)
-        
-        # Добавляем метаданные к результату
-        result_with_meta = audio_result.copy()
-        result_with_meta['_meta'] = {
-            'task_id': task_id,
-            'scene_id': scene_id,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Сохраняем чекпоинт
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(result_with_meta, f, ensure_ascii=False, indent=2)
-            
-        logger.info(f"Saved audio analysis checkpoint to {filepath}")
+        _save_checkpoint("audio", task_id, scene_id, audio_result)
+        logger.info(f"Saved audio analysis checkpoint for task_id={task_id}, scene_id={scene_id}")
     except Exception as e:
         logger.error(f"Error saving audio checkpoint for task_id={task_id}, scene_id={scene_id}: {str(e)}")
 
@@ -218,23 +531,9 @@ def load_audio_checkpoint(task_id: str, scene_id: str) -> Optional[Dict[str, Any
         Результат анализа аудио или None, если чекпоинт не найден
     """
     try:
-        # Формируем имя файла чекпоинта
-        filename = f"{task_id}_{scene_id}.json"
-        filepath = os.path.join(_AUDIO_CHECKPOINTS_DIR, filename)
-        
-        # Проверяем существование файла
-        if not os.path.exists(filepath):
-            return None
-        
-        # Загружаем чекпоинт
-        with open(filepath, 'r', encoding='utf-8') as f:
-            checkpoint = json.load(f)
-        
-        # Удаляем метаданные перед возвратом
-        if '_meta' in checkpoint:
-            del checkpoint['_meta']
-            
-        logger.info(f"Loaded audio checkpoint for task_id={task_id}, scene_id={scene_id}")
+        checkpoint = _load_checkpoint("audio", task_id, scene_id)
+        if checkpoint is not None:
+            logger.info(f"Loaded audio checkpoint for task_id={task_id}, scene_id={scene_id}")
         return checkpoint
     except Exception as e:
         logger.error(f"Error loading audio checkpoint for task_id={task_id}, scene_id={scene_id}: {str(e)}")
@@ -250,26 +549,8 @@ def save_frame_checkpoint(task_id: str, scene_id: str, frame_result: Dict[str, A
         frame_result: Результат анализа кадров
     """
     try:
-        # Создаем директорию, если она не существует
-        os.makedirs(_FRAME_CHECKPOINTS_DIR, exist_ok=True)
-        
-        # Формируем имя файла чекпоинта
-        filename = f"{task_id}_{scene_id}.json"
-        filepath = os.path.join(_FRAME_CHECKPOINTS_DIR, filename)
-        
-        # Добавляем метаданные к результату
-        result_with_meta = frame_result.copy()
-        result_with_meta['_meta'] = {
-            'task_id': task_id,
-            'scene_id': scene_id,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        # Сохраняем чекпоинт
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(result_with_meta, f, ensure_ascii=False, indent=2)
-            
-        logger.info(f"Saved frame analysis checkpoint to {filepath}")
+        _save_checkpoint("frame", task_id, scene_id, frame_result)
+        logger.info(f"Saved frame analysis checkpoint for task_id={task_id}, scene_id={scene_id}")
     except Exception as e:
         logger.error(f"Error saving frame checkpoint for task_id={task_id}, scene_id={scene_id}: {str(e)}")
 
@@ -285,23 +566,9 @@ def load_frame_checkpoint(task_id: str, scene_id: str) -> Optional[Dict[str, Any
         Результат анализа кадров или None, если чекпоинт не найден
     """
     try:
-        # Формируем имя файла чекпоинта
-        filename = f"{task_id}_{scene_id}.json"
-        filepath = os.path.join(_FRAME_CHECKPOINTS_DIR, filename)
-        
-        # Проверяем существование файла
-        if not os.path.exists(filepath):
-            return None
-        
-        # Загружаем чекпоинт
-        with open(filepath, 'r', encoding='utf-8') as f:
-            checkpoint = json.load(f)
-        
-        # Удаляем метаданные перед возвратом
-        if '_meta' in checkpoint:
-            del checkpoint['_meta']
-            
-        logger.info(f"Loaded frame checkpoint for task_id={task_id}, scene_id={scene_id}")
+        checkpoint = _load_checkpoint("frame", task_id, scene_id)
+        if checkpoint is not None:
+            logger.info(f"Loaded frame checkpoint for task_id={task_id}, scene_id={scene_id}")
         return checkpoint
     except Exception as e:
         logger.error(f"Error loading frame checkpoint for task_id={task_id}, scene_id={scene_id}: {str(e)}")
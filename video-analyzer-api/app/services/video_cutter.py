@@ -1,12 +1,28 @@
+import bisect
+import heapq
+import itertools
 import os
-import json
+import orjson
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=128)
+def _load_match_json(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """
+    Разобранный JSON результатов сопоставления. Кэшируется по пути и времени изменения файла,
+    поэтому при повторном сопоставлении эпизода кэш обновляется автоматически.
+    Возвращаемый словарь общий для всех вызовов и не должен изменяться
+    """
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
 class VideoCutter:
     """
     Сервис для нарезки видео на сюжеты на основе результатов сопоставления
@@ -17,6 +33,8 @@ class VideoCutter:
         self.data_root = self._get_data_root()
         self._check_ffmpeg()
         self.target_duration = 180  # Целевая продолжительность в секундах (3 минуты)
+        # Количество сюжетов, нарезаемых одновременно (0 - по числу ядер CPU)
+        self.max_workers = int(os.getenv("VIDEO_CUT_WORKERS", "0")) or (os.cpu_count() or 4)
         
     def _get_data_root(self) -> str:
         """Получает корневую директорию данных"""
@@ -65,7 +83,11 @@ class VideoCutter:
         
         results = []
         
-        # Обрабатываем каждый сюжет
+        # Позиции ключевых кадров нужны всем сюжетам, поэтому получаем их один раз на видео
+        keyframes = self._probe_keyframes(video_path)
+        
+        # Подготавливаем нарезку каждого сюжета: (название, сцены по времени начала, путь к результату)
+        jobs = []
         for storyline in match_result.get("storylines", []):
             title = storyline.get("title")
             if not title:
@@ -86,10 +108,16 @@ class VideoCutter:
             safe_title = title.replace(" ", "_").replace("/", "_").replace("\\", "_").replace(":", "_")
             output_filename = f"{safe_title}.mp4"
             output_path = os.path.join(output_dir, output_filename)
-            
-            # Нарезаем видео
-            success = self._cut_storyline(video_path, sorted_scenes, output_path)
-            
+            jobs.append((title, sorted_scenes, output_path))
+        
+        # Нарезаем сюжеты параллельно: ffmpeg с -c copy в основном ждет диск, а потоки на время
+        # работы подпроцесса не держат GIL. Результаты собираем в исходном порядке сюжетов
+        with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), self.max_workers))) as executor:
+            successes = list(executor.map(
+                lambda job: self._cut_storyline(video_path, job[1], job[2], keyframes), jobs
+            ))
+        
+        for (title, sorted_scenes, output_path), success in zip(jobs, successes):
             if success:
                 total_duration = sum(scene.get("duration", 0) for scene in sorted_scenes)
                 results.append({
@@ -119,14 +147,15 @@ class VideoCutter:
         Returns:
             Список выбранных сцен
         """
-        # Сортируем сцены по убыванию score
-        sorted_by_score = sorted(scenes, key=lambda x: x.get("score", 0), reverse=True)
-        
         selected_scenes = []
         total_duration = 0
         
         # Сначала добавляем сцены с высоким score до целевой продолжительности
-        for scene in sorted_by_score:
+        # (обычно нужна лишь небольшая часть сцен, поэтому полностью список не сортируем)
+        by_score = self._iter_by_score(scenes)
+        # Сцена, на которой остановился отбор, не попав в него (с нее продолжится добор сцен ниже)
+        skipped_scene = None
+        for scene in by_score:
             duration = scene.get("duration", 0)
             if total_duration + duration <= self.target_duration:
                 selected_scenes.append(scene)
@@ -141,6 +170,7 @@ class VideoCutter:
                     logger.info(f"Дополнительно выбрана сцена {scene.get('scene_id')}, score: {scene.get('score', 0):.4f}, длительность: {duration:.2f} сек")
                     break
                 else:
+                    skipped_scene = scene
                     break
         
         logger.info(f"Выбрано {len(selected_scenes)}/{len(scenes)} сцен, общая длительность: {total_duration:.2f} сек (цель: {self.target_duration} сек)")
@@ -148,7 +178,8 @@ class VideoCutter:
         # Если у нас недостаточно контента (менее 80% от целевого времени), 
         # добавляем ещё сцены даже с более низким score
         if total_duration < 0.8 * self.target_duration and len(selected_scenes) < len(scenes):
-            remaining_scenes = [s for s in sorted_by_score if s not in selected_scenes]
+            # Оставшиеся сцены в порядке убывания score - продолжение того же перебора
+            remaining_scenes = itertools.chain([skipped_scene] if skipped_scene is not None else [], by_score)
             logger.info(f"Недостаточная длительность ({total_duration:.2f} < {0.8 * self.target_duration:.2f}), добавляем дополнительные сцены")
             
             for scene in remaining_scenes:
@@ -163,6 +194,16 @@ class VideoCutter:
         # Возвращаем выбранные сцены
         return selected_scenes
     
+    def _iter_by_score(self, scenes: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Перебирает сцены по убыванию score (при равном score - в исходном порядке, как sorted).
+        Куча строится за O(N), и каждая следующая сцена извлекается за O(log N) только по мере надобности
+        """
+        heap = [(-scene.get("score", 0), i) for i, scene in enumerate(scenes)]
+        heapq.heapify(heap)
+        while heap:
+            yield scenes[heapq.heappop(heap)[1]]
+    
     def _load_match_result(self, episode_id: str) -> Dict[str, Any]:
         """Загружает результаты сопоставления из JSON-файла"""
         try:
@@ -171,14 +212,39 @@ class VideoCutter:
                 logger.error(f"Файл с результатами сопоставления не найден: {match_path}")
                 return {}
                 
-            with open(match_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return _load_match_json(match_path, os.stat(match_path).st_mtime_ns)
                 
         except Exception as e:
             logger.error(f"Ошибка при загрузке результатов сопоставления: {str(e)}")
             return {}
     
-    def _cut_storyline(self, video_path: str, scenes: List[Dict[str, Any]], output_path: str) -> bool:
+    def _probe_keyframes(self, video_path: str) -> Optional[List[float]]:
+        """
+        Получает отсортированные времена ключевых кадров видеопотока через ffprobe (читаются только пакеты,
+        без декодирования). Возвращает None, если получить их не удалось
+        """
+        try:
+            output = subprocess.run(
+                ["ffprobe", "-v", "error", "-select_streams", "v:0",
+                 "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path],
+                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            ).stdout.decode("utf-8")
+            
+            keyframes = []
+            for line in output.splitlines():
+                pts_time, _, flags = line.partition(",")
+                if flags.startswith("K") and pts_time not in ("", "N/A"):
+                    keyframes.append(float(pts_time))
+            keyframes.sort()
+            
+            logger.info(f"Найдено {len(keyframes)} ключевых кадров в {video_path}")
+            return keyframes or None
+        except Exception as e:
+            logger.warning(f"Не удалось получить ключевые кадры видео {video_path}: {str(e)}")
+            return None
+    
+    def _cut_storyline(self, video_path: str, scenes: List[Dict[str, Any]], output_path: str,
+                       keyframes: Optional[List[float]] = None) -> bool:
         """
         Нарезает видео для одного сюжета с помощью ffmpeg
         
@@ -186,25 +252,34 @@ class VideoCutter:
             video_path: Путь к исходному видео
             scenes: Список сцен для нарезки
             output_path: Путь для сохранения результата
+            keyframes: Отсортированные времена ключевых кадров; начало каждой сцены сдвигается
+                на ближайший предыдущий ключевой кадр, чтобы копирование без перекодирования
+                не давало испорченных первых кадров
             
         Returns:
             True если нарезка успешна, иначе False
         """
+        segments_file = None
         try:
-            # Создаем временный файл со списком сегментов для ffmpeg
+            # Формируем список сегментов для ffmpeg (3 строки на сцену) и записываем его одним вызовом
+            lines = []
+            for scene in scenes:
+                start_time = scene.get("start_time", 0)
+                end_time = start_time + scene.get("duration", 0)
+                inpoint = start_time
+                if keyframes:
+                    keyframe_idx = bisect.bisect_right(keyframes, start_time) - 1
+                    if keyframe_idx >= 0:
+                        inpoint = keyframes[keyframe_idx]
+                lines.append(f"file '{video_path}'\ninpoint {inpoint}\noutpoint {end_time}\n")
+            
+            # Временный файл с уникальным именем, чтобы параллельные нарезки не перезаписывали списки друг друга
             temp_dir = os.path.join(self.data_root, "temp")
             os.makedirs(temp_dir, exist_ok=True)
-            
-            segments_file = os.path.join(temp_dir, f"segments_{Path(output_path).stem}.txt")
-            
-            # Записываем информацию о сегментах в файл
-            with open(segments_file, 'w', encoding='utf-8') as f:
-                for i, scene in enumerate(scenes):
-                    start_time = scene.get("start_time", 0)
-                    duration = scene.get("duration", 0)
-                    f.write(f"file '{video_path}'\n")
-                    f.write(f"inpoint {start_time}\n")
-                    f.write(f"outpoint {start_time + duration}\n")
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix=".txt", dir=temp_dir,
+                                             prefix=f"segments_{Path(output_path).stem}_", delete=False) as f:
+                segments_file = f.name
+                f.writelines(lines)
             
             # Формируем команду для ffmpeg
             cmd = [
@@ -219,14 +294,11 @@ class VideoCutter:
             
             # Запускаем процесс ffmpeg
             logger.info(f"Запуск команды ffmpeg: {' '.join(cmd)}")
-            process = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
             
             # Проверяем, что файл создан
             if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                 logger.info(f"Успешно создан файл сюжета: {output_path}")
-                # Удаляем временный файл после успешной обработки
-                if os.path.exists(segments_file):
-                    os.remove(segments_file)
                 return True
             else:
                 logger.error(f"Файл сюжета не был создан или имеет нулевой размер: {output_path}")
@@ -237,4 +309,8 @@ class VideoCutter:
             return False
         except Exception as e:
             logger.error(f"Ошибка при нарезке сюжета: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+        finally:
+            # Удаляем временный список сегментов
+            if segments_file and os.path.exists(segments_file):
+                os.remove(segments_file)
\ No newline at end of file
@@ -1,11 +1,27 @@
+import json
 import logging
+import os
+import subprocess
+from fractions import Fraction
+from functools import lru_cache
 from typing import Dict, Any
-from moviepy.editor import VideoFileClip
 
 from app.services.base_analyzer import BaseAnalyzer
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=64)
+def _run_ffprobe(video_path: str, mtime_ns: int) -> Dict[str, Any]:
+    """
+    Описание контейнера и потоков видео от ffprobe. Кэшируется по пути и времени изменения файла,
+    чтобы повторный анализ того же видео не запускал ffprobe снова
+    """
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", video_path],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ).stdout
+    return json.loads(output)
+
 class VideoMetadataExtractor(BaseAnalyzer):
     """
     Анализатор для извлечения метаданных видео (длительность, FPS, размер и т.д.)
@@ -30,20 +46,56 @@ class VideoMetadataExtractor(BaseAnalyzer):
         logger.info(f"Extracting metadata for {video_path}")
         
         try:
-            with VideoFileClip(video_path) as video:
-                metadata = {
-                    "duration": video.duration,
-                    "fps": video.fps,
-                    "size": video.size,
-                    "filename": video_path.split('/')[-1],
-                    "width": video.size[0],
-                    "height": video.size[1],
-                    "audio_present": video.audio is not None
-                }
-                
+            # Метаданные читаем через ffprobe, не открывая декодер видео
+            probe = self._probe(video_path)
+            streams = probe.get("streams", [])
+            video_stream = next(stream for stream in streams if stream.get("codec_type") == "video")
+            
+            size = [int(video_stream["width"]), int(video_stream["height"])]
+            if abs(self._get_rotation(video_stream)) in (90, 270):
+                size.reverse()
+            
+            metadata = {
+                "duration": float(probe["format"]["duration"]),
+                "fps": self._get_fps(video_stream),
+                "size": size,
+                "filename": video_path.split('/')[-1],
+                "width": size[0],
+                "height": size[1],
+                "audio_present": any(stream.get("codec_type") == "audio" for stream in streams)
+            }
+            
             logger.info(f"Extracted metadata: duration={metadata['duration']:.2f}s, fps={metadata['fps']}, size={metadata['size']}")
             return {"metadata": metadata}
         
         except Exception as e:
             logger.error(f"Error extracting video metadata: {str(e)}")
-            return {"metadata": {}} 
\ No newline at end of file
+            return {"metadata": {}}
+    
+    def _probe(self, video_path: str) -> Dict[str, Any]:
+        """Получает описание контейнера и потоков видео через ffprobe"""
+        return _run_ffprobe(video_path, os.stat(video_path).st_mtime_ns)
+    
+    def _get_fps(self, video_stream: Dict[str, Any]) -> float:
+        """Частота кадров видеопотока (средняя, если известна, иначе базовая)"""
+        for key in ("avg_frame_rate", "r_frame_rate"):
+            rate = video_stream.get(key, "0/0")
+            numerator, _, denominator = rate.partition("/")
+            if denominator and int(denominator) != 0 and int(numerator) != 0:
+                return float(Fraction(int(numerator), int(denominator)))
+            if not denominator and float(numerator) > 0:
+                return float(numerator)
+        return 0.0
+    
+    def _get_rotation(self, video_stream: Dict[str, Any]) -> int:
+        """Поворот видео в градусах из тегов или side data (для вертикальных видео с телефона)"""
+        rotation = video_stream.get("tags", {}).get("rotate")
+        if rotation is None:
+            for side_data in video_stream.get("side_data_list", []):
+                if "rotation" in side_data:
+                    rotation = side_data["rotation"]
+                    break
+        try:
+            return int(float(rotation)) if rotation is not None else 0
+        except (TypeError, ValueError):
+            return 0
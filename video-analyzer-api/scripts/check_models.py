@@ -4,12 +4,23 @@
 Запускается перед основным приложением.
 """
 
+import hashlib
+import json
 import os
+import runpy
 import sys
 import logging
+import re
 import subprocess
+import threading
 import time
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+# Предзагрузка выполняется один раз при старте контейнера: байткод импортируемых здесь модулей
+# (huggingface_hub, torch) не записываем, исходное значение восстанавливается перед запуском приложения
+_DONT_WRITE_BYTECODE = sys.dont_write_bytecode
+sys.dont_write_bytecode = True
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,211 +29,381 @@ logging.basicConfig(
 )
 logger = logging.getLogger("model_checker")
 
+# Ускоренная загрузка файлов моделей через hf_transfer (Rust). Переменная должна быть задана до первого
+# импорта huggingface_hub; без установленного пакета она приводит к ошибке загрузки, поэтому проверяем его
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    logger.warning("hf_transfer не установлен, модели будут загружаться стандартным загрузчиком huggingface_hub")
+
 # Получение переменных окружения с дефолтными значениями
 def get_env(name, default):
     """Возвращает значение переменной окружения или значение по умолчанию"""
     return os.environ.get(name, default)
 
-# Конфигурация моделей
-MODELS = {
-    "CrossEncoder": {
-        "model_id": get_env("CROSS_ENCODER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
-        "cache_path": os.path.join(os.environ.get("HF_HOME", "/root/.cache/huggingface"), 
-                                  f"models--{get_env('CROSS_ENCODER_MODEL_NAME', 'cross-encoder/ms-marco-MiniLM-L-6-v2').replace('/', '--')}")
-    },
-    "CLIP": {
-        "model_id": get_env("VISION_MODEL_NAME", "openai/clip-vit-base-patch32"),
-        "cache_path": os.path.join(os.environ.get("HF_HOME", "/root/.cache/huggingface"), 
-                                  f"models--{get_env('VISION_MODEL_NAME', 'openai/clip-vit-base-patch32').replace('/', '--')}")
-    },
-    "RuBERT": {
-        "model_id": "DeepPavlov/rubert-base-cased",
-        "cache_path": os.path.join(os.environ.get("HF_HOME", "/root/.cache/huggingface"), 
-                                  "models--DeepPavlov--rubert-base-cased")
-    },
-    "Whisper": {
-        "model_id": get_env("WHISPER_MODEL_SIZE", "small"),
-        "cache_path": os.path.join(os.environ.get("HF_HOME", "/root/.cache/huggingface"), 
-                                  f"models--Systran--faster-whisper-{get_env('WHISPER_MODEL_SIZE', 'small')}")
+# Количество моделей, проверяемых и загружаемых одновременно
+PREFETCH_CONCURRENCY = int(get_env("MODEL_PREFETCH_CONCURRENCY", "4"))
+# Количество файлов одной модели, загружаемых параллельно (например, шардов весов)
+DOWNLOAD_WORKERS = int(get_env("HF_DOWNLOAD_WORKERS", "8"))
+
+# Подгрузка файлов весов моделей в страничный кэш ОС перед запуском приложения (posix_fadvise WILLNEED),
+# чтобы первая загрузка моделей в приложении не ждала чтения с диска
+WARM_PAGE_CACHE = get_env("MODEL_WARM_PAGE_CACHE", "false").lower() in ("true", "1", "yes", "y")
+
+# Если все модели в кэше, приложение запускается с HF_HUB_OFFLINE=1: from_pretrained и faster-whisper
+# берут файлы из кэша, не обращаясь к Hugging Face Hub за проверкой обновлений при каждом запуске
+OFFLINE_WHEN_CACHED = get_env("MODEL_OFFLINE_WHEN_CACHED", "true").lower() in ("true", "1", "yes", "y")
+
+# Проверка целостности файлов весов в кэше по sha256 (дольше обычной проверки, нужна после прерванных загрузок)
+VERIFY_CACHE = get_env("MODEL_VERIFY_CACHE", "false").lower() in ("true", "1", "yes", "y")
+
+# Первый импорт из нескольких потоков одновременно может завершиться ошибкой частично
+# инициализированного модуля, поэтому импорты в загрузчиках выполняются под блокировкой
+_IMPORT_LOCK = threading.Lock()
+
+# Файлы весов для других фреймворков, которые приложению не нужны
+_IGNORED_WEIGHT_PATTERNS = ["*.h5", "*.msgpack", "*.onnx", "*.ot", "*.tflite", "tf_model*", "flax_model*", "rust_model*"]
+
+# Файлы модели faster-whisper (тот же набор, что загружает сам faster_whisper.download_model)
+_WHISPER_ALLOW_PATTERNS = ["config.json", "preprocessor_config.json", "model.bin", "tokenizer.json", "vocabulary.*"]
+
+@lru_cache(maxsize=1)
+def _hf_home():
+    """Корневой каталог кэша Hugging Face"""
+    return os.environ.get("HF_HOME", "/root/.cache/huggingface")
+
+def _cache_path(repo_id, cache_dir=None):
+    """
+    Каталог модели в кэше Hugging Face. По умолчанию это кэш хаба (HF_HOME/hub), куда загружают
+    from_pretrained и snapshot_download; cache_dir задается для загрузок с явным каталогом (Whisper)
+    """
+    cache_dir = cache_dir or os.environ.get("HF_HUB_CACHE", os.path.join(_hf_home(), "hub"))
+    return os.path.join(cache_dir, f"models--{repo_id.replace('/', '--')}")
+
+def models():
+    """
+    Конфигурация моделей (строится при вызове из текущих переменных окружения):
+    репозиторий, каталоги кэша для проверки и параметры загрузки (cache_dir, allow_patterns)
+    """
+    cross_encoder_id = get_env("CROSS_ENCODER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    clip_id = get_env("VISION_MODEL_NAME", "openai/clip-vit-base-patch32")
+    rubert_id = get_env("TEXT_MODEL_NAME", "DeepPavlov/rubert-base-cased")
+    whisper_size = get_env("WHISPER_MODEL_SIZE", "small")
+    whisper_id = whisper_size if "/" in whisper_size else f"Systran/faster-whisper-{whisper_size}"
+    return {
+        "CrossEncoder": {"model_id": cross_encoder_id, "cache_paths": [_cache_path(cross_encoder_id)]},
+        "CLIP": {"model_id": clip_id, "cache_paths": [_cache_path(clip_id)]},
+        "RuBERT": {"model_id": rubert_id, "cache_paths": [_cache_path(rubert_id)]},
+        # AudioAnalyzer загружает Whisper с download_root=HF_HOME, то есть не в кэш хаба;
+        # модель, загруженная без download_root, лежит в кэше хаба, поэтому проверяем оба каталога
+        "Whisper": {
+            "model_id": whisper_id,
+            "cache_paths": [_cache_path(whisper_id, _hf_home()), _cache_path(whisper_id)],
+            "cache_dir": _hf_home(),
+            "allow_patterns": _WHISPER_ALLOW_PATTERNS,
+            # Каталог, из которого модель загружает приложение (WhisperModel с download_root=HF_HOME):
+            # без подключения к Hugging Face Hub модель из кэша хаба приложение не найдет
+            "app_cache_path": _cache_path(whisper_id, _hf_home())
+        }
     }
-}
+
+def _manifest_path():
+    """Файл-манифест успешной предзагрузки: если он совпадает с текущей конфигурацией, кэш не проверяется"""
+    return os.path.join(_hf_home(), ".series_prefetch_ok")
+
+def _manifest(model_configs):
+    """Содержимое манифеста для конфигурации моделей: модель -> репозиторий"""
+    return {model_name: model_config["model_id"] for model_name, model_config in model_configs.items()}
+
+def _read_manifest():
+    """Читает манифест предзагрузки (None, если его нет или он поврежден)"""
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_manifest(model_configs):
+    """Атомарно записывает манифест предзагрузки (через временный файл и os.replace)"""
+    path = _manifest_path()
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_manifest(model_configs), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Не удалось записать манифест предзагрузки моделей: {str(e)}")
+
+def _has_snapshot_with_config(snapshots_dir):
+    """Есть ли в каталоге снимков хотя бы один снимок с config.json (один проход scandir без отдельного stat каталога)"""
+    try:
+        with os.scandir(snapshots_dir) as entries:
+            return any(
+                entry.is_dir() and os.path.exists(os.path.join(entry.path, "config.json"))
+                for entry in entries
+            )
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+# Файлы LFS (веса моделей) хранятся в каталоге blobs под именем, равным sha256 их содержимого
+_LFS_BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+_HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+def _has_incomplete_blobs(cache_path):
+    """Остались ли в кэше файлы прерванной загрузки (*.incomplete)"""
+    try:
+        with os.scandir(os.path.join(cache_path, "blobs")) as entries:
+            return any(entry.name.endswith(".incomplete") for entry in entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
+def _blob_matches_hash(blob_path, expected):
+    """Сравнивает sha256 файла с ожидаемым (hashlib отпускает GIL, поэтому файлы проверяются параллельно)"""
+    digest = hashlib.sha256()
+    with open(blob_path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+def _verify_blobs(cache_path):
+    """Проверяет sha256 всех файлов LFS модели в кэше"""
+    blobs_dir = os.path.join(cache_path, "blobs")
+    try:
+        with os.scandir(blobs_dir) as entries:
+            blobs = [entry.name for entry in entries if _LFS_BLOB_NAME.match(entry.name)]
+    except (FileNotFoundError, NotADirectoryError):
+        return True
+    if not blobs:
+        return True
+    with ThreadPoolExecutor(max_workers=min(len(blobs), os.cpu_count() or 1)) as executor:
+        results = executor.map(lambda name: _blob_matches_hash(os.path.join(blobs_dir, name), name), blobs)
+        corrupted = [name for name, ok in zip(blobs, results) if not ok]
+    for name in corrupted:
+        logger.warning(f"Файл {name} в кэше {cache_path} поврежден, удаляю")
+        try:
+            os.remove(os.path.join(blobs_dir, name))
+        except OSError as e:
+            logger.warning(f"Не удалось удалить поврежденный файл {name}: {str(e)}")
+    return not corrupted
 
 def check_model_exists(model_config):
-    """Проверяет, существует ли модель в кэше"""
-    cache_path = model_config["cache_path"]
-    logger.info(f"Проверка модели {model_config['model_id']} в кэше {cache_path}")
+    """Проверяет, существует ли модель в кэше (в любом из каталогов cache_paths)"""
+    logger.info(f"Проверка модели {model_config['model_id']} в кэше")
     
-    # Если есть директория модели - считаем что она существует
-    model_dir = Path(cache_path)
-    if model_dir.exists() and any(model_dir.glob("**/*")):
-        logger.info(f"✅ Модель {model_config['model_id']} найдена в кэше")
-        return True
+    for cache_path in model_config["cache_paths"]:
+        logger.debug(f"Проверка каталога {cache_path}")
+        
+        # Модель считаем загруженной, если в кэше есть снимок репозитория с config.json
+        # (проверяются только каталоги снимков, без обхода всех файлов модели)
+        if _has_snapshot_with_config(os.path.join(cache_path, "snapshots")):
+            # Прерванная загрузка оставляет *.incomplete: снимок с config.json есть, но части весов нет,
+            # поэтому модель загружается повторно (snapshot_download докачивает только недостающие файлы)
+            if _has_incomplete_blobs(cache_path):
+                logger.warning(f"В кэше {cache_path} есть незавершенная загрузка модели {model_config['model_id']}")
+                continue
+            if VERIFY_CACHE and not _verify_blobs(cache_path):
+                continue
+            logger.info(f"✅ Модель {model_config['model_id']} найдена в кэше {cache_path}")
+            return True
     
     logger.warning(f"❌ Модель {model_config['model_id']} не найдена в кэше")
     return False
 
-def load_blip2_model():
-    """Загружает модель BLIP2"""
-    start_time = time.time()
-    model_id = MODELS["BLIP2"]["model_id"]
-    logger.info(f"Загрузка модели BLIP2 {model_id} (это может занять несколько минут)...")
+def _configure_http_backend():
+    """
+    Настраивает HTTP-сессии huggingface_hub: пул соединений по числу потоков загрузки (соединения
+    переиспользуются между файлами без повторного TLS-рукопожатия) и повторы при временных ошибках сервера
+    """
+    import requests
+    from huggingface_hub import configure_http_backend
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     
-    try:
-        import torch
-        from transformers import Blip2Processor, Blip2ForConditionalGeneration
-        
-        # Определяем устройство и тип данных
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        dtype = torch.float16 if device == "cuda" else torch.float32
-        
-        logger.info(f"Загрузка процессора BLIP2...")
-        processor = Blip2Processor.from_pretrained(model_id)
-        
-        logger.info(f"Загрузка модели BLIP2 на устройство {device}...")
-        model = Blip2ForConditionalGeneration.from_pretrained(
-            model_id,
-            torch_dtype=dtype
+    def backend_factory():
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=DOWNLOAD_WORKERS,
+            pool_maxsize=DOWNLOAD_WORKERS,
+            max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[502, 503, 504])
         )
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"✅ Модель BLIP2 успешно загружена за {elapsed_time:.2f} сек.")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке модели BLIP2: {str(e)}")
-        return False
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    
+    configure_http_backend(backend_factory=backend_factory)
 
-def load_clip_model():
-    """Загружает модель CLIP"""
+def download_model(model_name, model_config):
+    """
+    Загружает файлы модели в кэш Hugging Face без создания самой модели в памяти.
+    Если allow_patterns не заданы и в репозитории есть веса в safetensors, дублирующие их *.bin не загружаются
+    """
     start_time = time.time()
-    model_id = MODELS["CLIP"]["model_id"]
-    logger.info(f"Загрузка модели CLIP {model_id}...")
+    repo_id = model_config["model_id"]
+    allow_patterns = model_config.get("allow_patterns")
+    logger.info(f"Загрузка файлов модели {model_name} ({repo_id})...")
     
     try:
-        import torch
-        from transformers import CLIPProcessor, CLIPModel
-        
-        # Определяем устройство и тип данных
-        device = get_env("VISION_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
-        compute_type = get_env("VISION_COMPUTE_TYPE", "float16" if device == "cuda" else "float32")
+        with _IMPORT_LOCK:
+            from huggingface_hub import HfApi, snapshot_download
         
-        logger.info(f"Загрузка процессора CLIP...")
-        processor = CLIPProcessor.from_pretrained(model_id)
+        ignore_patterns = None
+        if allow_patterns is None:
+            ignore_patterns = list(_IGNORED_WEIGHT_PATTERNS)
+            if any(name.endswith(".safetensors") for name in HfApi().list_repo_files(repo_id)):
+                ignore_patterns.append("*.bin")
         
-        logger.info(f"Загрузка модели CLIP на устройство {device}...")
-        model = CLIPModel.from_pretrained(
-            model_id,
-            device_map=device,
-            torch_dtype=torch.float16 if compute_type == "float16" else torch.float32
+        snapshot_download(
+            repo_id,
+            cache_dir=model_config.get("cache_dir"),
+            allow_patterns=allow_patterns,
+            ignore_patterns=ignore_patterns,
+            max_workers=DOWNLOAD_WORKERS,
+            etag_timeout=30
         )
         
         elapsed_time = time.time() - start_time
-        logger.info(f"✅ Модель CLIP успешно загружена за {elapsed_time:.2f} сек.")
+        logger.info(f"✅ Модель {model_name} успешно загружена за {elapsed_time:.2f} сек.")
         return True
     except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке модели CLIP: {str(e)}")
+        logger.error(f"❌ Ошибка при загрузке модели {model_name}: {str(e)}")
         return False
 
-def load_rubert_model():
-    """Загружает модель RuBERT"""
-    start_time = time.time()
-    model_id = MODELS["RuBERT"]["model_id"]
-    logger.info(f"Загрузка модели RuBERT {model_id}...")
-    
-    try:
-        import torch
-        from transformers import AutoTokenizer, AutoModel
-        
-        logger.info(f"Загрузка токенизатора RuBERT...")
-        tokenizer = AutoTokenizer.from_pretrained(model_id)
-        
-        logger.info(f"Загрузка модели RuBERT...")
-        model = AutoModel.from_pretrained(model_id)
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"✅ Модель RuBERT успешно загружена за {elapsed_time:.2f} сек.")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке модели RuBERT: {str(e)}")
-        return False
+def warm_page_cache(model_name, model_config):
+    """
+    Просит ядро заранее прочитать файлы весов модели в страничный кэш (без загрузки модели в память процесса).
+    Чтение идет асинхронно в ядре, поэтому функция возвращается сразу
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    warmed = 0
+    for cache_path in model_config["cache_paths"]:
+        for root, _, files in os.walk(os.path.join(cache_path, "snapshots")):
+            for name in files:
+                if not name.endswith((".safetensors", ".bin")):
+                    continue
+                try:
+                    # Файлы снимков - символические ссылки на blobs, open читает сам файл весов
+                    fd = os.open(os.path.join(root, name), os.O_RDONLY | os.O_CLOEXEC)
+                    try:
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                        warmed += 1
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logger.debug(f"Не удалось подгрузить {name} в страничный кэш: {str(e)}")
+    if warmed:
+        logger.info(f"Файлы весов модели {model_name} ({warmed}) подгружаются в страничный кэш")
 
-def load_whisper_model():
-    """Загружает модель Whisper"""
-    start_time = time.time()
-    model_size = MODELS["Whisper"]["model_id"]
-    
-    try:
-        import torch
-        
-        device = get_env("WHISPER_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
-        compute_type = get_env("WHISPER_COMPUTE_TYPE", "float16" if device == "cuda" else "int8")
-        
-        logger.info(f"Загрузка модели Whisper {model_size} на устройство {device}...")
-        
-        from faster_whisper import WhisperModel
-        
-        model = WhisperModel(
-            model_size,
-            device=device,
-            compute_type=compute_type,
-            download_root=os.environ.get("HF_HOME", "/root/.cache/huggingface")
-        )
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"✅ Модель Whisper успешно загружена за {elapsed_time:.2f} сек.")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке модели Whisper: {str(e)}")
+def _run_in_process(command):
+    """
+    Запускает Python-команду (python -m module ... или python script.py ...) в текущем интерпретаторе,
+    не тратя время на запуск нового процесса. Используется только при обычном перезапуске, когда модели
+    не загружались: huggingface_hub читает переменные окружения (HF_HUB_OFFLINE и др.) один раз при импорте,
+    поэтому после загрузок приложение запускается в новом процессе. Настройка logging этого скрипта
+    (basicConfig с тем же форматом, что и в приложении) сохраняется.
+    Возвращает False, если команду нужно запустить через exec
+    """
+    if len(command) < 2 or not os.path.basename(command[0]).startswith("python"):
         return False
-
-def load_cross_encoder_model():
-    """Загружает модель CrossEncoder"""
-    start_time = time.time()
-    model_id = MODELS["CrossEncoder"]["model_id"]
-    logger.info(f"Загрузка модели CrossEncoder {model_id}...")
-    
-    try:
-        from sentence_transformers import CrossEncoder
-        
-        logger.info(f"Загрузка модели CrossEncoder...")
-        model = CrossEncoder(model_id)
-        
-        elapsed_time = time.time() - start_time
-        logger.info(f"✅ Модель CrossEncoder успешно загружена за {elapsed_time:.2f} сек.")
-        return True
-    except Exception as e:
-        logger.error(f"❌ Ошибка при загрузке модели CrossEncoder: {str(e)}")
+    if "huggingface_hub" in sys.modules:
         return False
+    sys.dont_write_bytecode = _DONT_WRITE_BYTECODE
+    # Как и при запуске интерпретатора, первым в sys.path должен быть текущий каталог (для -m) или каталог скрипта
+    if command[1] == "-m" and len(command) > 2:
+        sys.argv = [command[2]] + command[3:]
+        sys.path[0] = os.getcwd()
+        runpy.run_module(command[2], run_name="__main__", alter_sys=True)
+        return True
+    if not command[1].startswith("-"):
+        sys.argv = command[1:]
+        sys.path[0] = os.path.dirname(os.path.abspath(command[1]))
+        runpy.run_path(command[1], run_name="__main__")
+        return True
+    return False
 
 def main():
     """Основная функция для проверки и загрузки моделей"""
     logger.info("Начало проверки моделей...")
     
-    # Проверка доступности CUDA
-    try:
-        import torch
-        cuda_available = torch.cuda.is_available()
-        if cuda_available:
-            cuda_device = torch.cuda.get_device_name(0)
-            logger.info(f"CUDA доступна: {cuda_device}")
-        else:
-            logger.warning("CUDA недоступна, будет использоваться CPU")
-    except:
-        logger.warning("Невозможно определить доступность CUDA")
+    model_configs = models()
+    # Манифест пишется только после того, как все модели оказались в кэше; если он совпадает
+    # с текущей конфигурацией, каталоги снимков не проверяются. Поиск незавершенных загрузок дешевый
+    # и выполняется всегда, а при MODEL_VERIFY_CACHE кэш проверяется полностью независимо от манифеста
+    manifest_matches = (
+        not VERIFY_CACHE
+        and _read_manifest() == _manifest(model_configs)
+        and not any(
+            _has_incomplete_blobs(cache_path)
+            for model_config in model_configs.values()
+            for cache_path in model_config["cache_paths"]
+        )
+    )
+    if manifest_matches:
+        logger.info("Все модели уже загружены (по манифесту предзагрузки)")
+        missing_models = []
+    else:
+        missing_models = [
+            (model_name, model_config) for model_name, model_config in model_configs.items()
+            if not check_model_exists(model_config)
+        ]
+    all_loaded = True
     
-    # Проверка и загрузка моделей по очереди
-    models_to_check = [
-        ("CrossEncoder", load_cross_encoder_model),
-        ("CLIP", load_clip_model),
-        ("RuBERT", load_rubert_model),
-        ("Whisper", load_whisper_model)
-    ]
+    # Если все модели уже в кэше (обычный перезапуск), сразу запускаем приложение без импорта torch
+    if missing_models:
+        try:
+            _configure_http_backend()
+        except Exception as e:
+            logger.warning(f"Не удалось настроить HTTP-сессии huggingface_hub: {str(e)}")
+        
+        # Загрузка недостающих моделей (загрузки разных моделей идут параллельно)
+        with ThreadPoolExecutor(max_workers=max(1, PREFETCH_CONCURRENCY)) as executor:
+            futures = {}
+            for model_name, model_config in missing_models:
+                logger.info(f"Начинаю загрузку модели {model_name}...")
+                futures[executor.submit(download_model, model_name, model_config)] = model_name
+            for future in as_completed(futures):
+                model_name = futures[future]
+                try:
+                    loaded = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка при загрузке модели {model_name}: {str(e)}")
+                    loaded = False
+                if not loaded:
+                    logger.error(f"Не удалось загрузить модель {model_name}.")
+                    all_loaded = False
+                    # Продолжаем с другими моделями, не останавливаемся
+        
+        # Проверка доступности CUDA (после завершения потоков загрузки, чтобы драйвер CUDA
+        # не инициализировался, пока они работают)
+        try:
+            import torch
+            cuda_available = torch.cuda.is_available()
+            if cuda_available:
+                cuda_device = torch.cuda.get_device_name(0)
+                logger.info(f"CUDA доступна: {cuda_device}")
+            else:
+                logger.warning("CUDA недоступна, будет использоваться CPU")
+        except:
+            logger.warning("Невозможно определить доступность CUDA")
+    
+    if all_loaded and not manifest_matches:
+        _write_manifest(model_configs)
+    if all_loaded and OFFLINE_WHEN_CACHED:
+        not_in_app_cache = [
+            model_name for model_name, model_config in model_configs.items()
+            if "app_cache_path" in model_config
+            and not _has_snapshot_with_config(os.path.join(model_config["app_cache_path"], "snapshots"))
+        ]
+        if not_in_app_cache:
+            logger.warning(f"Модели {', '.join(not_in_app_cache)} найдены не в том каталоге кэша, из которого их "
+                           f"загружает приложение; приложение запускается без HF_HUB_OFFLINE")
+        else:
+            os.environ.setdefault("HF_HUB_OFFLINE", "1")
     
-    for model_name, load_func in models_to_check:
-        if not check_model_exists(MODELS[model_name]):
-            logger.info(f"Начинаю загрузку модели {model_name}...")
-            if not load_func():
-                logger.error(f"Не удалось загрузить модель {model_name}.")
-                # Продолжаем с другими моделями, не останавливаемся
+    if WARM_PAGE_CACHE:
+        for model_name, model_config in model_configs.items():
+            warm_page_cache(model_name, model_config)
     
     # Все проверки пройдены, запускаем основное приложение
     logger.info("✅ Проверка моделей завершена. Запуск основного приложения...")
@@ -231,7 +412,8 @@ def main():
     if len(sys.argv) > 1:
         command = sys.argv[1:]
         logger.info(f"Запуск команды: {' '.join(command)}")
-        os.execvp(command[0], command)
+        if not _run_in_process(command):
+            os.execvp(command[0], command)
     else:
         logger.warning("Не указана команда для запуска. Завершение работы.")
 